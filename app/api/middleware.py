@@ -0,0 +1,32 @@
+import time
+
+from app.metrics import API_LATENCY
+
+class LatencyMiddleware:
+    """
+    ASGI middleware recording every HTTP request in API_LATENCY, labelled by
+    method, route template (not the raw path, to keep the series bounded) and status.
+    Streamed responses are timed until their last chunk is sent.
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            API_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status)
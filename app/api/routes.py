@@ -1,66 +1,196 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Body
-from fastapi.responses import JSONResponse
-from app.hardware.pump import PUMP_HEADS
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Body, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from app.api.streaming import LOG_FORMATS
+from app.hardware.pump import PUMP_HEADS, UPPER_LIMIT, fit_calibration
+from app.hardware.command_queue import QueueFullError
+from app.scheduler.timeline import parse_window_time
+from app.metrics import REGISTRY
+from app.events import EVENT_TYPES
+from dataclasses import asdict, replace
+import json
+from datetime import datetime, timedelta
+from pydantic import BaseModel
+from typing import List, Optional
 
-def get_router(pump, scheduler_manager, sqlite_client):
+class ScheduleItem(BaseModel):
+    head: int
+    total_dose: float
+    doses_per_day: int
+    window_start: Optional[str] = None
+    window_end: Optional[str] = None
+
+class DoseItem(BaseModel):
+    head: int
+    ml: float
+
+class CalibrationRun(BaseModel):
+    seconds: float
+    ml: float
+
+def local_time(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Time-zone aware query datetimes converted to naive local time, the way every stored time is kept.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+def get_router(command_queue, scheduler_manager, sqlite_client, dispatcher, events, consumption, columnar_archive):
+    # sqlite_client is an AsyncSQliteClient: read routes are async and never take a threadpool worker
     router = APIRouter()
 
+    def submit_command(head: int, mode: str, ml: float):
+        try:
+            return command_queue.submit(head, mode, ml)
+        except QueueFullError as e:
+            raise HTTPException(
+                status_code=429,
+                detail={"message": str(e), "queue_depth": e.depth}
+            )
+
+    def dose_error(head: int, ml: float) -> Optional[str]:
+        if head not in PUMP_HEADS:
+            return "Invalid doser ID."
+        if not (0 < ml <= UPPER_LIMIT):
+            return f"Invalid dosing amount. Must be greater than 0mL and smaller/equal to {UPPER_LIMIT}mL."
+        return None
+
+    def schedule_error(item: ScheduleItem) -> Optional[str]:
+        if item.head not in PUMP_HEADS:
+            return f"Invalid head. Must be one of {list(PUMP_HEADS)}."
+        if item.total_dose <= 0 or item.doses_per_day <= 0:
+            return "Dose and doses per day must be positive."
+        try:
+            start = parse_window_time(item.window_start or "00:00")
+            end = parse_window_time(item.window_end or "24:00")
+        except ValueError:
+            return "Window bounds must be HH:MM."
+        if start >= end:
+            return "window_start must be before window_end."
+        return None
+
+    def batch_errors(errors: List[Optional[str]]) -> None:
+        # The whole batch is rejected when any item is invalid, so nothing is half applied
+        if any(errors):
+            raise HTTPException(
+                status_code=400,
+                detail=[{"index": index, "error": error} for index, error in enumerate(errors) if error]
+            )
+
     @router.post(
             "/remaining/{head}",
             summary="Update remaining liquid",
             description="Update the remaining liquid amount for a specific doser head."
     )
-    def set_remaining(head: int, ml: float):
+    async def set_remaining(head: int, ml: float):
         """
         Set the remaining liquid amount for a specific doser head.
         """
         if head not in PUMP_HEADS:
-            raise HTTPException(status_code=400, detail="Invalid head. Must be 1 or 2.")
+            raise HTTPException(status_code=400, detail=f"Invalid head. Must be one of {list(PUMP_HEADS)}.")
         
         if ml < 0:
             raise HTTPException(status_code=400, detail="Remaining amount cannot be negative.")
         
-        sqlite_client.set_remaining(head, ml)
+        await sqlite_client.set_remaining(head, ml)
+        events.publish("remaining-changed", {"head": head, "remaining": ml})
         return JSONResponse(content=f"Set remaining amount for head {head} to {ml}mL.", status_code=200)
 
+    @router.get(
+        "/heads",
+        summary="Get pump heads",
+        description="Get the configured pump heads with their pins, calibration and driver board."
+    )
+    async def get_heads():
+        """
+        Get the configured pump head definitions.
+        """
+        return JSONResponse(content={head_id: asdict(head) for head_id, head in PUMP_HEADS.items()}, status_code=200)
+
+    @router.post(
+        "/heads/{head}/calibration",
+        summary="Calibrate a pump head",
+        description=(
+            "Fit a head's flow rate and start/stop latency to measured runs: the actual_seconds of a few raw "
+            "log entries of different lengths and the volume each one delivered. The fit is applied until "
+            "restart; copy it into the heads file to keep it."
+        )
+    )
+    async def calibrate_head(head: int, runs: List[CalibrationRun] = Body(..., embed=True)):
+        """
+        Fit and apply a head's calibration from measured runs.
+        """
+        if head not in PUMP_HEADS:
+            raise HTTPException(status_code=400, detail=f"Invalid head. Must be one of {list(PUMP_HEADS)}.")
+        try:
+            fitted = fit_calibration([(run.seconds, run.ml) for run in runs])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        PUMP_HEADS[head] = replace(PUMP_HEADS[head], **fitted)
+        return JSONResponse(content=asdict(PUMP_HEADS[head]), status_code=200)
+
     @router.get(
         "/remaining",
         summary="Get remaining liquid amounts",
         description="Get the remaining liquid amounts for all doser heads."
     )
-    def get_remaining():
+    async def get_remaining():
         """
         Get the remaining liquid amounts for all doser heads.
         """
-        remaining = sqlite_client.get_remaining()
+        remaining = await sqlite_client.get_remaining()
         return JSONResponse(content=remaining, status_code=200)
     
+    @router.post(
+        "/dose/batch",
+        summary="Send dose commands for several heads",
+        description="Validate a list of {head, ml} doses and queue them all. Returns one result per item."
+    )
+    async def send_dose_batch(doses: List[DoseItem] = Body(..., embed=True)):
+        """
+        Queue several manual doses in one request. Invalid items reject the whole batch;
+        a full head queue only rejects that item.
+        """
+        batch_errors([dose_error(dose.head, dose.ml) for dose in doses])
+
+        results = []
+        for dose in doses:
+            try:
+                command = command_queue.submit(dose.head, "Manual", dose.ml)
+                results.append({"head": dose.head, "ml": dose.ml, "status": "queued", "command_id": command.id, "queue_depth": command_queue.depth(dose.head)})
+            except QueueFullError as e:
+                results.append({"head": dose.head, "ml": dose.ml, "status": "rejected", "error": str(e), "queue_depth": e.depth})
+        return JSONResponse(content={"results": results}, status_code=200)
+
     @router.post(
         "/dose/{doser_id}",
         summary="Send a manual dose command",
         description="Send a manual dose command to a specific doser head."
     )
-    async def send_dose_task(doser_id: int, ml: float, background_tasks: BackgroundTasks):
+    async def send_dose_task(doser_id: int, ml: float):
         """
         Send a manual dose command to the specified doser head.
         """
-        if doser_id not in PUMP_HEADS:
-            raise HTTPException(status_code=400, detail="Invalid doser ID.")
+        error = dose_error(doser_id, ml)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
 
-        UPPER_LIMIT = 20
-        if not (0 < ml <= UPPER_LIMIT):
-            raise HTTPException(status_code=400, detail=f"Invalid dosing amount. Must be greater than 0mL and smaller/equal to {UPPER_LIMIT}mL.")
-        
-        background_tasks.add_task(pump.dose, doser_id, "Manual", ml)
-        return JSONResponse(content=f"Sent dose command for {ml}mL on doser {doser_id}.", status_code=200)
+        command = submit_command(doser_id, "Manual", ml)
+        return JSONResponse(
+            content={
+                "message": f"Sent dose command for {ml}mL on doser {doser_id}.",
+                "command_id": command.id,
+                "queue_depth": command_queue.depth(doser_id)
+            },
+            status_code=200
+        )
 
     @router.post(
         "/prime/{doser_id}",
         summary="Prime a doser head",
         description="Prime the specified doser head with a fixed amount."
     )
-    async def send_prime_task(doser_id: int, background_tasks: BackgroundTasks):
+    async def send_prime_task(doser_id: int):
         """
         Prime the specified doser head with a fixed amount.
         """
@@ -68,34 +198,229 @@ def get_router(pump, scheduler_manager, sqlite_client):
             raise HTTPException(status_code=400, detail="Invalid doser ID.")
         
         ml = 5.0
-        background_tasks.add_task(pump.dose, doser_id, "Primer", ml)
-        return JSONResponse(content=f"Sent command to prime {ml}mL on doser {doser_id}.", status_code=200)
+        command = submit_command(doser_id, "Primer", ml)
+        return JSONResponse(
+            content={
+                "message": f"Sent command to prime {ml}mL on doser {doser_id}.",
+                "command_id": command.id,
+                "queue_depth": command_queue.depth(doser_id)
+            },
+            status_code=200
+        )
+
+    @router.get(
+        "/commands/{command_id}",
+        summary="Get dose command status",
+        description="Get the status of a dose or prime command by its command id."
+    )
+    async def get_command(command_id: str):
+        """
+        Get the status of a dose or prime command.
+        """
+        command = command_queue.get(command_id)
+        if command is None:
+            raise HTTPException(status_code=404, detail="Unknown command ID.")
+        status = asdict(command)
+        status["queue_depth"] = command_queue.depth(command.head)
+        return JSONResponse(content=status, status_code=200)
+
+    @router.get(
+        "/cache",
+        summary="Get read cache statistics",
+        description="Get hit and miss counters for the cached remaining, schedules and today's totals."
+    )
+    async def get_cache_stats():
+        """
+        Get hit and miss counters of the storage read cache.
+        """
+        return JSONResponse(content=sqlite_client.cache_stats(), status_code=200)
+
+    @router.get(
+        "/power",
+        summary="Get power budget usage",
+        description="Get the power budget, the heads currently running and the parallelism achieved so far."
+    )
+    async def get_power():
+        """
+        Get power budget usage and achieved dosing parallelism.
+        """
+        return JSONResponse(content=dispatcher.stats(), status_code=200)
+
+    @router.get(
+        "/metrics",
+        summary="Get Prometheus metrics",
+        description="Latency histograms, queue depths and cache counters in the Prometheus text format."
+    )
+    async def get_metrics():
+        """
+        Get service metrics in the Prometheus text exposition format.
+        """
+        return PlainTextResponse(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    @router.get(
+        "/events",
+        summary="Stream live events",
+        description=(
+            "Server-Sent Events stream of dose-start, dose-complete, remaining-changed and "
+            "schedule-changed events. types is an optional comma-separated filter. A client that "
+            "falls behind gets a 'dropped' event with the number of events it missed."
+        )
+    )
+    async def stream_events(types: Optional[str] = None, keepalive: float = Query(15.0, ge=1)):
+        """
+        Stream live events as text/event-stream.
+        """
+        wanted = None
+        if types:
+            wanted = {t.strip() for t in types.split(",") if t.strip()}
+            unknown = wanted - set(EVENT_TYPES)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown event types {sorted(unknown)}. Must be in {list(EVENT_TYPES)}.")
+
+        async def stream():
+            # Subscribe inside the generator, so the finally always runs for a live subscription
+            subscription = None
+            try:
+                subscription = events.subscribe(wanted)
+                yield "retry: 1000\n\n"
+                reported = 0
+                while True:
+                    batch = await subscription.get(keepalive)
+                    if subscription.dropped > reported:
+                        yield f"event: dropped\ndata: {json.dumps({'count': subscription.dropped - reported})}\n\n"
+                        reported = subscription.dropped
+                    if not batch:
+                        yield ": keepalive\n\n"
+                    for event in batch:
+                        yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            finally:
+                if subscription is not None:
+                    events.unsubscribe(subscription)
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
     @router.get(
         "/logs",
         summary="Get raw dose reports",
-        description="Fetch all raw dosing report logs."
+        description=(
+            "Stream dosing report logs as JSON, NDJSON or CSV. Rows come in (date, time) order. "
+            "Pass limit to page through them; when more rows follow, the X-Next-Cursor response header "
+            "holds the cursor for the next page."
+        )
     )
-    def get_logs(raw: Optional[bool] = False, days: Optional[int] = 7):
+    async def get_logs(
+        raw: Optional[bool] = False,
+        days: Optional[int] = 7,
+        head: Optional[int] = None,
+        mode: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        format: str = "json"
+    ):
         """
-        Fetch all raw dosing report logs.
+        Stream dosing report logs.
         """
+        if format not in LOG_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of {', '.join(LOG_FORMATS)}.")
+        if head is not None and head not in PUMP_HEADS:
+            raise HTTPException(status_code=400, detail="Invalid head.")
+        if mode is not None and (not raw or mode not in sqlite_client.DOSE_MODES):
+            raise HTTPException(status_code=400, detail=f"Invalid mode. Raw logs only, one of {', '.join(sqlite_client.DOSE_MODES)}.")
+        if limit is not None and limit <= 0:
+            raise HTTPException(status_code=400, detail="Limit must be positive.")
+
         table_name = sqlite_client.RAW_LOGS_TABLE_NAME if raw else sqlite_client.LOGS_TABLE_NAME
-        logs = sqlite_client.fetch_all_logs(table_name=table_name, days=days)
-        return JSONResponse(content=logs, status_code=200)
+        try:
+            after = sqlite_client.decode_cursor(cursor, table_name) if cursor else None
+            columns, batches, next_key = await sqlite_client.stream_logs(
+                table_name=table_name, days=days, head=head, mode=mode, after=after, limit=limit
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        headers = {}
+        if next_key is not None:
+            headers["X-Next-Cursor"] = sqlite_client.encode_cursor(table_name, next_key)
+        formatter, media_type = LOG_FORMATS[format]
+        return StreamingResponse(formatter(columns, sqlite_client.iterate(batches)), media_type=media_type, headers=headers)
     
+    @router.get(
+        "/history",
+        summary="Get dosing history",
+        description=(
+            "Get dosed totals per time bucket, head and mode between start and end (default: the last 7 days). "
+            "Without a resolution the finest of hourly, daily or monthly that fits the range in about 500 buckets is used. "
+            "Hourly buckets come from the hourly logs and have no mode breakdown, so they can't be filtered by mode."
+        )
+    )
+    async def get_history(
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        head: Optional[int] = None,
+        mode: Optional[str] = None,
+        resolution: Optional[str] = None
+    ):
+        """
+        Get dosed totals per time bucket from the rollup tables.
+        """
+        end = local_time(end) or sqlite_client.clock.now()
+        start = local_time(start) or end - timedelta(days=7)
+        if start > end:
+            raise HTTPException(status_code=400, detail="Start must be before end.")
+        if head is not None and head not in PUMP_HEADS:
+            raise HTTPException(status_code=400, detail="Invalid head.")
+        if mode is not None and mode not in sqlite_client.DOSE_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of {', '.join(sqlite_client.DOSE_MODES)}.")
+        if resolution is None:
+            resolution = sqlite_client.history_resolution(start, end, mode=mode)
+        elif resolution not in sqlite_client.HISTORY_RESOLUTIONS:
+            raise HTTPException(status_code=400, detail=f"Invalid resolution. Must be one of {', '.join(sqlite_client.HISTORY_RESOLUTIONS)}.")
+
+        try:
+            buckets = await sqlite_client.fetch_history(resolution, start, end, head=head, mode=mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return JSONResponse(
+            content={
+                "resolution": resolution,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "buckets": buckets
+            },
+            status_code=200
+        )
+
     @router.get(
         "/totals",
         summary="Get total dosed amounts",
         description="Get the total dosed amounts for each head, including today's total."
     )
-    def get_totals():
+    async def get_totals():
         """
         Get the total dosed amounts for each head, including today's total.
         """
-        totals = sqlite_client.get_todays_total()
+        totals = await sqlite_client.get_todays_total()
         return JSONResponse(content=totals, status_code=200)
 
+    @router.get(
+        "/forecast",
+        summary="Get consumption forecast",
+        description=(
+            "Per head: today's consumption, 7 and 30 day daily averages, the trend in ml/day per day, "
+            "the projected daily use from the schedule plus average manual and primer runs, "
+            "and when the container runs dry at that rate. days adds that many days of daily consumption."
+        )
+    )
+    async def get_forecast(days: Optional[int] = 0):
+        """
+        Get per-head consumption statistics and the projected time to empty.
+        """
+        if days < 0 or days > consumption.history_days:
+            raise HTTPException(status_code=400, detail=f"days must be between 0 and {consumption.history_days}.")
+        remaining = await sqlite_client.get_remaining()
+        schedules = await sqlite_client.fetch_all_schedules()
+        return JSONResponse(content=consumption.forecast(remaining, schedules, days=days), status_code=200)
+
     @router.post(
         "/schedule",
         summary="Set dosing schedule",
@@ -104,42 +429,160 @@ def get_router(pump, scheduler_manager, sqlite_client):
     def set_schedule(
         head: int = Body(...),
         total_dose: float = Body(...),
-        doses_per_day: int = Body(...)
+        doses_per_day: int = Body(...),
+        window_start: Optional[str] = Body(None),
+        window_end: Optional[str] = Body(None)
     ):
         """
-        Set a dosing schedule for a specific head.
+        Set a dosing schedule for a specific head, optionally limited to an "HH:MM" window.
         """
-        if head not in [1, 2]:
-            raise HTTPException(status_code=400, detail="Invalid head. Must be 1 or 2.")
+        error = schedule_error(ScheduleItem(
+            head=head,
+            total_dose=total_dose,
+            doses_per_day=doses_per_day,
+            window_start=window_start,
+            window_end=window_end
+        ))
+        if error:
+            raise HTTPException(status_code=400, detail=error)
 
-        if total_dose <= 0 or doses_per_day <= 0:
-            raise HTTPException(status_code=400, detail="Dose and doses per day must be positive.")
-        
-        scheduler_manager.set_schedule(head, total_dose, doses_per_day)
+        scheduler_manager.set_schedule(head, total_dose, doses_per_day, window_start, window_end)
         return JSONResponse(content=f"Schedule set for head {head}.", status_code=200)
 
+    @router.post(
+        "/schedule/batch",
+        summary="Set dosing schedules for several heads",
+        description="Validate and set a list of schedules in one transaction. Returns one result per item."
+    )
+    def set_schedule_batch(schedules: List[ScheduleItem] = Body(..., embed=True)):
+        """
+        Set several heads' schedules at once. Either every schedule is applied or none is.
+        """
+        errors = [schedule_error(item) for item in schedules]
+        heads = [item.head for item in schedules]
+        errors = [
+            error or (f"Head {item.head} appears more than once." if heads.count(item.head) > 1 else None)
+            for item, error in zip(schedules, errors)
+        ]
+        batch_errors(errors)
+
+        scheduler_manager.set_schedules({
+            item.head: {
+                "total_dose": item.total_dose,
+                "doses_per_day": item.doses_per_day,
+                "window_start": item.window_start,
+                "window_end": item.window_end
+            }
+            for item in schedules
+        })
+        return JSONResponse(
+            content={"results": [{"head": item.head, "status": "scheduled"} for item in schedules]},
+            status_code=200
+        )
+
     @router.get(
         "/schedules",
         summary="Get all schedules",
         description="Get all current dosing schedules."
     )
-    def get_schedules():
+    async def get_schedules():
         """
         Get all current dosing schedules.
         """
-        return JSONResponse(content=scheduler_manager.get_schedules(), status_code=200)
+        return JSONResponse(content=await sqlite_client.fetch_all_schedules(), status_code=200)
     
     @router.get(
         "/jobs",
         summary="Get all jobs",
-        description="Get all current dosing jobs."
+        description="Get all current dosing jobs and the upcoming dose timeline."
     )
-    def get_jobs():
+    async def get_jobs():
         """
         Get all current job schedules.
         """
         return JSONResponse(content=scheduler_manager.get_jobs(), status_code=200)
 
+    @router.get(
+        "/maintenance",
+        summary="Get maintenance status",
+        description="Get the raw log retention settings and the report of the last retention run."
+    )
+    async def get_maintenance():
+        """
+        Get the retention settings and the last retention report.
+        """
+        return JSONResponse(content=scheduler_manager.get_maintenance(), status_code=200)
+
+    @router.post(
+        "/maintenance/run",
+        summary="Run maintenance now",
+        description="Append new raw logs to the columnar archive, then prune raw logs past the retention window and reclaim space now, returning rows archived and pruned, bytes reclaimed and time spent."
+    )
+    def run_maintenance():
+        """
+        Run the retention job now.
+        """
+        if not scheduler_manager.retention_days and columnar_archive is None:
+            raise HTTPException(status_code=400, detail="Retention and the columnar archive are disabled.")
+        return JSONResponse(content=scheduler_manager.run_maintenance(), status_code=200)
+
+    def require_archive():
+        if columnar_archive is None:
+            raise HTTPException(status_code=400, detail="The columnar archive is disabled.")
+
+    @router.get(
+        "/archive",
+        summary="Get columnar archive segments",
+        description="Get the segments of the columnar dose archive with their row counts, time ranges and sizes."
+    )
+    async def get_archive():
+        """
+        Get the columnar archive's segments.
+        """
+        require_archive()
+        return JSONResponse(content=await sqlite_client.run(columnar_archive.stats), status_code=200)
+
+    @router.get(
+        "/archive/export",
+        summary="Export the columnar archive",
+        description=(
+            "Stream every archive segment back to back. Each segment is a 32-byte header followed by "
+            "float64 epoch times, float32 ml, actual_seconds and actual_ml, and uint8 head and mode columns."
+        )
+    )
+    async def export_archive():
+        """
+        Stream the whole columnar archive.
+        """
+        require_archive()
+        return StreamingResponse(
+            sqlite_client.iterate(columnar_archive.iter_export()),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="doses.dosa"'}
+        )
+
+    @router.get(
+        "/archive/range",
+        summary="Read an archived range",
+        description="Stream the archived doses between start and end (inclusive), optionally for one head, in the export segment format."
+    )
+    async def read_archive_range(
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        head: Optional[int] = None
+    ):
+        """
+        Stream archived doses in a time range from memory-mapped segments.
+        """
+        require_archive()
+        start, end = local_time(start), local_time(end)
+        if start is not None and end is not None and start > end:
+            raise HTTPException(status_code=400, detail="start must be before end.")
+        return StreamingResponse(
+            sqlite_client.iterate(columnar_archive.iter_range(start, end, head=head)),
+            media_type="application/octet-stream"
+        )
+
     @router.post(
         "/schedule/pause/{head}",
         summary="Pause schedule",
@@ -0,0 +1,37 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, List
+
+async def json_rows(columns: List[str], batches: AsyncIterator[List[tuple]]) -> AsyncIterator[str]:
+    """
+    Stream rows as one JSON array of objects, the same shape /logs has always returned.
+    """
+    yield "["
+    first = True
+    async for rows in batches:
+        chunk = ",".join(json.dumps(dict(zip(columns, row))) for row in rows)
+        yield chunk if first else "," + chunk
+        first = False
+    yield "]"
+
+async def ndjson_rows(columns: List[str], batches: AsyncIterator[List[tuple]]) -> AsyncIterator[str]:
+    async for rows in batches:
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+async def csv_rows(columns: List[str], batches: AsyncIterator[List[tuple]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+LOG_FORMATS = {
+    "json": (json_rows, "application/json"),
+    "ndjson": (ndjson_rows, "application/x-ndjson"),
+    "csv": (csv_rows, "text/csv"),
+}
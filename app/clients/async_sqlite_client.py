@@ -0,0 +1,61 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List
+
+from app.clients.sqlite_client import SQliteClient
+
+class AsyncSQliteClient:
+    """
+    Async front for SQliteClient with the same method surface.
+
+    Every storage method becomes a coroutine that runs on a small executor of
+    its own, so awaiting it neither blocks the event loop nor takes one of
+    Starlette's threadpool workers. The executor's threads are long-lived,
+    so SQliteClient's per-thread connections are reused across calls.
+    Attributes and the pure helpers in SYNC_METHODS pass straight through.
+    """
+    SYNC_METHODS = frozenset({"encode_cursor", "decode_cursor", "history_resolution", "cache_stats"})
+
+    def __init__(self, sqlite_client: SQliteClient, max_workers: int = 2) -> None:
+        self.sqlite_client = sqlite_client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sqlite")
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.sqlite_client, name)
+        if not callable(attribute) or name in self.SYNC_METHODS or name.startswith("_"):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def method(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, method)
+        return method
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn on the storage executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def iterate(self, iterator: Iterator[List[tuple]]) -> AsyncIterator[List[tuple]]:
+        """
+        Drain a blocking iterator, such as the batches from stream_logs, on the storage executor.
+        """
+        sentinel = object()
+        try:
+            while True:
+                batch = await self.run(next, iterator, sentinel)
+                if batch is sentinel:
+                    return
+                yield batch
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await self.run(close)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
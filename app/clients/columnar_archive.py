@@ -0,0 +1,208 @@
+import os
+import re
+import struct
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.clients.sqlite_client import SQliteClient
+
+# Segment layout (little endian): a 32-byte header, then each column stored contiguously
+# in this order, widest first so every column stays aligned for memory mapping.
+HEADER = struct.Struct("<4sHHIdd4x")
+MAGIC = b"DOSA"
+VERSION = 1
+COLUMNS = (
+    ("time", np.dtype("<f8")),            # Seconds since 1970-01-01 of the logged wall-clock time
+    ("ml", np.dtype("<f4")),
+    ("actual_seconds", np.dtype("<f4")),  # NaN when not measured
+    ("actual_ml", np.dtype("<f4")),       # NaN when not measured
+    ("head", np.dtype("u1")),
+    ("mode", np.dtype("u1")),             # Index into MODES
+)
+MODES = SQliteClient.DOSE_MODES
+SEGMENT_NAME = re.compile(r"^segment-(\d{6})\.dosa$")
+EPOCH = datetime(1970, 1, 1)
+
+def to_epoch(value: datetime) -> float:
+    """
+    Seconds since 1970-01-01 of a naive timestamp, read as is (like every time in raw_logs).
+    Aware timestamps are converted to local time first.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return (value - EPOCH).total_seconds()
+
+def from_epoch(seconds: float) -> datetime:
+    return EPOCH + timedelta(microseconds=round(seconds * 1_000_000))
+
+def encode_segment(columns: dict) -> bytes:
+    """
+    One segment from arrays keyed by column name, already in time order.
+    """
+    times = columns["time"]
+    count = len(times)
+    parts = [HEADER.pack(MAGIC, VERSION, 0, count, times[0] if count else 0.0, times[-1] if count else 0.0)]
+    parts.extend(np.ascontiguousarray(columns[name], dtype=dtype).tobytes() for name, dtype in COLUMNS)
+    return b"".join(parts)
+
+def iter_segments(data: bytes) -> Iterator[dict]:
+    """
+    Decode a concatenation of segments, as served by /archive/export and /archive/range,
+    into one dict of column arrays per segment.
+    """
+    offset = 0
+    while offset < len(data):
+        magic, version, _, count, _, _ = HEADER.unpack_from(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} dose archive segment at byte {offset}.")
+        offset += HEADER.size
+        columns = {}
+        for name, dtype in COLUMNS:
+            columns[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count
+        yield columns
+
+class ColumnarArchive:
+    """
+    Append-only directory of typed, columnar dose history segments.
+
+    Each segment holds the raw log entries of one append in time order, at
+    22 bytes per dose instead of a UUID and ISO strings. Segments cover
+    consecutive time ranges, so a range read only memory-maps the segments
+    that overlap it, binary searches their time column and slices the other
+    columns, without loading whole segments.
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def segments(self) -> List[dict]:
+        """
+        Segment files in append order with their row count and time range.
+        """
+        result = []
+        for name in sorted(os.listdir(self.directory)):
+            if not SEGMENT_NAME.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, "rb") as f:
+                magic, version, _, count, first, last = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} dose archive segment.")
+            result.append({
+                "name": name,
+                "path": path,
+                "rows": count,
+                "start": first,
+                "end": last,
+                "bytes": os.path.getsize(path),
+            })
+        return result
+
+    def watermark(self) -> Optional[datetime]:
+        """
+        Time of the newest archived dose, None for an empty archive.
+        """
+        segments = self.segments()
+        return from_epoch(segments[-1]["end"]) if segments else None
+
+    def append(self, rows: List[Tuple[str, int, str, float, Optional[float], Optional[float]]]) -> Optional[dict]:
+        """
+        Write rows of (ISO time, head, mode, ml, actual_seconds, actual_ml), in time order, as a new segment.
+        """
+        if not rows:
+            return None
+        time_column, heads, modes, ml, actual_seconds, actual_ml = zip(*rows)
+        columns = {
+            "time": np.array(time_column, dtype="datetime64[us]").astype(np.int64) / 1_000_000,
+            "head": np.array(heads, dtype=np.int64),
+            "mode": np.array([MODES.index(mode) for mode in modes]),
+            # None becomes NaN
+            "ml": np.array(ml, dtype=np.float64),
+            "actual_seconds": np.array(actual_seconds, dtype=np.float64),
+            "actual_ml": np.array(actual_ml, dtype=np.float64),
+        }
+        if columns["head"].min() < 0 or columns["head"].max() > 255:
+            raise ValueError("Head ids must fit in one byte to be archived.")
+
+        with self._lock:
+            segments = self.segments()
+            index = int(SEGMENT_NAME.match(segments[-1]["name"]).group(1)) + 1 if segments else 0
+            path = os.path.join(self.directory, f"segment-{index:06d}.dosa")
+            # Write then rename, so readers never see a partial segment
+            with open(path + ".tmp", "wb") as f:
+                f.write(encode_segment(columns))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+        return {"segment": os.path.basename(path), "rows": len(rows), "bytes": os.path.getsize(path)}
+
+    def _map(self, segment: dict) -> dict:
+        offset = HEADER.size
+        columns = {}
+        for name, dtype in COLUMNS:
+            if segment["rows"]:
+                columns[name] = np.memmap(segment["path"], dtype=dtype, mode="r", offset=offset, shape=(segment["rows"],))
+            else:
+                columns[name] = np.empty(0, dtype=dtype)
+            offset += dtype.itemsize * segment["rows"]
+        return columns
+
+    def iter_range(
+            self,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            head: Optional[int] = None
+            ) -> Iterator[bytes]:
+        """
+        Doses between start and end (inclusive), optionally for one head, as one
+        encoded segment per archive segment that overlaps the range.
+        """
+        low = to_epoch(start) if start is not None else -np.inf
+        high = to_epoch(end) if end is not None else np.inf
+        for segment in self.segments():
+            if segment["rows"] == 0 or segment["end"] < low or segment["start"] > high:
+                continue
+            columns = self._map(segment)
+            first = int(np.searchsorted(columns["time"], low, side="left"))
+            last = int(np.searchsorted(columns["time"], high, side="right"))
+            selected = {name: column[first:last] for name, column in columns.items()}
+            if head is not None:
+                mask = selected["head"] == head
+                selected = {name: column[mask] for name, column in selected.items()}
+            if len(selected["time"]):
+                yield encode_segment(selected)
+
+    def iter_export(self, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        """
+        The whole archive as its segment files back to back, read in chunks.
+        """
+        for segment in self.segments():
+            with open(segment["path"], "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def stats(self) -> dict:
+        segments = self.segments()
+        return {
+            "directory": self.directory,
+            "segments": [
+                {
+                    "name": segment["name"],
+                    "rows": segment["rows"],
+                    "start": from_epoch(segment["start"]).isoformat(),
+                    "end": from_epoch(segment["end"]).isoformat(),
+                    "bytes": segment["bytes"],
+                }
+                for segment in segments
+            ],
+            "rows": sum(segment["rows"] for segment in segments),
+            "bytes": sum(segment["bytes"] for segment in segments),
+        }
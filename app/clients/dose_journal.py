@@ -0,0 +1,140 @@
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class DoseEntry:
+    id: str
+    head: int
+    ml: float
+    mode: str
+    timestamp: datetime
+    actual_seconds: Optional[float] = None
+    actual_ml: Optional[float] = None
+
+class DoseJournal:
+    """
+    In-memory write-behind buffer for completed doses.
+
+    append() is O(1) and never touches disk. A background thread hands the
+    buffered entries to flush_fn in one batch once max_batch entries are
+    waiting or max_delay seconds have passed, whichever comes first.
+
+    When a batch fails, its entries are retried one at a time so a single bad
+    entry can't hold back the rest. An entry that fails max_attempts flushes
+    is logged, dropped and handed to drop_fn, if set, once the flush lock is released.
+    """
+    def __init__(
+            self,
+            flush_fn: Callable[[List[DoseEntry]], None],
+            max_batch: int = 50,
+            max_delay: float = 5.0,
+            max_attempts: int = 5,
+            drop_fn: Optional[Callable[[List[DoseEntry]], None]] = None
+            ) -> None:
+        self.flush_fn = flush_fn
+        self.drop_fn = drop_fn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self._queue = deque()
+        self._queue_lock = threading.Lock()
+        # Failed flushes per entry id, only touched with the flush lock held
+        self._attempts: Dict[str, int] = {}
+        # Held while a batch is being written so readers never see it twice
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="dose-journal", daemon=True)
+        self._thread.start()
+
+    def append(self, entry: DoseEntry) -> None:
+        with self._queue_lock:
+            self._queue.append(entry)
+            size = len(self._queue)
+        if size >= self.max_batch:
+            self._wakeup.set()
+
+    def backlog(self) -> int:
+        with self._queue_lock:
+            return len(self._queue)
+
+    @contextmanager
+    def pending(self) -> Iterator[List[DoseEntry]]:
+        """
+        Yield the entries not yet written to disk. Flushing is held off until the
+        block exits, so a read done inside it sees every dose exactly once.
+        """
+        with self._flush_lock:
+            with self._queue_lock:
+                entries = list(self._queue)
+            yield entries
+
+    def flush(self) -> int:
+        dropped = []
+        with self._flush_lock:
+            with self._queue_lock:
+                batch = list(self._queue)
+                self._queue.clear()
+            if not batch:
+                return 0
+            try:
+                self.flush_fn(batch)
+                self._attempts.clear()
+                written = len(batch)
+            except Exception:
+                logger.exception(f"Failed to flush {len(batch)} dose entries, retrying them one at a time")
+                written = self._flush_each(batch, dropped)
+        # drop_fn may take locks that are held around pending(), call it without the flush lock
+        if dropped and self.drop_fn is not None:
+            self.drop_fn(dropped)
+        return written
+
+    def _flush_each(self, batch: List[DoseEntry], dropped: List[DoseEntry]) -> int:
+        """
+        Write the entries of a failed batch one by one. An entry that fails is added to
+        dropped once it has used up max_attempts, otherwise it and the entries after it
+        go back to the front of the queue. Called with the flush lock held.
+        """
+        written = 0
+        for index, entry in enumerate(batch):
+            try:
+                self.flush_fn([entry])
+            except Exception:
+                attempts = self._attempts.pop(entry.id, 0) + 1
+                if attempts >= self.max_attempts:
+                    logger.exception(f"Dropping dose entry {entry} after {attempts} failed flushes")
+                    dropped.append(entry)
+                    continue
+                logger.exception(f"Failed to flush dose entry {entry.id}, will retry")
+                self._attempts[entry.id] = attempts
+                with self._queue_lock:
+                    self._queue.extendleft(reversed(batch[index:]))
+                return written
+            self._attempts.pop(entry.id, None)
+            written += 1
+        return written
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
@@ -1,28 +1,275 @@
+import os
+import re
+import json
+import base64
 import sqlite3
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
 from uuid import uuid4
-from datetime import datetime
-from typing import List, Tuple, Optional
+from datetime import datetime, timedelta
+from typing import Callable, ContextManager, Dict, Iterable, Iterator, List, Set, Tuple, Optional
+
+from app.clients.dose_journal import DoseEntry, DoseJournal
+from app.hardware.clock import Clock
+from app.metrics import SQLITE_LATENCY, timed
+
+logger = logging.getLogger(__name__)
 
 class SQliteClient:
     RAW_LOGS_TABLE_NAME = "raw_logs"
     LOGS_TABLE_NAME = "logs"
     SCHEDULES_TABLE_NAME = "schedules"
+    SCHEDULER_STATE_TABLE_NAME = "scheduler_state"
     REMAINING_TABLE_NAME = "remaining"
+    DOSE_MODES = ("Manual", "Scheduled", "Primer")
+
+    # Keyset pagination order for each log table
+    LOG_KEYS = {
+        RAW_LOGS_TABLE_NAME: ("date", "time", "id"),
+        LOGS_TABLE_NAME: ("date", "hour", "head"),
+    }
+
+    # Rollup tables per resolution: table name, bucket format and the same bucket computed from raw_logs.time.
+    # Hourly history is read from the hourly logs table, which already holds those sums
+    ROLLUPS = {
+        "daily": ("rollup_daily", "%Y-%m-%d", "substr(time, 1, 10)"),
+        "monthly": ("rollup_monthly", "%Y-%m", "substr(time, 1, 7)"),
+    }
+
+    HISTORY_RESOLUTIONS = ("hourly", "daily", "monthly")
+
+    # Bumped whenever _migrate_schema gains a step
+    SCHEMA_VERSION = 6
+
+    # Applied once to every connection when it is opened
+    PRAGMAS = (
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -4000",
+    )
 
     def __init__(
             self,
             logs_path: str = "/mnt/logs.db",
             schedules_path: str = "/mnt/schedules.db",
-            remaining_path: str = "/mnt/remaining.db"
+            remaining_path: str = "/mnt/remaining.db",
+            db_path: Optional[str] = None,
+            write_behind: bool = False,
+            journal_max_batch: int = 50,
+            journal_max_delay: float = 5.0,
+            clock: Optional[Clock] = None,
+            heads: Iterable[int] = (1, 2)
             ) -> None:
-        self.logs_path = logs_path
-        self.schedules_path = schedules_path
-        self.remaining_path = remaining_path
+        """
+        With db_path unset every table group lives in its own file (legacy layout).
+        With db_path set all tables share one database and any legacy files found
+        at the other paths are migrated into it on startup.
+        With write_behind set, doses are buffered in a DoseJournal and written in batches.
+        heads are the configured pump head ids; schedules and remaining get a row for each.
+        """
+        self.db_path = db_path
+        self.clock = clock or Clock()
+        self.heads = tuple(sorted(heads))
+        if db_path is None:
+            self.logs_path = logs_path
+            self.schedules_path = schedules_path
+            self.remaining_path = remaining_path
+        else:
+            self.logs_path = self.schedules_path = self.remaining_path = db_path
+
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # Read cache for remaining, schedules and today's totals, kept current by the write methods
+        self._cache = {}
+        self._cache_stats = {key: {"hits": 0, "misses": 0} for key in ("remaining", "schedules", "today")}
+        self._cache_lock = threading.RLock()
+        # Counters have their own lock: _cache_lock is held across SQLite writes, cache_stats() must not wait on them
+        self._cache_stats_lock = threading.Lock()
 
         self._create_tables()
+        if db_path is not None:
+            self._migrate_legacy_files((logs_path, schedules_path, remaining_path))
+        self._migrate_schema()
+
+        # Called with every DoseEntry passed to record_dose, after it is queued or written
+        self.dose_listeners: List[Callable[[DoseEntry], None]] = []
+
+        self.journal: Optional[DoseJournal] = None
+        if write_behind:
+            self.journal = DoseJournal(self._write_doses, journal_max_batch, journal_max_delay, drop_fn=self._doses_dropped)
+            self.journal.start()
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        """
+        Return this thread's long-lived connection to path, opening it on first use.
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            connections[path] = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        if self.journal is not None:
+            self.journal.stop()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _migrate_legacy_files(self, legacy_paths: Tuple[str, ...]) -> None:
+        """
+        Copy the tables of a three-file install into the single database and rename
+        each legacy file to <path>.migrated so it is only imported once.
+        """
+        tables = (
+            self.RAW_LOGS_TABLE_NAME,
+            self.LOGS_TABLE_NAME,
+            self.SCHEDULES_TABLE_NAME,
+            self.REMAINING_TABLE_NAME,
+        )
+        conn = self._connect(self.db_path)
+        # A database still on the wide logs layout takes the legacy rows as they are and is migrated afterwards
+        main_logs_columns = [row["name"] for row in conn.execute(f"PRAGMA main.table_info({self.LOGS_TABLE_NAME})").fetchall()]
+        for path in legacy_paths:
+            if not os.path.exists(path) or os.path.abspath(path) == os.path.abspath(self.db_path):
+                continue
+            conn.execute("ATTACH DATABASE ? AS legacy", (path,))
+            try:
+                with conn:
+                    for table in tables:
+                        columns = [row["name"] for row in conn.execute(f"PRAGMA legacy.table_info({table})").fetchall()]
+                        if not columns:
+                            continue
+                        if table == self.LOGS_TABLE_NAME and "head" not in columns and "head" in main_logs_columns:
+                            self._unpivot_logs(conn, f"legacy.{table}", columns)
+                            continue
+                        column_list = ", ".join(columns)
+                        conn.execute(
+                            f"""
+                            INSERT OR REPLACE INTO main.{table} ({column_list})
+                            SELECT {column_list} FROM legacy.{table}
+                            """
+                        )
+            finally:
+                conn.execute("DETACH DATABASE legacy")
+            os.replace(path, f"{path}.migrated")
+            logger.info(f"Migrated legacy database {path} into {self.db_path}")
+
+    def _migrate_schema(self) -> None:
+        """
+        Bring existing databases up to SCHEMA_VERSION, tracked in PRAGMA user_version of the logs database.
+        """
+        conn = self._connect(self.logs_path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+
+        with conn:
+            # Explicit, so the DDL below (which the sqlite3 module runs outside any implicit transaction)
+            # commits or rolls back together with the data it moves
+            conn.execute("BEGIN")
+            if version < 1:
+                # Backfill the rollups from the raw logs recorded before they existed
+                for table, _, bucket in self.ROLLUPS.values():
+                    conn.execute(f"DELETE FROM {table}")
+                    conn.execute(
+                        f"""
+                        INSERT INTO {table} (bucket, head, mode, ml, doses)
+                        SELECT {bucket}, head, mode, SUM(ml), COUNT(*)
+                        FROM {self.RAW_LOGS_TABLE_NAME}
+                        GROUP BY 1, 2, 3
+                        """
+                    )
+            if version < 3:
+                # Optional dosing window per head, "HH:MM" bounds
+                window_columns = {"window_start": "TEXT", "window_end": "TEXT"}
+                if self.schedules_path == self.logs_path:
+                    # Same connection: a nested `with` would commit the migration transaction early
+                    self._add_columns(conn, self.SCHEDULES_TABLE_NAME, window_columns)
+                else:
+                    with self._connect(self.schedules_path) as schedules_conn:
+                        self._add_columns(schedules_conn, self.SCHEDULES_TABLE_NAME, window_columns)
+            if version < 4:
+                # Measured pin-on time and the volume computed from it, next to the requested ml
+                self._add_columns(conn, self.RAW_LOGS_TABLE_NAME, {"actual_seconds": "REAL", "actual_ml": "REAL"})
+            if version < 5:
+                # Hourly logs move from one column per head to one row per (date, hour, head)
+                wide = f"{self.LOGS_TABLE_NAME}_wide"
+                columns = [row["name"] for row in conn.execute(f"PRAGMA table_info({self.LOGS_TABLE_NAME})").fetchall()]
+                if "head" not in columns:
+                    conn.execute(f"ALTER TABLE {self.LOGS_TABLE_NAME} RENAME TO {wide}")
+                    conn.execute(self._logs_table_sql())
+                else:
+                    # A logs_wide left behind by an interrupted migration still holds the hourly history
+                    columns = [row["name"] for row in conn.execute(f"PRAGMA table_info({wide})").fetchall()]
+                if columns:
+                    self._unpivot_logs(conn, wide, columns)
+                    conn.execute(f"DROP TABLE {wide}")
+            if version < 6:
+                # Hourly history is served from the logs table, which held the same sums
+                conn.execute("DROP TABLE IF EXISTS rollup_hourly")
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        if version < 2 and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # auto_vacuum only changes on a full VACUUM, done once so retention can reclaim space in small steps
+            conn.execute("VACUUM")
+        logger.info(f"Migrated {self.logs_path} from schema version {version} to {self.SCHEMA_VERSION}")
+
+    def _logs_table_sql(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.LOGS_TABLE_NAME} (
+                date TEXT NOT NULL,
+                hour TEXT NOT NULL,
+                head INTEGER NOT NULL,
+                ml REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (date, hour, head)
+            ) WITHOUT ROWID
+            """
+
+    def _unpivot_logs(self, conn: sqlite3.Connection, source: str, columns: List[str]) -> None:
+        """
+        Copy a wide hourly log table (one headN column per head) into the long logs table.
+        """
+        for column in columns:
+            match = re.fullmatch(r"head(\d+)", column)
+            if match is None:
+                continue
+            conn.execute(
+                f"""
+                INSERT INTO main.{self.LOGS_TABLE_NAME} (date, hour, head, ml)
+                SELECT date, hour, ?, {column} FROM {source} WHERE {column} IS NOT NULL
+                ON CONFLICT(date, hour, head) DO UPDATE SET ml = excluded.ml
+                """,
+                (int(match.group(1)),)
+            )
+
+    @staticmethod
+    def _add_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str], schema: str = "main") -> None:
+        existing = {row["name"] for row in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {column_type}")
 
     def _create_tables(self) -> None:
-        with sqlite3.connect(self.logs_path) as conn:
+        with self._connect(self.logs_path) as conn:
             cur = conn.cursor()
             cur.executescript(
                 f"""
@@ -32,41 +279,64 @@ class SQliteClient:
                     head INTEGER,
                     time TEXT,
                     ml REAL,
-                    mode TEXT CHECK(mode IN ('Manual', 'Scheduled', 'Primer'))
+                    mode TEXT CHECK(mode IN ('Manual', 'Scheduled', 'Primer')),
+                    actual_seconds REAL,
+                    actual_ml REAL
                 );
 
-                CREATE TABLE IF NOT EXISTS {self.LOGS_TABLE_NAME} (
-                    date TEXT NOT NULL,
-                    hour TEXT NOT NULL,
-                    head1 REAL DEFAULT NULL,
-                    head2 REAL DEFAULT NULL,
-                    PRIMARY KEY (date, hour)
-                );
+                {self._logs_table_sql()};
+
+                CREATE INDEX IF NOT EXISTS idx_{self.RAW_LOGS_TABLE_NAME}_date_time
+                ON {self.RAW_LOGS_TABLE_NAME} (date, time, id);
+
+                CREATE INDEX IF NOT EXISTS idx_{self.RAW_LOGS_TABLE_NAME}_head_time
+                ON {self.RAW_LOGS_TABLE_NAME} (head, time);
                 
                 """
                 )
+            for table, _, _ in self.ROLLUPS.values():
+                cur.executescript(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        bucket TEXT NOT NULL,
+                        head INTEGER NOT NULL,
+                        mode TEXT NOT NULL,
+                        ml REAL NOT NULL DEFAULT 0,
+                        doses INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket, head, mode)
+                    ) WITHOUT ROWID;
+
+                    CREATE INDEX IF NOT EXISTS idx_{table}_head_bucket ON {table} (head, bucket);
+                    """
+                )
             conn.commit()
-        with sqlite3.connect(self.schedules_path) as conn:
+        with self._connect(self.schedules_path) as conn:
             cur = conn.cursor()
             cur.executescript(
                 f"""
                 CREATE TABLE IF NOT EXISTS {self.SCHEDULES_TABLE_NAME} (
                     head INTEGER PRIMARY KEY,
                     total_dose REAL,
-                    doses_per_day INTEGER
+                    doses_per_day INTEGER,
+                    window_start TEXT,
+                    window_end TEXT
                 );
 
-                INSERT OR IGNORE INTO {self.SCHEDULES_TABLE_NAME} (head, total_dose, doses_per_day)
-                VALUES (1, NULL, NULL);
-
-                INSERT OR IGNORE INTO {self.SCHEDULES_TABLE_NAME} (head, total_dose, doses_per_day)
-                VALUES (2, NULL, NULL);
+                CREATE TABLE IF NOT EXISTS {self.SCHEDULER_STATE_TABLE_NAME} (
+                    head INTEGER PRIMARY KEY,
+                    last_fired TEXT,
+                    next_due TEXT
+                );
 
                 """
                 )
+            cur.executemany(
+                f"INSERT OR IGNORE INTO {self.SCHEDULES_TABLE_NAME} (head, total_dose, doses_per_day) VALUES (?, NULL, NULL)",
+                [(head,) for head in self.heads]
+            )
             conn.commit()
 
-        with sqlite3.connect(self.remaining_path) as conn:
+        with self._connect(self.remaining_path) as conn:
             cur = conn.cursor()
             cur.executescript(
                 f"""
@@ -74,176 +344,768 @@ class SQliteClient:
                     head INTEGER PRIMARY KEY,
                     remaining REAL
                 );
-
-                INSERT OR IGNORE INTO {self.REMAINING_TABLE_NAME} (head, remaining)
-                VALUES (1, NULL);
-
-                INSERT OR IGNORE INTO {self.REMAINING_TABLE_NAME} (head, remaining)
-                VALUES (2, NULL);
-
                 """
                 )
+            cur.executemany(
+                f"INSERT OR IGNORE INTO {self.REMAINING_TABLE_NAME} (head, remaining) VALUES (?, NULL)",
+                [(head,) for head in self.heads]
+            )
             conn.commit()
 
+    @timed(SQLITE_LATENCY)
     def update_remaining(self, head: int, ml: float) -> None:
-        with sqlite3.connect(self.remaining_path) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                f"""
-                UPDATE {self.REMAINING_TABLE_NAME} SET remaining = remaining - ? WHERE head = ?
-                """,
-                (ml, head)
-            )
-            conn.commit()
+        with self._cache_lock:
+            with self._connect(self.remaining_path) as conn:
+                self._update_remaining(conn.cursor(), {head: ml})
+            self._cache_dose(head, ml, None)
         return
+
+    def _update_remaining(self, cur: sqlite3.Cursor, dosed: Dict[int, float]) -> None:
+        cur.executemany(
+            f"""
+            UPDATE {self.REMAINING_TABLE_NAME} SET remaining = remaining - ? WHERE head = ?
+            """,
+            [(ml, head) for head, ml in dosed.items()]
+        )
     
+    @timed(SQLITE_LATENCY)
     def set_remaining(self, head: int, ml: float) -> None:
-        with sqlite3.connect(self.remaining_path) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                f"""
-                UPDATE {self.REMAINING_TABLE_NAME} SET remaining = ? WHERE head = ?
-                """,
-                (ml, head)
-            )
-            conn.commit()
+        """
+        Set the remaining volume of head, e.g. after a refill. With write-behind the
+        journal is flushed first: the doses it holds happened before the refill and
+        must not be subtracted from the new level.
+        """
+        with self._cache_lock:
+            self.flush()
+            with self._connect(self.remaining_path) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    UPDATE {self.REMAINING_TABLE_NAME} SET remaining = ? WHERE head = ?
+                    """,
+                    (ml, head)
+                )
+                conn.commit()
+            remaining = self._cache.get("remaining")
+            if remaining is not None and head in remaining:
+                remaining[head] = ml
         return
     
+    @timed(SQLITE_LATENCY)
     def get_remaining(self) -> dict:
+        with self._cache_lock:
+            return dict(self._cached("remaining", self._load_remaining))
+
+    def _load_remaining(self) -> dict:
         result = {}
-        with sqlite3.connect(self.remaining_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(f"SELECT head, remaining FROM {self.REMAINING_TABLE_NAME}")
-            rows = cur.fetchall()
-            for row in rows:
-                result[row["head"]] = row["remaining"]
+        with self._pending() as pending:
+            with self._connect(self.remaining_path) as conn:
+                cur = conn.cursor()
+                cur.execute(f"SELECT head, remaining FROM {self.REMAINING_TABLE_NAME}")
+                rows = cur.fetchall()
+                for row in rows:
+                    result[row["head"]] = row["remaining"]
+        for entry in pending:
+            if result.get(entry.head) is not None:
+                result[entry.head] -= entry.ml
         return result
 
-    def update_schedule(self, head: int, total_dose: float, doses_per_day: int) -> None:
-        with sqlite3.connect(self.schedules_path) as conn:
+    def update_schedule(
+            self,
+            head: int,
+            total_dose: float,
+            doses_per_day: int,
+            window_start: Optional[str] = None,
+            window_end: Optional[str] = None
+            ) -> None:
+        self.update_schedules({
+            head: {
+                "total_dose": total_dose,
+                "doses_per_day": doses_per_day,
+                "window_start": window_start,
+                "window_end": window_end
+            }
+        })
+
+    @timed(SQLITE_LATENCY)
+    def update_schedules(self, schedules: Dict[int, dict]) -> None:
+        """
+        Write several heads' schedules in one transaction. Values have the keys
+        returned by fetch_all_schedules.
+        """
+        with self._cache_lock:
+            self._update_schedules(schedules)
+            cached = self._cache.get("schedules")
+            if cached is not None:
+                for head, schedule in schedules.items():
+                    if head in cached:
+                        cached[head] = dict(schedule)
+        return
+
+    def _update_schedules(self, schedules: Dict[int, dict]) -> None:
+        with self._connect(self.schedules_path) as conn:
             cur = conn.cursor()
-            if total_dose is None and doses_per_day is None:
-                cur.execute(
-                    f"""
-                    UPDATE {self.SCHEDULES_TABLE_NAME}
-                    SET total_dose = NULL, doses_per_day = NULL
-                    WHERE head = ?
-                    """,
-                    (head,)
-                )
-            else:
-                cur.execute(
-                    f"""
-                    UPDATE {self.SCHEDULES_TABLE_NAME}
-                    SET total_dose = ?, doses_per_day = ?
-                    WHERE head = ?
-                    """,
-                    (total_dose, doses_per_day, head)
-                )
+            cur.executemany(
+                f"""
+                UPDATE {self.SCHEDULES_TABLE_NAME}
+                SET total_dose = ?, doses_per_day = ?, window_start = ?, window_end = ?
+                WHERE head = ?
+                """,
+                [
+                    (
+                        schedule["total_dose"],
+                        schedule["doses_per_day"],
+                        schedule.get("window_start"),
+                        schedule.get("window_end"),
+                        head
+                    )
+                    for head, schedule in schedules.items()
+                ]
+            )
             conn.commit()
         return
 
+    @timed(SQLITE_LATENCY)
     def insert_raw_entry(self, head: int, ml: float, mode: str) -> str:
-        entry_id = str(uuid4())
-        now = datetime.now()
-        with sqlite3.connect(self.logs_path) as conn:
-            cur = conn.cursor()
-            cur.execute(
+        entry = DoseEntry(str(uuid4()), head, ml, mode, self.clock.now())
+        with self._connect(self.logs_path) as conn:
+            self._insert_raw_entries(conn.cursor(), [entry])
+        return entry.id
+
+    def _insert_raw_entries(self, cur: sqlite3.Cursor, entries: List[DoseEntry]) -> None:
+        cur.executemany(
+            f"""
+            INSERT INTO {self.RAW_LOGS_TABLE_NAME} (id, date, head, time, ml, mode, actual_seconds, actual_ml)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    entry.id,
+                    entry.timestamp.date().isoformat(),
+                    entry.head,
+                    entry.timestamp.isoformat(),
+                    entry.ml,
+                    entry.mode,
+                    entry.actual_seconds,
+                    entry.actual_ml,
+                )
+                for entry in entries
+            ],
+        )
+        self._update_rollups(cur, entries)
+
+    def _update_rollups(self, cur: sqlite3.Cursor, entries: List[DoseEntry]) -> None:
+        for table, bucket_format, _ in self.ROLLUPS.values():
+            totals = defaultdict(lambda: [0.0, 0])
+            for entry in entries:
+                total = totals[(entry.timestamp.strftime(bucket_format), entry.head, entry.mode)]
+                total[0] += entry.ml
+                total[1] += 1
+            cur.executemany(
                 f"""
-                INSERT INTO {self.RAW_LOGS_TABLE_NAME} (id, date, head, time, ml, mode)
-                VALUES (?, ?, ?, ?, ?, ?)
+                INSERT INTO {table} (bucket, head, mode, ml, doses)
+                VALUES (?, ?, ?, ?, ?)
+
+                ON CONFLICT(bucket, head, mode)
+                DO UPDATE SET ml = ml + excluded.ml, doses = doses + excluded.doses
                 """,
-                (
-                    entry_id,
-                    now.date().isoformat(),
-                    head,
-                    now.isoformat(),
-                    ml,
-                    mode,
-                ),
+                [(*key, ml, doses) for key, (ml, doses) in totals.items()],
             )
-            conn.commit()
-        return entry_id
     
+    @timed(SQLITE_LATENCY)
     def insert_entry(self, head: int, ml: float) -> None:
-        now = datetime.now()
-        with sqlite3.connect(self.logs_path) as conn:
+        now = self.clock.now()
+        with self._cache_lock:
+            with self._connect(self.logs_path) as conn:
+                self._insert_entries(conn.cursor(), {(head, now.date().isoformat(), now.strftime("%H:00")): ml})
+            self._cache_dose(head, None, now.date().isoformat(), ml)
+        return
+
+    def _insert_entries(self, cur: sqlite3.Cursor, hourly: Dict[Tuple[int, str, str], float]) -> None:
+        cur.executemany(
+            f"""
+            INSERT INTO {self.LOGS_TABLE_NAME} (date, hour, head, ml)
+            VALUES (?, ?, ?, ?)
+
+            ON CONFLICT(date, hour, head)
+            DO UPDATE SET ml = ml + excluded.ml
+            """,
+            [(date, hour, head, ml) for (head, date, hour), ml in hourly.items()],
+        )
+
+    @timed(SQLITE_LATENCY)
+    def record_dose(
+            self,
+            head: int,
+            ml: float,
+            mode: str,
+            actual_seconds: Optional[float] = None,
+            actual_ml: Optional[float] = None
+            ) -> str:
+        """
+        Record a completed dose: raw entry, hourly entry and remaining volume.
+        actual_seconds/actual_ml are the measured run time and the volume computed from it.
+        With write-behind enabled the dose is only queued here and written by the journal.
+        """
+        entry = DoseEntry(str(uuid4()), head, ml, mode, self.clock.now(), actual_seconds, actual_ml)
+        with self._cache_lock:
+            if self.journal is not None:
+                self.journal.append(entry)
+            else:
+                self._write_doses([entry])
+            self._cache_dose(head, ml, entry.timestamp.date().isoformat(), ml)
+        for listener in self.dose_listeners:
+            listener(entry)
+        return entry.id
+
+    @timed(SQLITE_LATENCY)
+    def _write_doses(self, entries: List[DoseEntry]) -> None:
+        """
+        Write a batch of doses. In single-database mode the whole batch is one transaction.
+        In the three-file mode logs.db is committed first and entries already there are
+        skipped, so a batch retried after a failed remaining.db write is not logged twice.
+        """
+        dosed = defaultdict(float)
+        for entry in entries:
+            dosed[entry.head] += entry.ml
+
+        if self.db_path is None:
+            with self._connect(self.logs_path) as conn:
+                cur = conn.cursor()
+                # A retried batch is already in logs.db when only the remaining.db write failed
+                written = self._written_ids(cur, entries)
+                unwritten = [entry for entry in entries if entry.id not in written]
+                self._insert_raw_entries(cur, unwritten)
+                self._insert_entries(cur, self._hourly_totals(unwritten))
+            with self._connect(self.remaining_path) as conn:
+                self._update_remaining(conn.cursor(), dosed)
+            return
+
+        with self._connect(self.db_path) as conn:
             cur = conn.cursor()
+            self._insert_raw_entries(cur, entries)
+            self._insert_entries(cur, self._hourly_totals(entries))
+            self._update_remaining(cur, dosed)
 
-            column = f"head{head}"
+    @staticmethod
+    def _hourly_totals(entries: List[DoseEntry]) -> Dict[Tuple[int, str, str], float]:
+        hourly = defaultdict(float)
+        for entry in entries:
+            hourly[(entry.head, entry.timestamp.date().isoformat(), entry.timestamp.strftime("%H:00"))] += entry.ml
+        return hourly
 
+    def _written_ids(self, cur: sqlite3.Cursor, entries: List[DoseEntry], chunk_size: int = 500) -> Set[str]:
+        """
+        Ids of the entries that already have a raw_logs row.
+        """
+        written = set()
+        for start in range(0, len(entries), chunk_size):
+            ids = [entry.id for entry in entries[start:start + chunk_size]]
             cur.execute(
-                f"""
-                INSERT INTO {self.LOGS_TABLE_NAME} (date, hour, {column})
-                VALUES (?, ?, ?)
-
-                ON CONFLICT(date, hour)
-                DO UPDATE SET {column} = COALESCE({column}, 0) + excluded.{column}
-                """,
-                (
-                    now.date().isoformat(),
-                    now.strftime("%H:00"),
-                    ml,
-                ),
+                f"SELECT id FROM {self.RAW_LOGS_TABLE_NAME} WHERE id IN ({', '.join('?' * len(ids))})",
+                ids
             )
-            conn.commit()
-        return
+            written.update(row[0] for row in cur.fetchall())
+        return written
+
+    @timed(SQLITE_LATENCY)
+    def flush(self) -> None:
+        if self.journal is not None:
+            self.journal.flush()
+
+    def _pending(self) -> ContextManager[List[DoseEntry]]:
+        """
+        Context yielding the doses still waiting in the write-behind journal.
+        Reads run inside it so unflushed doses are merged in exactly once.
+        """
+        if self.journal is None:
+            return nullcontext([])
+        return self.journal.pending()
     
-    def get_todays_total(self) -> Tuple[Optional[float], Optional[float]]:
-        today = datetime.now().date().isoformat()
+    @timed(SQLITE_LATENCY)
+    def get_todays_total(self) -> dict:
+        today = self.clock.now().date().isoformat()
         result = {}
-        with sqlite3.connect(self.schedules_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(f"SELECT total_dose AS head1_total FROM {self.SCHEDULES_TABLE_NAME} WHERE head = 1")
-            row = cur.fetchone()
-            head1_total = row["head1_total"] if row is not None else 0.0
+        with self._cache_lock:
+            schedules = self._cached("schedules", self._load_schedules)
+            # Today's totals are keyed on the date, so the first read after midnight reloads them
+            totals = self._cached("today", lambda: self._load_todays_total(today), valid=lambda cached: cached["date"] == today)
+            for head in self.heads:
+                total_dose = schedules.get(head, {}).get("total_dose")
+                result[f"head{head}"] = {
+                    "total_dose": total_dose if total_dose is not None else 0.0,
+                    "today_total": totals["heads"].get(head, 0.0)
+                }
+        return result
+
+    def _load_todays_total(self, today: str) -> dict:
+        with self._pending() as pending:
+            with self._connect(self.logs_path) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    SELECT head, SUM(ml)
+                    FROM {self.LOGS_TABLE_NAME}
+                    WHERE date = ?
+                    GROUP BY head
+                    """,
+                    (today,)
+                )
+                rows = cur.fetchall()
+        heads = dict.fromkeys(self.heads, 0.0)
+        heads.update((head, ml) for head, ml in rows)
+        for entry in pending:
+            if entry.head in heads and entry.timestamp.date().isoformat() == today:
+                heads[entry.head] += entry.ml
+        return {"date": today, "heads": heads}
+
+    def _cached(self, key: str, loader: Callable[[], dict], valid: Callable[[dict], bool] = lambda cached: True) -> dict:
+        """
+        Return the cached value for key, loading it from disk on a miss.
+        Callers get the live cache object and must copy before handing it out.
+        """
+        with self._cache_lock:
+            value = self._cache.get(key)
+            hit = value is not None and valid(value)
+            with self._cache_stats_lock:
+                self._cache_stats[key]["hits" if hit else "misses"] += 1
+            if hit:
+                return value
+            value = self._cache[key] = loader()
+            return value
+
+    def _cache_dose(self, head: int, remaining_ml: Optional[float], date: Optional[str], today_ml: float = 0.0) -> None:
+        """
+        Apply a write to the cached remaining volume and today's totals. Called with the cache lock held.
+        """
+        remaining = self._cache.get("remaining")
+        if remaining_ml is not None and remaining is not None and remaining.get(head) is not None:
+            remaining[head] -= remaining_ml
+        today = self._cache.get("today")
+        if date is not None and today is not None and today["date"] == date and head in today["heads"]:
+            today["heads"][head] += today_ml
+
+    def _doses_dropped(self, entries: List[DoseEntry]) -> None:
+        """
+        Forget the cached values the journal's dropped doses were already applied to,
+        so the next read matches what SQLite holds.
+        """
+        with self._cache_lock:
+            self._cache.pop("remaining", None)
+            self._cache.pop("today", None)
+
+    def cache_stats(self) -> dict:
+        with self._cache_stats_lock:
+            return {key: dict(stats) for key, stats in self._cache_stats.items()}
+
+    @timed(SQLITE_LATENCY)
+    def fetch_all_logs(self, table_name, days = 7) -> List[Tuple[str, str, int, str, float, str]]:
+        with self._pending() as pending:
+            with self._connect(self.logs_path) as conn:
+                cur = conn.cursor()
+                cutoff = (self.clock.now().date() - timedelta(days=days)).isoformat()
+                cur.execute(f"SELECT * FROM {table_name} WHERE date >= ?", (cutoff,))
+                rows = cur.fetchall()
+        logs = [dict(r) for r in rows]
+
+        if table_name == self.RAW_LOGS_TABLE_NAME:
+            for entry in pending:
+                logs.append({
+                    "id": entry.id,
+                    "date": entry.timestamp.date().isoformat(),
+                    "head": entry.head,
+                    "time": entry.timestamp.isoformat(),
+                    "ml": entry.ml,
+                    "mode": entry.mode,
+                    "actual_seconds": entry.actual_seconds,
+                    "actual_ml": entry.actual_ml,
+                })
+        elif pending:
+            hourly = {(log["date"], log["hour"], log["head"]): log for log in logs}
+            for entry in pending:
+                key = (entry.timestamp.date().isoformat(), entry.timestamp.strftime("%H:00"), entry.head)
+                if key not in hourly:
+                    hourly[key] = {"date": key[0], "hour": key[1], "head": key[2], "ml": 0.0}
+                    logs.append(hourly[key])
+                hourly[key]["ml"] += entry.ml
+        return logs
+    
+    @timed(SQLITE_LATENCY)
+    def stream_logs(
+            self,
+            table_name: str,
+            days: int = 7,
+            head: Optional[int] = None,
+            mode: Optional[str] = None,
+            after: Optional[tuple] = None,
+            limit: Optional[int] = None,
+            batch_size: int = 500
+            ) -> Tuple[List[str], Iterator[List[tuple]], Optional[tuple]]:
+        """
+        Stream log rows in key order straight from a cursor.
+
+        Returns the column names, an iterator of row batches and the key to resume
+        after when more rows follow the limit (None otherwise). after is the key of
+        the last row already seen. The stream reads one snapshot on its own
+        connection, which is closed once the iterator is exhausted or discarded.
+        """
+        keys = self.LOG_KEYS[table_name]
+        raw = table_name == self.RAW_LOGS_TABLE_NAME
+        if mode is not None and not raw:
+            raise ValueError("The mode filter only applies to raw logs.")
+
+        clauses = ["date >= ?"]
+        params = [(self.clock.now().date() - timedelta(days=days)).isoformat()]
+        if head is not None:
+            clauses.append("head = ?")
+            params.append(head)
+        if mode is not None:
+            clauses.append("mode = ?")
+            params.append(mode)
+        if after is not None:
+            if len(after) != len(keys):
+                raise ValueError("Cursor does not match this log table.")
+            clauses.append(f"({', '.join(keys)}) > ({', '.join('?' for _ in keys)})")
+            params.extend(after)
+        where = " AND ".join(clauses)
+        order = ", ".join(keys)
+
+        # Buffered doses must be on disk before the snapshot is taken
+        self.flush()
+        conn = sqlite3.connect(self.logs_path, check_same_thread=False)
+        conn.execute("BEGIN")
+
+        next_key = None
+        if limit is not None:
+            cur = conn.execute(
+                f"SELECT {order} FROM {table_name} WHERE {where} ORDER BY {order} LIMIT 2 OFFSET ?",
+                (*params, limit - 1)
+            )
+            boundary = cur.fetchall()
+            if len(boundary) == 2:
+                next_key = tuple(boundary[0])
+
+        cur = conn.execute(
+            f"SELECT * FROM {table_name} WHERE {where} ORDER BY {order}" + (" LIMIT ?" if limit is not None else ""),
+            (*params, limit) if limit is not None else params
+        )
+        columns = [column[0] for column in cur.description]
+
+        def batches():
+            try:
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    yield rows
+            finally:
+                conn.close()
 
-            cur.execute(f"SELECT total_dose AS head2_total FROM {self.SCHEDULES_TABLE_NAME} WHERE head = 2")
-            row = cur.fetchone()
-            head2_total = row["head2_total"] if row is not None else 0.0
+        return columns, batches(), next_key
 
-            result["head1"] = {"total_dose": head1_total if head1_total is not None else 0.0, "today_total": 0.0}
-            result["head2"] = {"total_dose": head2_total if head2_total is not None else 0.0, "today_total": 0.0}
+    @staticmethod
+    def encode_cursor(table_name: str, key: tuple) -> str:
+        """
+        Opaque cursor for the key of the last row of a page of table_name.
+        """
+        return base64.urlsafe_b64encode(json.dumps({"table": table_name, "key": list(key)}).encode()).decode()
 
-        with sqlite3.connect(self.logs_path) as conn:
+    @staticmethod
+    def decode_cursor(token: str, table_name: str) -> tuple:
+        """
+        Key held by a cursor from encode_cursor. Raises ValueError when the cursor is
+        malformed or was issued for another log table.
+        """
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor.")
+        if not isinstance(cursor, dict):
+            raise ValueError("Invalid cursor.")
+        key = cursor.get("key")
+        if not isinstance(key, list) or not all(isinstance(value, (str, int, float)) for value in key):
+            raise ValueError("Invalid cursor.")
+        if cursor.get("table") != table_name:
+            raise ValueError("Cursor does not match this log table.")
+        return tuple(key)
+    
+    @timed(SQLITE_LATENCY)
+    def prune_raw_logs(
+            self,
+            older_than_days: int,
+            archive_path: Optional[str] = None,
+            batch_size: int = 500,
+            vacuum_pages: int = 64,
+            pause: float = 0.05
+            ) -> dict:
+        """
+        Delete raw log entries older than older_than_days, copying them to the
+        raw_logs table of archive_path first when it is set. Their volumes are
+        already in the hourly logs and rollup tables, written with every dose, so
+        history and totals keep them. Rows are deleted and pages vacuumed in
+        small transactions with a pause in between so doses are never held up.
+        """
+        started = time.monotonic()
+        cutoff = (self.clock.now().date() - timedelta(days=older_than_days)).isoformat()
+        self.flush()
+        conn = self._connect(self.logs_path)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+
+        if archive_path is not None:
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS archive.{self.RAW_LOGS_TABLE_NAME} AS SELECT * FROM main.{self.RAW_LOGS_TABLE_NAME} WHERE 0"
+            )
+            # Archives created before the measured columns existed
+            self._add_columns(conn, self.RAW_LOGS_TABLE_NAME, {"actual_seconds": "REAL", "actual_ml": "REAL"}, schema="archive")
+
+        columns = ", ".join(row["name"] for row in conn.execute(f"PRAGMA main.table_info({self.RAW_LOGS_TABLE_NAME})").fetchall())
+        pruned = 0
+        try:
+            while True:
+                with conn:
+                    rowids = [
+                        row[0] for row in conn.execute(
+                            f"SELECT rowid FROM {self.RAW_LOGS_TABLE_NAME} WHERE date < ? ORDER BY date LIMIT ?",
+                            (cutoff, batch_size)
+                        ).fetchall()
+                    ]
+                    if not rowids:
+                        break
+                    selection = f"rowid IN ({', '.join('?' for _ in rowids)})"
+                    if archive_path is not None:
+                        conn.execute(
+                            f"INSERT INTO archive.{self.RAW_LOGS_TABLE_NAME} ({columns}) SELECT {columns} FROM main.{self.RAW_LOGS_TABLE_NAME} WHERE {selection}",
+                            rowids
+                        )
+                    conn.execute(f"DELETE FROM main.{self.RAW_LOGS_TABLE_NAME} WHERE {selection}", rowids)
+                pruned += len(rowids)
+                time.sleep(pause)
+        finally:
+            if archive_path is not None:
+                conn.execute("DETACH DATABASE archive")
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            while free_pages > 0:
+                conn.execute(f"PRAGMA incremental_vacuum({vacuum_pages})").fetchall()
+                remaining_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if remaining_pages >= free_pages:
+                    break
+                free_pages = remaining_pages
+                time.sleep(pause)
+        pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+
+        report = {
+            "cutoff": cutoff,
+            "rows_pruned": pruned,
+            "archived_to": archive_path,
+            "bytes_reclaimed": (pages_before - pages_after) * page_size,
+            "seconds": time.monotonic() - started,
+        }
+        logger.info(f"Pruned raw logs: {report}")
+        return report
+
+    @timed(SQLITE_LATENCY)
+    def append_archive_segment(self, archive, settle_seconds: float = 60.0, max_rows: int = 100_000) -> dict:
+        """
+        Append the raw log entries newer than the archive's watermark to the
+        ColumnarArchive archive, in segments of at most max_rows. Entries from
+        the last settle_seconds are left for the next run so a dose still being
+        recorded is never skipped.
+        """
+        started = time.monotonic()
+        self.flush()
+        watermark = archive.watermark()
+        clauses = ["time <= ?"]
+        params = [(self.clock.now() - timedelta(seconds=settle_seconds)).isoformat()]
+        if watermark is not None:
+            clauses.append("time > ?")
+            params.append(watermark.isoformat())
+
+        appended = []
+        with self._connect(self.logs_path) as conn:
+            cur = conn.execute(
+                f"""
+                SELECT time, head, mode, ml, actual_seconds, actual_ml FROM {self.RAW_LOGS_TABLE_NAME}
+                WHERE {" AND ".join(clauses)}
+                ORDER BY time
+                """,
+                params
+            )
+            while True:
+                rows = cur.fetchmany(max_rows)
+                if not rows:
+                    break
+                appended.append(archive.append([tuple(row) for row in rows]))
+
+        report = {
+            "segments": appended,
+            "rows": sum(segment["rows"] for segment in appended),
+            "seconds": time.monotonic() - started,
+        }
+        logger.info(f"Appended to columnar archive: {report}")
+        return report
+
+    def history_resolution(self, start: datetime, end: datetime, max_points: int = 500, mode: Optional[str] = None) -> str:
+        """
+        Finest resolution that covers start..end in at most max_points buckets.
+        Hourly history has no mode breakdown, so a mode filter starts at daily.
+        """
+        span = end - start
+        buckets = {
+            "hourly": span.total_seconds() / 3600,
+            "daily": span.days,
+            "monthly": (end.year - start.year) * 12 + end.month - start.month,
+        }
+        for resolution in ("hourly", "daily"):
+            if resolution == "hourly" and mode is not None:
+                continue
+            if buckets[resolution] < max_points:
+                return resolution
+        return "monthly"
+
+    @timed(SQLITE_LATENCY)
+    def fetch_history(
+            self,
+            resolution: str,
+            start: datetime,
+            end: datetime,
+            head: Optional[int] = None,
+            mode: Optional[str] = None
+            ) -> List[dict]:
+        """
+        Dosed totals per bucket, head and mode from the rollup table for resolution.
+        Hourly buckets come from the hourly logs, with mode and doses left empty.
+        """
+        if resolution == "hourly":
+            return self._fetch_hourly_history(start, end, head, mode)
+        table, bucket_format, _ = self.ROLLUPS[resolution]
+        clauses = ["bucket >= ?", "bucket <= ?"]
+        params = [start.strftime(bucket_format), end.strftime(bucket_format)]
+        if head is not None:
+            clauses.append("head = ?")
+            params.append(head)
+        if mode is not None:
+            clauses.append("mode = ?")
+            params.append(mode)
+
+        self.flush()
+        with self._connect(self.logs_path) as conn:
             cur = conn.cursor()
             cur.execute(
                 f"""
-                SELECT 
-                    SUM(head1) as total_head1,
-                    SUM(head2) as total_head2
-                FROM {self.LOGS_TABLE_NAME}
-                WHERE date = ?
+                SELECT bucket, head, mode, ml, doses FROM {table}
+                WHERE {" AND ".join(clauses)}
+                ORDER BY bucket, head, mode
                 """,
-                (today,)
+                params
             )
-            row = cur.fetchone()
-            total_head1 = row[0] if row[0] is not None else 0.0
-            total_head2 = row[1] if row[1] is not None else 0.0
-            result["head1"]["today_total"] = total_head1
-            result["head2"]["today_total"] = total_head2
-            return result
+            rows = cur.fetchall()
+        return [dict(r) for r in rows]
+    
+    def _fetch_hourly_history(self, start: datetime, end: datetime, head: Optional[int], mode: Optional[str]) -> List[dict]:
+        if mode is not None:
+            raise ValueError("Hourly history has no mode breakdown, use daily or monthly resolution.")
+        clauses = ["(date, hour) >= (?, ?)", "(date, hour) <= (?, ?)"]
+        params = [start.date().isoformat(), start.strftime("%H:00"), end.date().isoformat(), end.strftime("%H:00")]
+        if head is not None:
+            clauses.append("head = ?")
+            params.append(head)
 
-    def fetch_all_logs(self, table_name, days = 7) -> List[Tuple[str, str, int, str, float, str]]:
-        with sqlite3.connect(self.logs_path) as conn:
-            conn.row_factory = sqlite3.Row
+        self.flush()
+        with self._connect(self.logs_path) as conn:
             cur = conn.cursor()
-            cur.execute(f"SELECT * FROM {table_name} WHERE date >= date('now', '-{days} day')")
+            cur.execute(
+                f"""
+                SELECT date || 'T' || hour AS bucket, head, NULL AS mode, ml, NULL AS doses FROM {self.LOGS_TABLE_NAME}
+                WHERE {" AND ".join(clauses)}
+                ORDER BY date, hour, head
+                """,
+                params
+            )
             rows = cur.fetchall()
         return [dict(r) for r in rows]
-    
+
+    @timed(SQLITE_LATENCY)
     def fetch_all_schedules(self, days = 7) -> List[Tuple[str, str, int, str, float, str]]:
-        with sqlite3.connect(self.schedules_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._cache_lock:
+            schedules = self._cached("schedules", self._load_schedules)
+            return {head: dict(schedule) for head, schedule in schedules.items()}
+
+    def _load_schedules(self) -> dict:
+        with self._connect(self.schedules_path) as conn:
             cur = conn.cursor()
-            cur.execute(f"SELECT * FROM {self.SCHEDULES_TABLE_NAME}")
+            cur.execute(f"SELECT head, total_dose, doses_per_day, window_start, window_end FROM {self.SCHEDULES_TABLE_NAME}")
             rows = cur.fetchall()
         return {
             head: {
                 "total_dose": total_dose,
-                "doses_per_day": doses_per_day
+                "doses_per_day": doses_per_day,
+                "window_start": window_start,
+                "window_end": window_end
             }
-            for head, total_dose, doses_per_day in rows
-        }
\ No newline at end of file
+            for head, total_dose, doses_per_day, window_start, window_end in rows
+        }
+
+    @timed(SQLITE_LATENCY)
+    def fetch_schedules_with_state(self) -> Tuple[dict, dict]:
+        """
+        Read every schedule and its persisted scheduler state in one query,
+        priming the schedules cache on the way.
+        """
+        with self._connect(self.schedules_path) as conn:
+            rows = conn.execute(
+                f"""
+                SELECT s.head, s.total_dose, s.doses_per_day, s.window_start, s.window_end, st.last_fired, st.next_due
+                FROM {self.SCHEDULES_TABLE_NAME} s
+                LEFT JOIN {self.SCHEDULER_STATE_TABLE_NAME} st ON st.head = s.head
+                """
+            ).fetchall()
+
+        schedules, state = {}, {}
+        for head, total_dose, doses_per_day, window_start, window_end, last_fired, next_due in rows:
+            schedules[head] = {
+                "total_dose": total_dose,
+                "doses_per_day": doses_per_day,
+                "window_start": window_start,
+                "window_end": window_end
+            }
+            state[head] = {
+                "last_fired": datetime.fromisoformat(last_fired) if last_fired else None,
+                "next_due": datetime.fromisoformat(next_due) if next_due else None
+            }
+        with self._cache_lock:
+            self._cache["schedules"] = {head: dict(schedule) for head, schedule in schedules.items()}
+        return schedules, state
+
+    def update_scheduler_state(self, head: int, last_fired: Optional[datetime], next_due: Optional[datetime]) -> None:
+        """
+        Record when head last fired and when it is next due. A None last_fired keeps the stored one.
+        """
+        self.update_scheduler_states({head: (last_fired, next_due)})
+
+    @timed(SQLITE_LATENCY)
+    def update_scheduler_states(self, states: Dict[int, Tuple[Optional[datetime], Optional[datetime]]]) -> None:
+        """
+        update_scheduler_state for several heads in one transaction: head -> (last_fired, next_due).
+        """
+        with self._connect(self.schedules_path) as conn:
+            conn.executemany(
+                f"""
+                INSERT INTO {self.SCHEDULER_STATE_TABLE_NAME} (head, last_fired, next_due)
+                VALUES (?, ?, ?)
+                ON CONFLICT(head) DO UPDATE SET
+                    last_fired = COALESCE(excluded.last_fired, last_fired),
+                    next_due = excluded.next_due
+                """,
+                [
+                    (
+                        head,
+                        last_fired.isoformat() if last_fired else None,
+                        next_due.isoformat() if next_due else None
+                    )
+                    for head, (last_fired, next_due) in states.items()
+                ]
+            )
@@ -0,0 +1,76 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+@dataclass(frozen=True)
+class Settings:
+    storage_mode: str = "single"
+    db_path: str = "/mnt/doser.db"
+    logs_path: str = "/mnt/logs.db"
+    schedules_path: str = "/mnt/schedules.db"
+    remaining_path: str = "/mnt/remaining.db"
+    write_behind: bool = True
+    journal_max_batch: int = 50
+    journal_max_delay: float = 5.0
+    queue_depth: int = 5
+    power_budget_amps: float = 1.0
+    gpio_backend: str = "rpi"
+    clock_speed: float = 1.0
+    clock_start: Optional[datetime] = None
+    retention_days: int = 0
+    retention_archive_path: Optional[str] = None
+    schedule_stagger_seconds: float = 30.0
+    schedule_grace_seconds: float = 300.0
+    catch_up_policy: str = "skip"
+    actuator_spin_seconds: float = 0.002
+    heads_path: Optional[str] = None
+    event_buffer_size: int = 100
+    storage_workers: int = 2
+    forecast_history_days: int = 90
+    columnar_archive_path: Optional[str] = None
+    gateway_nodes_path: Optional[str] = None
+    gateway_timeout: float = 2.0
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _env_datetime(name: str) -> Optional[datetime]:
+    value = os.environ.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+def load_settings() -> Settings:
+    """
+    Build the service settings from DOSER_* environment variables, falling back to the defaults above.
+    """
+    return Settings(
+        storage_mode=os.environ.get("DOSER_STORAGE_MODE", Settings.storage_mode),
+        db_path=os.environ.get("DOSER_DB_PATH", Settings.db_path),
+        logs_path=os.environ.get("DOSER_LOGS_PATH", Settings.logs_path),
+        schedules_path=os.environ.get("DOSER_SCHEDULES_PATH", Settings.schedules_path),
+        remaining_path=os.environ.get("DOSER_REMAINING_PATH", Settings.remaining_path),
+        write_behind=_env_bool("DOSER_WRITE_BEHIND", Settings.write_behind),
+        journal_max_batch=int(os.environ.get("DOSER_JOURNAL_MAX_BATCH", Settings.journal_max_batch)),
+        journal_max_delay=float(os.environ.get("DOSER_JOURNAL_MAX_DELAY", Settings.journal_max_delay)),
+        queue_depth=int(os.environ.get("DOSER_QUEUE_DEPTH", Settings.queue_depth)),
+        power_budget_amps=float(os.environ.get("DOSER_POWER_BUDGET_AMPS", Settings.power_budget_amps)),
+        gpio_backend=os.environ.get("DOSER_GPIO_BACKEND", Settings.gpio_backend),
+        clock_speed=float(os.environ.get("DOSER_CLOCK_SPEED", Settings.clock_speed)),
+        clock_start=_env_datetime("DOSER_CLOCK_START"),
+        retention_days=int(os.environ.get("DOSER_RETENTION_DAYS", Settings.retention_days)),
+        retention_archive_path=os.environ.get("DOSER_RETENTION_ARCHIVE_PATH") or None,
+        schedule_stagger_seconds=float(os.environ.get("DOSER_SCHEDULE_STAGGER_SECONDS", Settings.schedule_stagger_seconds)),
+        schedule_grace_seconds=float(os.environ.get("DOSER_SCHEDULE_GRACE_SECONDS", Settings.schedule_grace_seconds)),
+        catch_up_policy=os.environ.get("DOSER_CATCH_UP_POLICY", Settings.catch_up_policy),
+        actuator_spin_seconds=float(os.environ.get("DOSER_ACTUATOR_SPIN_SECONDS", Settings.actuator_spin_seconds)),
+        heads_path=os.environ.get("DOSER_HEADS_PATH") or None,
+        event_buffer_size=int(os.environ.get("DOSER_EVENT_BUFFER_SIZE", Settings.event_buffer_size)),
+        storage_workers=int(os.environ.get("DOSER_STORAGE_WORKERS", Settings.storage_workers)),
+        forecast_history_days=int(os.environ.get("DOSER_FORECAST_HISTORY_DAYS", Settings.forecast_history_days)),
+        columnar_archive_path=os.environ.get("DOSER_COLUMNAR_ARCHIVE_PATH") or None,
+        gateway_nodes_path=os.environ.get("DOSER_GATEWAY_NODES_PATH") or None,
+        gateway_timeout=float(os.environ.get("DOSER_GATEWAY_TIMEOUT", Settings.gateway_timeout)),
+    )
@@ -0,0 +1,91 @@
+import asyncio
+import itertools
+import threading
+from collections import deque
+from typing import Deque, List, Optional, Set
+
+from app.hardware.clock import Clock
+
+EVENT_TYPES = ("dose-start", "dose-complete", "remaining-changed", "schedule-changed")
+
+class Subscription:
+    """
+    One subscriber's bounded buffer. When the subscriber falls behind, the
+    oldest events are dropped and counted so it knows to resync.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer_size: int, types: Optional[Set[str]] = None) -> None:
+        self.types = types
+        self.dropped = 0
+        self._loop = loop
+        self._buffer: Deque[dict] = deque()
+        self._buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def put(self, event: dict) -> None:
+        if self.types is not None and event["type"] not in self.types:
+            return
+        with self._lock:
+            if len(self._buffer) >= self._buffer_size:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # Loop already closed, the subscriber is going away
+
+    async def get(self, timeout: float) -> List[dict]:
+        """
+        Wait up to timeout seconds for events and return everything buffered (possibly nothing).
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        with self._lock:
+            events = list(self._buffer)
+            self._buffer.clear()
+        return events
+
+class EventBus:
+    """
+    In-process pub/sub for dose, remaining and schedule events.
+
+    publish() may be called from any thread and never blocks on subscribers:
+    each one gets the event appended to its own bounded buffer and its event
+    loop woken up.
+    """
+    def __init__(self, clock: Optional[Clock] = None, buffer_size: int = 100) -> None:
+        self.clock = clock or Clock()
+        self.buffer_size = buffer_size
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+
+    def subscribe(self, types: Optional[Set[str]] = None) -> Subscription:
+        """
+        Subscribe from a running event loop, optionally to some event types only.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), self.buffer_size, types)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, type: str, data: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        event = {"id": next(self._sequence), "type": type, "time": self.clock.now().isoformat(), "data": data}
+        for subscription in subscribers:
+            subscription.put(event)
@@ -0,0 +1,145 @@
+import math
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from app.clients.dose_journal import DoseEntry
+from app.hardware.clock import Clock
+
+ROLLING_WINDOWS = (7, 30)
+TREND_DAYS = 30
+
+# First axis of the daily array: scheduled doses vs manual and primer runs
+SCHEDULED, UNSCHEDULED = 0, 1
+
+def _json_float(value: float) -> Optional[float]:
+    return None if math.isnan(value) or math.isinf(value) else float(value)
+
+class ConsumptionModel:
+    """
+    Per-head daily consumption held in a NumPy array, for /forecast.
+
+    The array is loaded once from the daily rollup and then updated in place
+    by every recorded dose (register it in SQliteClient.dose_listeners), so a
+    forecast is a handful of vectorized reductions over the last TREND_DAYS
+    columns, however much history the database holds.
+    """
+    def __init__(self, heads: Iterable[int], clock: Optional[Clock] = None, history_days: int = 90) -> None:
+        self.clock = clock or Clock()
+        self.heads = tuple(sorted(heads))
+        self.history_days = history_days
+        self._rows = {head: row for row, head in enumerate(self.heads)}
+        self._origin = self.clock.now().date() - timedelta(days=history_days)
+        # [scheduled/unscheduled, head, day since origin] -> ml
+        self._daily = np.zeros((2, len(self.heads), history_days + 366))
+        self._lock = threading.Lock()
+
+    def load(self, sqlite_client) -> None:
+        """
+        Fill the array from the daily rollup. Call before any dose can be recorded.
+        """
+        start = datetime.combine(self._origin, datetime.min.time())
+        rows = sqlite_client.fetch_history("daily", start, self.clock.now())
+        if not rows:
+            return
+        days = (
+            np.array([row["bucket"] for row in rows], dtype="datetime64[D]") - np.datetime64(self._origin, "D")
+        ).astype(np.int64)
+        heads = np.array([self._rows.get(row["head"], -1) for row in rows])
+        groups = np.array([SCHEDULED if row["mode"] == "Scheduled" else UNSCHEDULED for row in rows])
+        ml = np.array([row["ml"] for row in rows], dtype=np.float64)
+        with self._lock:
+            keep = (heads >= 0) & (days >= 0) & (days < self._daily.shape[2])
+            np.add.at(self._daily, (groups[keep], heads[keep], days[keep]), ml[keep])
+
+    def record(self, entry: DoseEntry) -> None:
+        row = self._rows.get(entry.head)
+        if row is None:
+            return
+        group = SCHEDULED if entry.mode == "Scheduled" else UNSCHEDULED
+        with self._lock:
+            day = self._index(entry.timestamp.date())
+            if day >= 0:
+                self._daily[group, row, day] += entry.ml
+
+    def _index(self, day: date) -> int:
+        """
+        Column of day, sliding the window forward (and dropping the oldest days) when day is past its end.
+        Called with the lock held.
+        """
+        index = (day - self._origin).days
+        capacity = self._daily.shape[2]
+        if index >= capacity:
+            shift = index - self.history_days
+            kept = self._daily[:, :, shift:]
+            self._daily = np.zeros_like(self._daily)
+            self._daily[:, :, :kept.shape[2]] = kept
+            self._origin += timedelta(days=shift)
+            index -= shift
+        return index
+
+    def forecast(self, remaining: Dict[int, Optional[float]], schedules: Dict[int, dict], days: int = 0) -> dict:
+        """
+        Per head: today's consumption, rolling daily averages over complete days,
+        the trend (ml/day change per day over the last TREND_DAYS), the projected
+        daily use (scheduled dose plus the average of manual and primer runs) and
+        when the container runs dry at that rate. days > 0 adds the last days of
+        daily consumption, today included.
+        """
+        now = self.clock.now()
+        with self._lock:
+            today = self._index(now.date())
+            start = max(0, today - TREND_DAYS)
+            window = self._daily[:, :, start:today].copy()
+            today_ml = self._daily[:, :, today].sum(axis=0)
+            recent = self._daily[:, :, max(0, today - days + 1):today + 1].sum(axis=0) if days > 0 else None
+
+        total = window.sum(axis=0)
+        length = total.shape[1]
+        # Only count days since a head was first used, so a fresh install isn't averaged over empty days
+        used = total > 0
+        first = np.where(used.any(axis=1), used.argmax(axis=1), length)
+        active = length - first
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            def average(values: np.ndarray, window_days: int) -> np.ndarray:
+                return values[:, max(0, length - window_days):].sum(axis=1) / np.minimum(window_days, active)
+
+            averages = {window_days: average(total, window_days) for window_days in ROLLING_WINDOWS}
+            scheduled_history = average(window[SCHEDULED], ROLLING_WINDOWS[0])
+            unscheduled = average(window[UNSCHEDULED], ROLLING_WINDOWS[-1])
+
+            x = np.arange(length, dtype=np.float64)
+            mask = x[None, :] >= first[:, None]
+            count = mask.sum(axis=1)
+            x_mean = (x * mask).sum(axis=1) / count
+            y_mean = (total * mask).sum(axis=1) / count
+            dx = (x[None, :] - x_mean[:, None]) * mask
+            trend = (dx * (total - y_mean[:, None])).sum(axis=1) / (dx ** 2).sum(axis=1)
+            trend[count < 2] = np.nan
+
+            scheduled = np.array([
+                (schedules.get(head) or {}).get("total_dose") or np.nan for head in self.heads
+            ], dtype=np.float64)
+            projected = np.where(np.isnan(scheduled), np.nan_to_num(scheduled_history), scheduled) + np.nan_to_num(unscheduled)
+            left = np.array([np.nan if remaining.get(head) is None else remaining[head] for head in self.heads], dtype=np.float64)
+            days_to_empty = np.where(projected > 0, np.maximum(left, 0) / projected, np.inf)
+
+        result = {}
+        for row, head in enumerate(self.heads):
+            empty_in = _json_float(days_to_empty[row])
+            result[head] = {
+                "remaining": _json_float(left[row]),
+                "today": float(today_ml[row]),
+                "averages": {f"{window_days}d": _json_float(averages[window_days][row]) for window_days in ROLLING_WINDOWS},
+                "trend": _json_float(trend[row]),
+                "scheduled": _json_float(scheduled[row]),
+                "projected": float(projected[row]),
+                "days_to_empty": empty_in,
+                "empty_at": (now + timedelta(days=empty_in)).isoformat() if empty_in is not None else None,
+            }
+            if recent is not None:
+                result[head]["daily"] = [float(ml) for ml in recent[row]]
+        return result
@@ -0,0 +1 @@
+# This file can be empty, but it indicates that the directory is a package.
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import httpx
+
+OVERVIEW_PATHS = {"remaining": "/remaining", "totals": "/totals", "jobs": "/jobs"}
+
+def load_gateway_nodes(path: str) -> Dict[str, str]:
+    """
+    Read the controller registry from a JSON object mapping node name to base URL,
+    e.g. {"tank1": "http://10.0.0.21:8000"}.
+    """
+    with open(path) as f:
+        nodes = json.load(f)
+    if not isinstance(nodes, dict) or not all(isinstance(url, str) for url in nodes.values()):
+        raise ValueError(f"{path} must be a JSON object of node name to base URL.")
+    return {str(name): url.rstrip("/") for name, url in nodes.items()}
+
+class FleetGateway:
+    """
+    Fans requests out to a registry of doser controllers concurrently.
+
+    All nodes share one pooled keep-alive AsyncClient, each node call has its
+    own deadline, and a node that fails or times out is reported next to the
+    others with its last good response (marked stale) instead of failing the
+    whole request. A fleet-wide call therefore takes about as long as the
+    slowest node. mounts is passed to httpx, e.g. to route nodes to local
+    create_app() instances through httpx.ASGITransport.
+    """
+    def __init__(
+        self,
+        nodes: Optional[Dict[str, str]] = None,
+        timeout: float = 2.0,
+        max_connections: int = 100,
+        mounts: Optional[Dict[str, httpx.AsyncBaseTransport]] = None
+    ) -> None:
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.mounts = mounts
+        self.client: Optional[httpx.AsyncClient] = None
+        self._nodes: Dict[str, str] = {name: url.rstrip("/") for name, url in (nodes or {}).items()}
+        # (node, path, params) -> (data, fetched_at) of the last successful call
+        self._last_good: Dict[Tuple[str, str, tuple], Tuple[Any, str]] = {}
+
+    async def start(self) -> None:
+        """
+        Open the shared connection pool. Must run on the event loop that will use it.
+        """
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                mounts=self.mounts
+            )
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def __aenter__(self) -> "FleetGateway":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def nodes(self) -> Dict[str, str]:
+        return dict(self._nodes)
+
+    def add_node(self, name: str, url: str) -> None:
+        self._nodes[name] = url.rstrip("/")
+
+    def remove_node(self, name: str) -> bool:
+        """
+        Remove a node and its cached responses. Returns False if it was not registered.
+        """
+        if self._nodes.pop(name, None) is None:
+            return False
+        for key in [key for key in self._last_good if key[0] == name]:
+            del self._last_good[key]
+        return True
+
+    async def fan_out(self, path: str, params: Optional[Dict[str, Any]] = None, names: Optional[Iterable[str]] = None) -> dict:
+        """
+        GET path on every node (or the named ones) at once.
+
+        Returns {"nodes": {name: result}, "failed": [...], "elapsed": seconds} where
+        each result has ok, elapsed and either data or error; a failed node
+        with a previous good response also carries that data with stale=True.
+        """
+        await self.start()
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        # Snapshot the registry: PUT/DELETE /nodes may change it while the requests are out
+        nodes = dict(self._nodes) if names is None else {name: self._nodes[name] for name in names if name in self._nodes}
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._fetch(name, url, path, params) for name, url in nodes.items()))
+        by_node = dict(zip(nodes, results))
+        return {
+            "nodes": by_node,
+            "failed": [name for name, result in by_node.items() if not result["ok"]],
+            "elapsed": time.perf_counter() - started,
+        }
+
+    async def overview(self) -> dict:
+        """
+        /remaining, /totals and /jobs of every node, all requested concurrently.
+        """
+        started = time.perf_counter()
+        names = list(self._nodes)
+        parts = await asyncio.gather(*(self.fan_out(path, names=names) for path in OVERVIEW_PATHS.values()))
+        nodes = {name: {} for name in names}
+        failed = set()
+        for key, part in zip(OVERVIEW_PATHS, parts):
+            for name, result in part["nodes"].items():
+                nodes.setdefault(name, {})[key] = result
+            failed.update(part["failed"])
+        return {"nodes": nodes, "failed": sorted(failed), "elapsed": time.perf_counter() - started}
+
+    async def logs(self, **params) -> dict:
+        """
+        /logs of every node as JSON, merged into one list with a node field on each row.
+        """
+        params["format"] = "json"
+        result = await self.fan_out("/logs", params)
+        rows = []
+        for name, node in result["nodes"].items():
+            data = node.pop("data", None)
+            try:
+                rows.extend([dict(row, node=name) for row in data or []])
+            except Exception as e:
+                node.update(ok=False, error=f"Unexpected /logs response: {e or type(e).__name__}")
+                node.pop("stale", None)
+                node.pop("fetched_at", None)
+                if name not in result["failed"]:
+                    result["failed"].append(name)
+        result["logs"] = rows
+        return result
+
+    async def _fetch(self, name: str, url: str, path: str, params: Dict[str, Any]) -> dict:
+        key = (name, path, tuple(sorted(params.items())))
+        started = time.perf_counter()
+        try:
+            # wait_for bounds the whole call, httpx's own timeout only bounds each network operation
+            response = await asyncio.wait_for(self.client.get(url + path, params=params), self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except asyncio.TimeoutError:
+            return self._failure(key, f"No answer within {self.timeout}s", started)
+        except Exception as e:
+            # Any failure of one node, down or answering garbage, is reported on that node only
+            return self._failure(key, str(e) or type(e).__name__, started)
+
+        fetched_at = datetime.now().isoformat()
+        self._last_good[key] = (data, fetched_at)
+        return {"ok": True, "data": data, "fetched_at": fetched_at, "elapsed": time.perf_counter() - started}
+
+    def _failure(self, key: Tuple[str, str, tuple], error: str, started: float) -> dict:
+        result = {
+            "ok": False,
+            "error": error,
+            "elapsed": time.perf_counter() - started,
+        }
+        last_good = self._last_good.get(key)
+        if last_good is not None:
+            result.update(data=last_good[0], fetched_at=last_good[1], stale=True)
+        return result
@@ -0,0 +1,48 @@
+import logging
+
+from fastapi import FastAPI
+from app.gateway.fleet import FleetGateway, load_gateway_nodes
+from app.gateway.routes import get_router
+from app.api.middleware import LatencyMiddleware
+from app.config import load_settings
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+def create_gateway_app(gateway: FleetGateway = None) -> FastAPI:
+    """
+    FastAPI app fronting a fleet of doser controllers. Without a gateway one is
+    built from DOSER_GATEWAY_NODES_PATH and DOSER_GATEWAY_TIMEOUT.
+    """
+    app = FastAPI()
+    settings = load_settings()
+
+    # --- Controller registry and shared connection pool ---
+    if gateway is None:
+        nodes = load_gateway_nodes(settings.gateway_nodes_path) if settings.gateway_nodes_path else {}
+        gateway = FleetGateway(nodes, timeout=settings.gateway_timeout)
+    app.state.gateway = gateway
+
+    # --- Register API routes ---
+    app.include_router(get_router(gateway))
+
+    # --- Metrics: request latency and the registry size ---
+    app.add_middleware(LatencyMiddleware)
+    REGISTRY.callback(
+        "doser_gateway_nodes", "Controllers registered with the gateway.", "gauge",
+        lambda: [({}, len(gateway.nodes()))]
+    )
+
+    # --- The pool is bound to the serving event loop, so open and close it there ---
+    @app.on_event("startup")
+    async def startup_event():
+        await gateway.start()
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        await gateway.close()
+
+    logger.info(f"Gateway fronting {len(gateway.nodes())} controllers")
+    return app
+
+app = create_gateway_app()
@@ -0,0 +1,126 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.metrics import REGISTRY
+from typing import Optional
+
+def get_router(gateway):
+    router = APIRouter()
+
+    @router.get(
+        "/nodes",
+        summary="Get registered controllers",
+        description="Get the doser controllers the gateway fans out to, by name and base URL."
+    )
+    async def get_nodes():
+        """
+        Get the controller registry.
+        """
+        return JSONResponse(content=gateway.nodes(), status_code=200)
+
+    @router.put(
+        "/nodes/{name}",
+        summary="Register a controller",
+        description="Add or replace a controller in the registry (until the gateway restarts)."
+    )
+    async def put_node(name: str, url: str):
+        """
+        Register a controller under a name.
+        """
+        if not url.startswith(("http://", "https://")):
+            raise HTTPException(status_code=400, detail="Controller URL must start with http:// or https://.")
+        gateway.add_node(name, url)
+        return JSONResponse(content=f"Registered {name} at {url}.", status_code=200)
+
+    @router.delete(
+        "/nodes/{name}",
+        summary="Remove a controller",
+        description="Remove a controller and its cached responses from the registry."
+    )
+    async def delete_node(name: str):
+        """
+        Remove a controller from the registry.
+        """
+        if not gateway.remove_node(name):
+            raise HTTPException(status_code=404, detail=f"Unknown controller {name}.")
+        return JSONResponse(content=f"Removed {name}.", status_code=200)
+
+    @router.get(
+        "/metrics",
+        summary="Get Prometheus metrics",
+        description="Gateway request latency and registry size in the Prometheus text format."
+    )
+    async def get_metrics():
+        """
+        Get gateway metrics in the Prometheus text exposition format.
+        """
+        return PlainTextResponse(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    @router.get(
+        "/fleet/overview",
+        summary="Get a fleet-wide overview",
+        description=(
+            "Remaining liquid, totals and jobs of every controller, fetched concurrently. "
+            "Controllers that failed are listed in failed and show their last good response marked stale."
+        )
+    )
+    async def get_overview():
+        """
+        Get remaining, totals and jobs of every controller.
+        """
+        return JSONResponse(content=await gateway.overview(), status_code=200)
+
+    @router.get(
+        "/fleet/remaining",
+        summary="Get remaining liquid across the fleet",
+        description="Get /remaining of every controller, fetched concurrently."
+    )
+    async def get_remaining():
+        """
+        Get the remaining liquid amounts of every controller.
+        """
+        return JSONResponse(content=await gateway.fan_out("/remaining"), status_code=200)
+
+    @router.get(
+        "/fleet/totals",
+        summary="Get totals across the fleet",
+        description="Get /totals of every controller, fetched concurrently."
+    )
+    async def get_totals():
+        """
+        Get the dosed totals of every controller.
+        """
+        return JSONResponse(content=await gateway.fan_out("/totals"), status_code=200)
+
+    @router.get(
+        "/fleet/jobs",
+        summary="Get jobs across the fleet",
+        description="Get /jobs of every controller, fetched concurrently."
+    )
+    async def get_jobs():
+        """
+        Get the scheduled jobs of every controller.
+        """
+        return JSONResponse(content=await gateway.fan_out("/jobs"), status_code=200)
+
+    @router.get(
+        "/fleet/logs",
+        summary="Get logs across the fleet",
+        description=(
+            "Get /logs of every controller as one list, each row tagged with its controller in node. "
+            "limit applies per controller."
+        )
+    )
+    async def get_logs(
+        raw: Optional[bool] = False,
+        days: Optional[int] = 7,
+        head: Optional[int] = None,
+        mode: Optional[str] = None,
+        limit: Optional[int] = None
+    ):
+        """
+        Get the logs of every controller merged into one list.
+        """
+        result = await gateway.logs(raw=str(raw).lower(), days=days, head=head, mode=mode, limit=limit)
+        return JSONResponse(content=result, status_code=200)
+
+    return router
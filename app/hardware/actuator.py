@@ -0,0 +1,122 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from app.hardware.clock import Clock
+
+logger = logging.getLogger(__name__)
+
+class Actuator:
+    """
+    Runs timed outputs without holding a thread per run.
+
+    run_for() switches an output on and pushes its switch-off onto a deadline
+    heap kept on the clock's monotonic time. One timer thread sleeps until the
+    earliest deadline, switches the due outputs off and records the measured
+    on-time in seconds. The futures are resolved on a separate completion
+    thread, so the done callbacks (recording the dose, publishing events,
+    starting the next queued run) never hold up another head's switch-off.
+
+    With spin_seconds > 0 the thread sleeps until spin_seconds before the
+    deadline and busy-waits the rest, so scheduler oversleep does not end up
+    in the dose.
+    """
+    def __init__(self, clock: Optional[Clock] = None, spin_seconds: float = 0.0) -> None:
+        self.clock = clock or Clock()
+        self.spin_seconds = spin_seconds
+        self._heap: List[Tuple[float, int, Callable[[], None], float, Future]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        # One worker, so completions run in switch-off order
+        self._completions = ThreadPoolExecutor(max_workers=1, thread_name_prefix="actuator-completion")
+        self._thread = threading.Thread(target=self._run, name="actuator", daemon=True)
+        self._thread.start()
+
+    def run_for(self, seconds: float, on_fn: Callable[[], None], off_fn: Callable[[], None], lead: float = 0.0) -> Future:
+        """
+        Switch on now and off after seconds. off_fn is called lead seconds early
+        to absorb its own latency; the measured on-time includes the off_fn call.
+        """
+        future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Actuator has been shut down.")
+            on_fn()
+            started = self.clock.monotonic()
+            heapq.heappush(self._heap, (started + seconds - lead, next(self._sequence), off_fn, started, future))
+            self._condition.notify()
+        return future
+
+    def in_flight(self) -> int:
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    timeout = self._heap[0][0] - self.clock.monotonic()
+                    if timeout <= self.spin_seconds:
+                        break
+                    self.clock.wait(self._condition, timeout - self.spin_seconds)
+                if self._stopped:
+                    return
+                deadline = self._heap[0][0]
+
+            # Spin out the last stretch without the lock, yielding the GIL on every pass
+            while self.clock.monotonic() < deadline:
+                time.sleep(0)
+
+            with self._condition:
+                due = []
+                now = self.clock.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+
+            # Only switch off and measure here, the completion thread resolves the futures
+            results = []
+            for _, _, off_fn, started, future in due:
+                try:
+                    off_fn()
+                    results.append((future, self.clock.monotonic() - started, None))
+                except Exception as e:
+                    results.append((future, None, e))
+            self._completions.submit(self._resolve, results)
+
+    @staticmethod
+    def _resolve(results: List[Tuple[Future, Optional[float], Optional[Exception]]]) -> None:
+        for future, elapsed, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(elapsed)
+
+    def shutdown(self) -> None:
+        """
+        Stop the timer thread and switch off everything still running.
+        Interrupted runs fail with InterruptedError.
+        """
+        with self._condition:
+            self._stopped = True
+            pending, self._heap = self._heap, []
+            self._condition.notify()
+        self._thread.join()
+
+        results = []
+        for _, _, off_fn, started, future in pending:
+            try:
+                off_fn()
+            except Exception:
+                logger.exception("Failed to switch off output during shutdown")
+            results.append((future, None, InterruptedError(f"Interrupted after {self.clock.monotonic() - started:.2f}s")))
+        self._completions.submit(self._resolve, results)
+        # Let every completion, interrupted ones included, finish before returning
+        self._completions.shutdown(wait=True)
@@ -0,0 +1,43 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+class Clock:
+    """
+    Time source shared by the pump, storage and scheduler.
+
+    The default clock is real time. With speed above 1 it becomes a virtual
+    clock that starts at start (default: now) and runs speed times faster than
+    real time, so hours of dosing can be replayed in seconds. Durations handed
+    to wait() are in virtual seconds.
+    """
+    def __init__(self, speed: float = 1.0, start: Optional[datetime] = None) -> None:
+        if speed <= 0:
+            raise ValueError("Clock speed must be positive.")
+        self.speed = speed
+        self.virtual = speed != 1.0 or start is not None
+        self._real_origin = time.monotonic()
+        self._start = start or datetime.now()
+
+    def monotonic(self) -> float:
+        if not self.virtual:
+            return time.monotonic()
+        return (time.monotonic() - self._real_origin) * self.speed
+
+    def now(self) -> datetime:
+        if not self.virtual:
+            return datetime.now()
+        return self._start + timedelta(seconds=self.monotonic())
+
+    def to_real(self, seconds: float) -> float:
+        return seconds / self.speed
+
+    def wait(self, condition: threading.Condition, seconds: Optional[float] = None) -> bool:
+        """
+        Wait on condition (lock held) for up to seconds of clock time.
+        """
+        return condition.wait(None if seconds is None else self.to_real(seconds))
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(self.to_real(seconds))
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from app.hardware.dispatcher import PowerDispatcher
+from app.hardware.pump import PUMP_HEADS, UPPER_LIMIT
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Command:
+    id: str
+    head: int
+    mode: str
+    ml: float
+    status: str = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    run_ml: Optional[float] = None
+    coalesced_with: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+class QueueFullError(Exception):
+    def __init__(self, head: int, depth: int) -> None:
+        super().__init__(f"Command queue for head {head} is full ({depth} waiting).")
+        self.head = head
+        self.depth = depth
+
+class CommandQueue:
+    """
+    Serialises dose commands per pump head.
+
+    Each head runs at most one dose at a time. Commands waiting behind it are
+    coalesced into one longer run when they share a mode and the combined
+    volume stays within UPPER_LIMIT. Each head accepts at most max_depth
+    waiting commands; submit() raises QueueFullError beyond that.
+    """
+    def __init__(self, dispatcher: PowerDispatcher, max_depth: int = 5, history: int = 256) -> None:
+        self.dispatcher = dispatcher
+        self.max_depth = max_depth
+        self.history = history
+
+        self._queues: Dict[int, deque] = {head: deque() for head in PUMP_HEADS}
+        self._running: Dict[int, Optional[List[Command]]] = {head: None for head in PUMP_HEADS}
+        self._commands: "OrderedDict[str, Command]" = OrderedDict()
+        # Re-entrant because a dose future that is already done runs its callback inline
+        self._lock = threading.RLock()
+
+    def submit(self, head: int, mode: str, ml: float, enforce_limit: bool = True) -> Command:
+        with self._lock:
+            queue = self._queues[head]
+            if enforce_limit and len(queue) >= self.max_depth:
+                raise QueueFullError(head, len(queue))
+
+            command = Command(id=uuid4().hex, head=head, mode=mode, ml=ml)
+            queue.append(command)
+            self._commands[command.id] = command
+            while len(self._commands) > self.history:
+                self._commands.popitem(last=False)
+
+            if self._running[head] is None:
+                self._start_next(head)
+        return command
+
+    def get(self, command_id: str) -> Optional[Command]:
+        with self._lock:
+            return self._commands.get(command_id)
+
+    def depth(self, head: int) -> int:
+        with self._lock:
+            return len(self._queues[head])
+
+    def _start_next(self, head: int) -> None:
+        queue = self._queues[head]
+        while queue:
+            batch = [queue.popleft()]
+            total = batch[0].ml
+            while queue and queue[0].mode == batch[0].mode and total + queue[0].ml <= UPPER_LIMIT:
+                command = queue.popleft()
+                batch.append(command)
+                total += command.ml
+
+            ids = [command.id for command in batch]
+            for command in batch:
+                command.status = "running"
+                command.run_ml = total
+                command.coalesced_with = [i for i in ids if i != command.id]
+
+            self._running[head] = batch
+            try:
+                future = self.dispatcher.dose(head, batch[0].mode, total)
+            except Exception as e:
+                logger.exception(f"Failed to start dose on head {head}")
+                self._mark(batch, "failed", str(e))
+                continue
+            future.add_done_callback(partial(self._finish, head, batch))
+            return
+        self._running[head] = None
+
+    def _finish(self, head: int, batch: List[Command], future: Future) -> None:
+        with self._lock:
+            error = future.exception()
+            if error is None:
+                self._mark(batch, "done")
+            else:
+                self._mark(batch, "failed", str(error))
+            self._start_next(head)
+
+    def _mark(self, batch: List[Command], status: str, error: Optional[str] = None) -> None:
+        for command in batch:
+            command.status = status
+            command.error = error
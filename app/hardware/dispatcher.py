@@ -0,0 +1,163 @@
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, List, Tuple
+
+from app.hardware.pump import Pump, PUMP_HEADS
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PendingRun:
+    head: int
+    mode: str
+    ml: float
+    seconds: float
+    amps: float
+    queued_at: float
+    future: Future = field(default_factory=Future)
+
+class PowerDispatcher:
+    """
+    Starts pump runs without exceeding the shared supply's current budget.
+
+    dose() has the same signature as Pump.dose and returns a future for the
+    run. Waiting runs are packed longest-first into whatever budget is free,
+    so short runs fill the gaps next to long ones. A run that has waited
+    longer than starvation_seconds is started before anything else and holds
+    back smaller runs until it fits.
+    """
+    def __init__(self, pump: Pump, budget_amps: float, starvation_seconds: float = 60.0) -> None:
+        self.pump = pump
+        self.clock = pump.clock
+        self.budget_amps = budget_amps
+        self.starvation_seconds = starvation_seconds
+
+        self._waiting: List[PendingRun] = []
+        self._active: Dict[int, PendingRun] = {}
+        self._lock = threading.Lock()
+
+        self._runs = 0
+        self._busy_seconds = 0.0
+        self._wall_seconds = 0.0
+        self._active_since = None
+        self._peak_concurrency = 0
+        self._peak_amps = 0.0
+
+    def dose(self, head_id: int, mode: str, ml: float) -> Future:
+        head = PUMP_HEADS[head_id]
+        if head.current_draw_amps > self.budget_amps:
+            raise ValueError(
+                f"Head {head_id} draws {head.current_draw_amps}A, more than the {self.budget_amps}A budget."
+            )
+
+        run = PendingRun(
+            head=head_id,
+            mode=mode,
+            ml=ml,
+            seconds=head.on_seconds(ml),
+            amps=head.current_draw_amps,
+            queued_at=self.clock.monotonic()
+        )
+        with self._lock:
+            self._waiting.append(run)
+            started, failed = self._pack()
+        self._settle(started, failed)
+        return run.future
+
+    def _used_amps(self) -> float:
+        return sum(run.amps for run in self._active.values())
+
+    def _pack(self) -> Tuple[List[Tuple[PendingRun, float, Future]], List[Tuple[Future, Exception]]]:
+        """
+        Start every waiting run that fits the free budget. Called with the lock held.
+        Returns the runs that started and the runs that failed to start, both handed
+        to _settle after the lock is released.
+        """
+        started = []
+        failed = []
+        now = self.clock.monotonic()
+        order = sorted(
+            self._waiting,
+            key=lambda run: (now - run.queued_at < self.starvation_seconds, -run.seconds)
+        )
+        for run in order:
+            if run.head in self._active:
+                continue
+            if self._used_amps() + run.amps > self.budget_amps:
+                if now - run.queued_at >= self.starvation_seconds:
+                    break
+                continue
+
+            self._waiting.remove(run)
+            try:
+                future = self.pump.dose(run.head, run.mode, run.ml)
+            except Exception as e:
+                logger.exception(f"Failed to start dose on head {run.head}")
+                failed.append((run.future, e))
+                continue
+
+            if not self._active:
+                self._active_since = self.clock.monotonic()
+            self._active[run.head] = run
+            self._runs += 1
+            self._peak_concurrency = max(self._peak_concurrency, len(self._active))
+            self._peak_amps = max(self._peak_amps, self._used_amps())
+            started.append((run, self.clock.monotonic(), future))
+        return started, failed
+
+    def _finish(self, run: PendingRun, started: float, future: Future) -> None:
+        with self._lock:
+            now = self.clock.monotonic()
+            self._active.pop(run.head, None)
+            self._busy_seconds += now - started
+            if not self._active and self._active_since is not None:
+                self._wall_seconds += now - self._active_since
+                self._active_since = None
+            started, failed = self._pack()
+
+        # Resolve outside the lock, callers may submit their next run from the callback
+        error = future.exception()
+        if error is None:
+            run.future.set_result(future.result())
+        else:
+            run.future.set_exception(error)
+        self._settle(started, failed)
+
+    def _settle(
+            self,
+            started: List[Tuple[PendingRun, float, Future]],
+            failed: List[Tuple[Future, Exception]]
+            ) -> None:
+        """
+        Hook up the runs _pack started and fail the ones it couldn't start. Called without
+        the lock: a pump future that is already done runs _finish inline, which takes it.
+        """
+        for run, started_at, future in started:
+            future.add_done_callback(partial(self._finish, run, started_at))
+        for future, error in failed:
+            future.set_exception(error)
+
+    def stats(self) -> dict:
+        """
+        Report how much of the dosing overlapped. average_concurrency is pump-seconds
+        per second of wall-clock time during which at least one head was running.
+        """
+        with self._lock:
+            wall = self._wall_seconds
+            if self._active_since is not None:
+                wall += self.clock.monotonic() - self._active_since
+            return {
+                "budget_amps": self.budget_amps,
+                "active_heads": sorted(self._active),
+                "active_amps": self._used_amps(),
+                "waiting": len(self._waiting),
+                "runs": self._runs,
+                "busy_seconds": self._busy_seconds,
+                "wall_seconds": wall,
+                "average_concurrency": self._busy_seconds / wall if wall > 0 else 0.0,
+                "peak_concurrency": self._peak_concurrency,
+                "peak_amps": self._peak_amps,
+            }
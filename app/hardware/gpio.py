@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, NamedTuple, Optional
+
+from app.hardware.clock import Clock
+
+class PinTransition(NamedTuple):
+    timestamp: datetime
+    monotonic: float
+    pin: int
+    value: int
+
+class SimulatedGPIO:
+    """
+    Stand-in for RPi.GPIO that keeps pin state in memory and records every
+    output() call with the clock's wall and monotonic time.
+    """
+    BCM = "BCM"
+    BOARD = "BOARD"
+    OUT = "OUT"
+    IN = "IN"
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, clock: Clock, max_transitions: Optional[int] = 100_000) -> None:
+        self.clock = clock
+        self.mode = None
+        self.pins: Dict[int, int] = {}
+        self.transitions: Deque[PinTransition] = deque(maxlen=max_transitions)
+        self._lock = threading.Lock()
+
+    def setmode(self, mode) -> None:
+        self.mode = mode
+
+    def setup(self, pin: int, direction) -> None:
+        with self._lock:
+            self.pins[pin] = self.LOW
+
+    def output(self, pin: int, value: int) -> None:
+        with self._lock:
+            if pin not in self.pins:
+                raise RuntimeError(f"Pin {pin} has not been set up as an output.")
+            self.pins[pin] = value
+            self.transitions.append(PinTransition(self.clock.now(), self.clock.monotonic(), pin, value))
+
+    def input(self, pin: int) -> int:
+        with self._lock:
+            return self.pins[pin]
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self.pins.clear()
+
+def load_gpio(backend: str, clock: Clock):
+    """
+    Return the GPIO driver for backend: "rpi" for RPi.GPIO, "simulated" for SimulatedGPIO.
+    """
+    if backend == "rpi":
+        import RPi.GPIO as GPIO
+        return GPIO
+    if backend == "simulated":
+        return SimulatedGPIO(clock)
+    raise ValueError(f"Unknown GPIO backend '{backend}'. Must be 'rpi' or 'simulated'.")
@@ -1,37 +1,185 @@
+from concurrent.futures import Future
 from dataclasses import dataclass
-import RPi.GPIO as GPIO
-import time
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+
+from app.hardware.actuator import Actuator
+from app.hardware.clock import Clock
+from app.metrics import DOSE_ACTUATION_ERROR
+
+logger = logging.getLogger(__name__)
 
 @dataclass(frozen=True)
 class PumpHead:
     pin_1: int
     pin_2: int
     calibration_ml_per_second: float
+    current_draw_amps: float = 0.5
+    # Measured delay until liquid flows after switch-on, and run-on after switch-off
+    start_latency_seconds: float = 0.0
+    stop_latency_seconds: float = 0.0
+    # Driver board the head is wired to, informational
+    board: str = "main"
+
+    def flow_ml(self, on_seconds: float) -> float:
+        """
+        Volume delivered by a run that kept the pins on for on_seconds.
+        """
+        return max(on_seconds - self.start_latency_seconds + self.stop_latency_seconds, 0.0) * self.calibration_ml_per_second
+
+    def on_seconds(self, ml: float) -> float:
+        """
+        Pin-on time that delivers ml once start and stop latency are accounted for.
+        """
+        return max(ml / self.calibration_ml_per_second + self.start_latency_seconds - self.stop_latency_seconds, 0.0)
 
 PUMP_HEADS = {
-    1: PumpHead(pin_1=17, pin_2=22, calibration_ml_per_second=1.40),
-    2: PumpHead(pin_1=23, pin_2=24, calibration_ml_per_second=1.34)
+    1: PumpHead(pin_1=17, pin_2=22, calibration_ml_per_second=1.40, current_draw_amps=0.5),
+    2: PumpHead(pin_1=23, pin_2=24, calibration_ml_per_second=1.34, current_draw_amps=0.5)
 }
 
+# Largest volume a single run may dispense, in mL
+UPPER_LIMIT = 20
+
+def fit_calibration(runs: List[Tuple[float, float]]) -> Dict[str, float]:
+    """
+    Flow rate and latency fitted to measured runs of (pin-on seconds, mL delivered).
+
+    A head delivers rate * (seconds - start_latency + stop_latency), a straight
+    line in the run time. A least-squares line through runs of different
+    lengths gives the rate as its slope and the net latency as its intercept
+    over the slope. Volumes only show the net latency, so it is returned as
+    start_latency_seconds when liquid lags the pins and as stop_latency_seconds
+    when it keeps flowing after them. Returns the three PumpHead fields.
+    """
+    if len({seconds for seconds, _ in runs}) < 2:
+        raise ValueError("Calibration needs runs of at least two different lengths.")
+    mean_seconds = sum(seconds for seconds, _ in runs) / len(runs)
+    mean_ml = sum(ml for _, ml in runs) / len(runs)
+    rate = (
+        sum((seconds - mean_seconds) * (ml - mean_ml) for seconds, ml in runs)
+        / sum((seconds - mean_seconds) ** 2 for seconds, _ in runs)
+    )
+    if rate <= 0:
+        raise ValueError("Measured volumes do not grow with run time.")
+    latency = (mean_ml - rate * mean_seconds) / rate
+    return {
+        "calibration_ml_per_second": rate,
+        "start_latency_seconds": max(-latency, 0.0),
+        "stop_latency_seconds": max(latency, 0.0),
+    }
+
+def load_pump_heads(path: str) -> Dict[int, PumpHead]:
+    """
+    Replace the built-in PUMP_HEADS with the heads defined in a JSON file: a list
+    of objects with an "id" plus PumpHead fields. PUMP_HEADS is updated in place
+    so every module that imported it sees the configured heads.
+    """
+    with open(path) as f:
+        definitions = json.load(f)
+
+    heads = {}
+    for definition in definitions:
+        definition = dict(definition)
+        head_id = int(definition.pop("id"))
+        if head_id in heads:
+            raise ValueError(f"Head {head_id} is defined more than once in {path}.")
+        heads[head_id] = PumpHead(**definition)
+
+    pins = [pin for head in heads.values() for pin in (head.pin_1, head.pin_2)]
+    if len(pins) != len(set(pins)):
+        raise ValueError(f"Heads in {path} share GPIO pins.")
+
+    PUMP_HEADS.clear()
+    PUMP_HEADS.update(sorted(heads.items()))
+    return PUMP_HEADS
+
 class Pump:
-    def __init__(self, sqlite_client):
-        GPIO.setmode(GPIO.BCM)
+    def __init__(self, sqlite_client, gpio, clock: Optional[Clock] = None, spin_seconds: float = 0.0, events=None):
+        """
+        gpio is the driver returned by app.hardware.gpio.load_gpio (RPi.GPIO or SimulatedGPIO).
+        spin_seconds enables the actuator's precision timing (see Actuator).
+        events is an optional app.events.EventBus that dose and remaining events are published to.
+        """
+        self.events = events
+        self.gpio = gpio
+        self.clock = clock or Clock()
+        self.gpio.setmode(self.gpio.BCM)
         for head in PUMP_HEADS.values():
-            GPIO.setup(head.pin_1, GPIO.OUT)
-            GPIO.setup(head.pin_2, GPIO.OUT)
+            self.gpio.setup(head.pin_1, self.gpio.OUT)
+            self.gpio.setup(head.pin_2, self.gpio.OUT)
         self.sqlite_client = sqlite_client
+        self.actuator = Actuator(self.clock, spin_seconds=spin_seconds)
+        # Running average of how long the switch-off GPIO calls take per head, used as the actuator lead
+        self._stop_call_seconds: Dict[int, float] = {head_id: 0.0 for head_id in PUMP_HEADS}
 
-    def dose(self, head_id: int, mode: str, ml: float):
+    def dose(self, head_id: int, mode: str, ml: float) -> Future:
+        """
+        Start a dose and return straight away. The returned future resolves with the
+        measured run time once the actuator has switched the head off and the dose is recorded.
+        """
         head = PUMP_HEADS[head_id]
-        seconds = ml / head.calibration_ml_per_second
+        seconds = head.on_seconds(ml)
+
+        gpio = self.gpio
+        clock = self.clock
+        stop_call_seconds = self._stop_call_seconds
+
+        def start():
+            gpio.output(head.pin_1, gpio.LOW)
+            gpio.output(head.pin_2, gpio.HIGH)
+
+        def stop():
+            called = clock.monotonic()
+            gpio.output(head.pin_1, gpio.LOW)
+            gpio.output(head.pin_2, gpio.LOW)
+            stop_call_seconds[head_id] += 0.2 * (clock.monotonic() - called - stop_call_seconds[head_id])
+
+        started = self.clock.monotonic()
+        actuation = self.actuator.run_for(seconds, start, stop, lead=stop_call_seconds[head_id])
+        self._publish("dose-start", {"head": head_id, "mode": mode, "ml": ml, "seconds": seconds})
+        done = Future()
+
+        def complete(actuation: Future):
+            try:
+                elapsed = actuation.result()
+                DOSE_ACTUATION_ERROR.observe(abs(elapsed - seconds), head=head_id)
+                self.sqlite_client.record_dose(head_id, ml, mode, elapsed, head.flow_ml(elapsed))
+                self._publish_completed(head_id, mode, ml, elapsed, head.flow_ml(elapsed), interrupted=False)
+                done.set_result(elapsed)
+            except InterruptedError as e:
+                # Only part of the dose went out, record what was actually pumped
+                elapsed = self.clock.monotonic() - started
+                dosed = min(ml, head.flow_ml(elapsed))
+                logger.warning(f"Dose of {ml}mL on head {head_id} interrupted, recording {dosed:.2f}mL")
+                self.sqlite_client.record_dose(head_id, dosed, mode, elapsed, dosed)
+                self._publish_completed(head_id, mode, dosed, elapsed, dosed, interrupted=True)
+                done.set_exception(e)
+            except Exception as e:
+                logger.exception(f"Dose of {ml}mL on head {head_id} failed")
+                done.set_exception(e)
+
+        # Runs on the actuator's completion thread, never on its timer thread
+        actuation.add_done_callback(complete)
+        return done
 
-        GPIO.output(head.pin_1, GPIO.LOW)
-        GPIO.output(head.pin_2, GPIO.HIGH)
-        time.sleep(seconds)
+    def _publish(self, type: str, data: dict) -> None:
+        if self.events is not None:
+            self.events.publish(type, data)
 
-        GPIO.output(head.pin_1, GPIO.LOW)
-        GPIO.output(head.pin_2, GPIO.LOW)
+    def _publish_completed(self, head_id: int, mode: str, ml: float, seconds: float, actual_ml: float, interrupted: bool) -> None:
+        if self.events is None:
+            return
+        self.events.publish("dose-complete", {
+            "head": head_id,
+            "mode": mode,
+            "ml": ml,
+            "actual_seconds": seconds,
+            "actual_ml": actual_ml,
+            "interrupted": interrupted
+        })
+        self.events.publish("remaining-changed", {"head": head_id, "remaining": self.sqlite_client.get_remaining().get(head_id)})
 
-        self.sqlite_client.insert_raw_entry(head_id, ml, mode)
-        self.sqlite_client.insert_entry(head_id, ml)
-        self.sqlite_client.update_remaining(head_id, ml)
\ No newline at end of file
+    def shutdown(self):
+        self.actuator.shutdown()
@@ -1,31 +1,131 @@
+import logging
+import time
+
 from fastapi import FastAPI
 from app.api.routes import get_router
-from app.hardware.pump import Pump
+from app.api.middleware import LatencyMiddleware
+from app.hardware.pump import Pump, PUMP_HEADS, load_pump_heads
+from app.hardware.clock import Clock
+from app.hardware.gpio import load_gpio
+from app.hardware.command_queue import CommandQueue
+from app.hardware.dispatcher import PowerDispatcher
 from app.scheduler.jobs import SchedulerManager
 from app.clients.sqlite_client import SQliteClient
+from app.clients.async_sqlite_client import AsyncSQliteClient
+from app.clients.columnar_archive import ColumnarArchive
+from app.config import load_settings
+from app.events import EventBus
+from app.forecast import ConsumptionModel
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
 
 def create_app() -> FastAPI:
     # --- Initialize FastAPI app ---
+    started = time.perf_counter()
     app = FastAPI()
+    settings = load_settings()
+
+    # --- Pump heads from the heads file, if any, before anything sizes itself on PUMP_HEADS ---
+    if settings.heads_path:
+        load_pump_heads(settings.heads_path)
+
+    # --- Time source and GPIO driver (real or simulated) ---
+    clock = Clock(speed=settings.clock_speed, start=settings.clock_start)
+    gpio = load_gpio(settings.gpio_backend, clock)
 
     # --- Set up database client ---
-    sqlite_client = SQliteClient()
+    sqlite_client = SQliteClient(
+        logs_path=settings.logs_path,
+        schedules_path=settings.schedules_path,
+        remaining_path=settings.remaining_path,
+        db_path=settings.db_path if settings.storage_mode == "single" else None,
+        write_behind=settings.write_behind,
+        journal_max_batch=settings.journal_max_batch,
+        journal_max_delay=settings.journal_max_delay,
+        clock=clock,
+        heads=PUMP_HEADS
+    )
+
+    # --- Daily consumption for /forecast, loaded before any dose can be recorded and kept current by each one ---
+    consumption = ConsumptionModel(PUMP_HEADS, clock, history_days=settings.forecast_history_days)
+    consumption.load(sqlite_client)
+    sqlite_client.dose_listeners.append(consumption.record)
+
+    # --- Compact columnar copy of the dose history, appended by the maintenance job ---
+    columnar_archive = ColumnarArchive(settings.columnar_archive_path) if settings.columnar_archive_path else None
+
+    # --- Async front used by the API routes, on a small executor of its own ---
+    async_sqlite_client = AsyncSQliteClient(sqlite_client, max_workers=settings.storage_workers)
+
+    # --- In-process pub/sub behind the /events stream ---
+    events = EventBus(clock, buffer_size=settings.event_buffer_size)
 
     # --- Initialize hardware pump ---
-    pump = Pump(sqlite_client)
+    pump = Pump(sqlite_client, gpio, clock, spin_seconds=settings.actuator_spin_seconds, events=events)
+
+    # --- Power-budget dispatcher and per-head command queue in front of the pump ---
+    dispatcher = PowerDispatcher(pump, budget_amps=settings.power_budget_amps)
+    command_queue = CommandQueue(dispatcher, max_depth=settings.queue_depth)
 
     # --- Set up scheduler manager ---
-    scheduler_manager = SchedulerManager(pump, sqlite_client)
+    scheduler_manager = SchedulerManager(
+        command_queue,
+        sqlite_client,
+        clock,
+        retention_days=settings.retention_days,
+        archive_path=settings.retention_archive_path,
+        stagger_seconds=settings.schedule_stagger_seconds,
+        grace_seconds=settings.schedule_grace_seconds,
+        catch_up_policy=settings.catch_up_policy,
+        events=events,
+        columnar_archive=columnar_archive
+    )
 
     # --- Register API routes ---
-    router = get_router(pump, scheduler_manager, sqlite_client)
+    router = get_router(command_queue, scheduler_manager, async_sqlite_client, dispatcher, events, consumption, columnar_archive)
     app.include_router(router)
 
-    # --- Graceful shutdown for scheduler ---
+    # --- Metrics: request latency plus queue depths and cache counters read at scrape time ---
+    app.add_middleware(LatencyMiddleware)
+    REGISTRY.callback(
+        "doser_command_queue_depth", "Commands waiting per head in the command queue.", "gauge",
+        lambda: [({"head": head}, command_queue.depth(head)) for head in PUMP_HEADS]
+    )
+    REGISTRY.callback(
+        "doser_dispatcher_waiting", "Runs waiting for power budget in the dispatcher.", "gauge",
+        lambda: [({}, dispatcher.stats()["waiting"])]
+    )
+    REGISTRY.callback(
+        "doser_actuator_in_flight", "Pump runs currently switched on.", "gauge",
+        lambda: [({}, pump.actuator.in_flight())]
+    )
+    REGISTRY.callback(
+        "doser_journal_backlog", "Doses buffered in the write-behind journal.", "gauge",
+        lambda: [({}, sqlite_client.journal.backlog() if sqlite_client.journal else 0)]
+    )
+    REGISTRY.callback(
+        "doser_event_subscribers", "Clients connected to /events.", "gauge",
+        lambda: [({}, events.subscriber_count())]
+    )
+    REGISTRY.callback(
+        "doser_cache_requests_total", "SQliteClient read cache hits and misses.", "counter",
+        lambda: [
+            ({"cache": cache, "result": result}, count)
+            for cache, stats in sqlite_client.cache_stats().items()
+            for result, count in (("hit", stats["hits"]), ("miss", stats["misses"]))
+        ]
+    )
+
+    # --- Graceful shutdown for scheduler, pump and storage (flushes the dose journal) ---
     @app.on_event("shutdown")
     def shutdown_event():
         scheduler_manager.shutdown()
+        pump.shutdown()
+        async_sqlite_client.close()
+        sqlite_client.close()
 
+    logger.info(f"Started in {time.perf_counter() - started:.3f}s (scheduler {scheduler_manager.startup['seconds']:.3f}s)")
     return app
 
 app = create_app()
\ No newline at end of file
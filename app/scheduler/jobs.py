@@ -1,81 +1,283 @@
-from app.hardware.pump import Pump
+from app.hardware.command_queue import CommandQueue
 from app.clients.sqlite_client import SQliteClient
+from app.hardware.clock import Clock
+from app.hardware.pump import PUMP_HEADS, UPPER_LIMIT
+from app.metrics import SCHEDULER_LAG
+from app.scheduler.timeline import DoseEvent, TimelineDispatcher, compile_timeline
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set
 import logging
+import threading
+import time
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.jobstores.base import JobLookupError
 
 logger = logging.getLogger(__name__)
 
+# What to do with scheduled doses missed while the service was down or found past the grace window
+CATCH_UP_POLICIES = ("skip", "merge", "spread")
+
 class SchedulerManager:
-    def __init__(self, pump: Pump, sqlite_client: SQliteClient) -> None:
+    def __init__(
+            self,
+            command_queue: CommandQueue,
+            sqlite_client: SQliteClient,
+            clock: Clock,
+            retention_days: Optional[int] = None,
+            archive_path: Optional[str] = None,
+            stagger_seconds: float = 30.0,
+            grace_seconds: float = 300.0,
+            catch_up_policy: str = "skip",
+            events=None,
+            columnar_archive=None
+            ) -> None:
+        if catch_up_policy not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy '{catch_up_policy}'. Must be one of {', '.join(CATCH_UP_POLICIES)}.")
+        started = time.perf_counter()
         self.scheduler = BackgroundScheduler()
-        self.pump = pump
+        self.command_queue = command_queue
+        self.clock = clock
         self.sqlite_client = sqlite_client
-        self.schedules = self.sqlite_client.fetch_all_schedules(self.sqlite_client.SCHEDULES_TABLE_NAME)
-        self._add_jobs_from_store()
-        self.scheduler.start()
+        self.retention_days = retention_days
+        self.archive_path = archive_path
+        self.stagger_seconds = stagger_seconds
+        self.grace_seconds = grace_seconds
+        self.catch_up_policy = catch_up_policy
+        self.events = events
+        self.columnar_archive = columnar_archive
+        self.last_maintenance: Optional[dict] = None
+        # Paused heads keep their timeline but their doses are skipped; not persisted across restarts
+        self.paused: Set[int] = set()
+        # Extra mL the spread policy adds to a head's next doses: head -> [ml per dose, doses left]
+        self._spread: Dict[int, list] = {}
+        # _spread is written by catch-up on the timeline thread and reset by schedule changes from API threads
+        self._spread_lock = threading.Lock()
 
-    def _add_jobs_from_store(self):
+        # Schedules and last fire / next due per head come back in a single read
+        self.schedules, state = self.sqlite_client.fetch_schedules_with_state()
         logger.info(self.schedules)
+
+        # Scheduled doses come from one compiled timeline instead of an interval job per head
+        self.timeline = TimelineDispatcher(
+            self.clock, self._compile, self._run_scheduled_dose, grace_seconds=grace_seconds, late_fn=self._run_late_doses,
+            last_fired={head: head_state["last_fired"] for head, head_state in state.items()}
+        )
+        self.timeline.rebuild()
+        missed = self._find_missed(state, self.clock.now())
+        caught_up = self._catch_up(missed)
+        self.timeline.start()
+        next_due = {head: self.timeline.next_for(head) for head in self.schedules}
+        changed = {head: (None, due) for head, due in next_due.items() if due != state[head]["next_due"]}
+        if changed:
+            self.sqlite_client.update_scheduler_states(changed)
+        self._add_maintenance_job()
+        self.scheduler.start()
+
+        self.startup = {
+            "seconds": time.perf_counter() - started,
+            "catch_up_policy": self.catch_up_policy,
+            "missed": {
+                head: {"doses": len(events), "ml": sum(event.ml for event in events), "since": events[0].at.isoformat()}
+                for head, events in missed.items()
+            },
+            "caught_up_ml": caught_up
+        }
+        if missed:
+            logger.warning(f"Missed scheduled doses while down: {self.startup['missed']} ({self.catch_up_policy})")
+
+    def _compile(self, day: date) -> List[DoseEvent]:
+        # Rows left behind by heads no longer in the heads file are not scheduled
+        schedules = {head: sched for head, sched in self.schedules.items() if head in PUMP_HEADS}
+        return compile_timeline(schedules, day, self.stagger_seconds)
+
+    def _find_missed(self, state: dict, now: datetime) -> Dict[int, List[DoseEvent]]:
+        """
+        Timeline events per head between its persisted next due time and now.
+        """
+        missed = {}
         for head, sched in self.schedules.items():
-            if sched["total_dose"] is not None and sched["doses_per_day"] is not None:
-                self._add_job(int(head), sched["total_dose"], sched["doses_per_day"])
+            next_due = state[head]["next_due"]
+            if sched["total_dose"] is None or sched["doses_per_day"] is None or next_due is None or next_due > now:
+                continue
+            day, events = next_due.date(), []
+            while day <= now.date():
+                events.extend(e for e in self._compile(day) if e.head == head and next_due <= e.at <= now)
+                day += timedelta(days=1)
+            if events:
+                missed[head] = events
+        return missed
+
+    def _catch_up(self, missed: Dict[int, List[DoseEvent]]) -> Dict[int, float]:
+        """
+        Apply the catch-up policy to the missed doses, capped at one day's total per head.
+        Spread volume is added to whatever an earlier catch-up still has to spread, and
+        falls back to merge when the head has no dose in the next day to spread it over.
+        """
+        caught_up = {}
+        if self.catch_up_policy == "skip":
+            return caught_up
 
-    def _add_job(self, head, total_dose, doses_per_day):
+        now = self.clock.now()
+        for head, events in missed.items():
+            ml = min(sum(event.ml for event in events), self.schedules[head]["total_dose"])
+            upcoming = [e for e in self.timeline.upcoming() if e.head == head and e.at <= now + timedelta(days=1)]
+            if self.catch_up_policy == "spread" and upcoming:
+                with self._spread_lock:
+                    per_dose, left = self._spread.get(head, (0.0, 0))
+                    self._spread[head] = [(per_dose * left + ml) / len(upcoming), len(upcoming)]
+            else:
+                remaining = ml
+                while remaining > 0:
+                    chunk = min(remaining, UPPER_LIMIT)
+                    self.command_queue.submit(head, "Scheduled", chunk, enforce_limit=False)
+                    remaining -= chunk
+            caught_up[head] = ml
+        return caught_up
+
+    def _add_maintenance_job(self):
+        if not self.retention_days and self.columnar_archive is None:
+            return
 
         self.scheduler.add_job(
-            self.pump.dose,
-            args=[head, "Scheduled", total_dose / doses_per_day],
+            self.run_maintenance,
             trigger='interval',
-            hours=24 / doses_per_day,
-            id=f"scheduled_doser_{head}",
+            seconds=self.clock.to_real(24 * 3600),
+            id="maintenance_retention",
             replace_existing=True
         )
 
-    def set_schedule(self, head, total_dose, doses_per_day):
+    def run_maintenance(self):
+        """
+        Append new raw logs to the columnar archive, then prune raw logs past
+        the retention window and reclaim their space.
+        """
+        report = {}
+        if self.columnar_archive is not None:
+            report["columnar_archive"] = self.sqlite_client.append_archive_segment(self.columnar_archive)
+        if self.retention_days:
+            report.update(self.sqlite_client.prune_raw_logs(self.retention_days, archive_path=self.archive_path))
+        self.last_maintenance = report
+        return self.last_maintenance
+
+    def get_maintenance(self):
+        return {
+            "retention_days": self.retention_days,
+            "archive_path": self.archive_path,
+            "columnar_archive_path": self.columnar_archive.directory if self.columnar_archive is not None else None,
+            "last_run": self.last_maintenance
+        }
+
+    def _run_scheduled_dose(self, event: DoseEvent):
+        SCHEDULER_LAG.observe(max((self.clock.now() - event.at).total_seconds(), 0.0), head=event.head)
+        if event.head in self.paused:
+            logger.info(f"Skipping scheduled dose for paused head {event.head}")
+        else:
+            ml = event.ml
+            with self._spread_lock:
+                spread = self._spread.get(event.head)
+                if spread is not None:
+                    ml += spread[0]
+                    spread[1] -= 1
+                    if spread[1] <= 0:
+                        self._spread.pop(event.head, None)
+            # Scheduled doses are never turned away, they wait behind any manual doses
+            self.command_queue.submit(event.head, "Scheduled", ml, enforce_limit=False)
+        self.sqlite_client.update_scheduler_state(event.head, event.at, self.timeline.next_for(event.head))
+
+    def _run_late_doses(self, events: List[DoseEvent]):
+        """
+        Doses found past the timeline's grace window, e.g. after a suspend or a
+        forward clock jump, go through the catch-up policy like doses missed while down.
+        """
+        missed: Dict[int, List[DoseEvent]] = {}
+        for event in events:
+            if event.head not in self.paused:
+                missed.setdefault(event.head, []).append(event)
+        caught_up = self._catch_up(missed)
+        for head in sorted({event.head for event in events}):
+            late = [event for event in events if event.head == head]
+            if head in self.paused:
+                outcome = "head is paused"
+            elif head in caught_up:
+                outcome = f"{caught_up[head]:.2f}mL caught up ({self.catch_up_policy})"
+            else:
+                outcome = f"skipped ({self.catch_up_policy})"
+            logger.warning(
+                f"{len(late)} scheduled doses ({sum(event.ml for event in late):.2f}mL) on head {head} "
+                f"more than {self.grace_seconds}s late since {late[0].at.isoformat()}: {outcome}"
+            )
+        last_run = {}
+        for event in events:
+            last_run[event.head] = max(event.at, last_run.get(event.head, event.at))
+        self.sqlite_client.update_scheduler_states({
+            head: (at, self.timeline.next_for(head)) for head, at in last_run.items()
+        })
+
+    def set_schedule(self, head, total_dose, doses_per_day, window_start=None, window_end=None):
+        self.set_schedules({
+            head: {
+                "total_dose": total_dose,
+                "doses_per_day": doses_per_day,
+                "window_start": window_start,
+                "window_end": window_end
+            }
+        })
 
-        # Remove existing job for this head
-        try:
-            self.scheduler.remove_job(f"scheduled_doser_{head}")
-        except JobLookupError:
-            pass  # Job does not exist, nothing to remove
-        
-        # Update schedules dict and save
-        self.sqlite_client.update_schedule(head, total_dose, doses_per_day)
+    def set_schedules(self, schedules: Dict[int, dict]):
+        """
+        Replace several heads' schedules with one write and one timeline rebuild.
+        """
+        self.sqlite_client.update_schedules(schedules)
+        self.schedules = self.sqlite_client.fetch_all_schedules()
+        with self._spread_lock:
+            for head in schedules:
+                self._spread.pop(head, None)
+        self.timeline.rebuild()
+        self.sqlite_client.update_scheduler_states({head: (None, self.timeline.next_for(head)) for head in schedules})
+        for head in schedules:
+            self._publish_schedule(head)
+
+    def _publish_schedule(self, head):
+        if self.events is None:
+            return
+        next_due = self.timeline.next_for(head)
+        self.events.publish("schedule-changed", {
+            "head": head,
+            "schedule": self.schedules.get(head),
+            "paused": head in self.paused,
+            "next_due": next_due.isoformat() if next_due else None
+        })
 
-        # Add new job
-        self._add_job(head, total_dose, doses_per_day)
-    
     def pause_schedule(self, head):
-        job_id = f"scheduled_doser_{head}"
-        try:
-            self.scheduler.pause_job(job_id)
-        except JobLookupError:
-            pass  # Job does not exist
+        self.paused.add(head)
+        self._publish_schedule(head)
 
     def resume_schedule(self, head):
-        job_id = f"scheduled_doser_{head}"
-        try:
-            self.scheduler.resume_job(job_id)
-        except JobLookupError:
-            pass  # Job does not exist
+        self.paused.discard(head)
+        self._publish_schedule(head)
 
     def clear_schedule(self, head):
-        job_id = f"scheduled_doser_{head}"
-        try:
-            self.scheduler.remove_job(job_id)
-        except JobLookupError:
-            pass  # Job does not exist
-
-        # Remove from schedules dict and save
-        self.sqlite_client.update_schedule(head, None, None)
+        self.set_schedule(head, None, None)
 
     def get_schedules(self):
-        return self.sqlite_client.fetch_all_schedules(self.sqlite_client.SCHEDULES_TABLE_NAME)
+        return self.sqlite_client.fetch_all_schedules()
 
-    def get_jobs(self):
+    def get_jobs(self, limit: int = 50):
         jobs_list = []
+        upcoming = self.timeline.upcoming()
+        for head, sched in sorted(self.schedules.items()):
+            if sched["total_dose"] is None or sched["doses_per_day"] is None:
+                continue
+            next_event = next((event for event in upcoming if event.head == head), None)
+            jobs_list.append({
+                "id": f"scheduled_doser_{head}",
+                "name": "timeline",
+                "next_run_time": None if head in self.paused or next_event is None else str(next_event.at),
+                "trigger": f"timeline[{sched['doses_per_day']}/day, {sched.get('window_start') or '00:00'}-{sched.get('window_end') or '24:00'}]",
+                "args": [head, "Scheduled", sched["total_dose"] / sched["doses_per_day"]],
+                "kwargs": {},
+                "paused": head in self.paused
+            })
         for job in self.scheduler.get_jobs():
             jobs_list.append({
                 "id": job.id,
@@ -85,7 +287,12 @@ class SchedulerManager:
                 "args": job.args,
                 "kwargs": job.kwargs
             })
-        return {"jobs": jobs_list}
+        timeline = [
+            {"at": event.at.isoformat(), "head": event.head, "ml": event.ml, "paused": event.head in self.paused}
+            for event in upcoming[:limit]
+        ]
+        return {"jobs": jobs_list, "timeline": timeline, "startup": self.startup}
 
     def shutdown(self):
-        self.scheduler.shutdown(wait=False)
\ No newline at end of file
+        self.timeline.stop()
+        self.scheduler.shutdown(wait=False)
@@ -0,0 +1,218 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, List, Optional
+
+from app.hardware.clock import Clock
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True, order=True)
+class DoseEvent:
+    at: datetime
+    head: int
+    ml: float
+    # Time on the head's even spacing before any stagger, None when not staggered
+    nominal: Optional[datetime] = field(default=None, compare=False)
+
+    @property
+    def slot(self) -> datetime:
+        return self.nominal or self.at
+
+def parse_window_time(value: str) -> time:
+    """
+    Parse an "HH:MM" window bound. "24:00" is accepted as the end of the day.
+    """
+    if value == "24:00":
+        return time.max
+    return datetime.strptime(value, "%H:%M").time()
+
+def compile_timeline(schedules: Dict[int, dict], day: date, stagger_seconds: float = 30.0) -> List[DoseEvent]:
+    """
+    Turn each head's total_dose/doses_per_day into the day's dose events.
+
+    Doses are spread evenly over the head's window (the whole day by default),
+    starting at the window start, so they land on the same wall-clock times
+    every day. Heads whose doses share a time are taken in head order and the
+    n-th of them is moved by n times stagger_seconds, later if that keeps it
+    before the head's next dose and inside its window, earlier if that keeps
+    it after the head's previous dose, otherwise not at all. A head's doses
+    never change order and stay inside [window_start, window_end).
+    """
+    gap = timedelta(seconds=stagger_seconds)
+    nominal_times = {}
+    for head, schedule in schedules.items():
+        total_dose = schedule.get("total_dose")
+        doses_per_day = schedule.get("doses_per_day")
+        if total_dose is None or not doses_per_day:
+            continue
+
+        start = datetime.combine(day, parse_window_time(schedule.get("window_start") or "00:00"))
+        end_time = parse_window_time(schedule.get("window_end") or "24:00")
+        end = datetime.combine(day + timedelta(days=1), time()) if end_time == time.max else datetime.combine(day, end_time)
+        step = (end - start) / doses_per_day
+        nominal_times[int(head)] = (start, end, total_dose / doses_per_day, [start + step * i for i in range(doses_per_day)])
+
+    heads_at = defaultdict(list)
+    for head in sorted(nominal_times):
+        for at in nominal_times[head][3]:
+            heads_at[at].append(head)
+
+    def offset(head: int, nominal: datetime) -> timedelta:
+        return gap * heads_at[nominal].index(head)
+
+    events = []
+    for head, (start, end, ml, times) in nominal_times.items():
+        previous = None
+        for i, nominal in enumerate(times):
+            at = nominal
+            shift = offset(head, nominal)
+            if shift:
+                # Leave room for the next dose to move back by its own offset
+                following = times[i + 1] - offset(head, times[i + 1]) if i + 1 < len(times) else end
+                if nominal + shift < following:
+                    at = nominal + shift
+                elif nominal - shift >= start and (previous is None or nominal - shift > previous):
+                    at = nominal - shift
+            events.append(DoseEvent(at, head, ml, nominal if at != nominal else None))
+            previous = at
+
+    events.sort()
+    return events
+
+class TimelineDispatcher:
+    """
+    Fires compiled dose events from a single min-heap.
+
+    One thread sleeps until the earliest event is due, then hands every due
+    event to fire_fn. Today's and tomorrow's timelines are compiled up front;
+    each midnight the day after is added, so there is always a full day ahead.
+
+    Events found more than grace_seconds past their time (the host was
+    suspended, or the wall clock jumped forward) are not fired one after the
+    other; they go to late_fn together, or are dropped if there is none.
+    grace_seconds is real time, so an accelerated clock does not turn a few
+    milliseconds of thread wake-up delay into minutes of lateness.
+
+    The last event fired per head (seeded from last_fired) is remembered, so a
+    rebuild never brings back a dose that already ran, even when the stagger
+    moved it to a later time.
+    """
+    def __init__(
+            self,
+            clock: Clock,
+            compile_fn: Callable[[date], List[DoseEvent]],
+            fire_fn: Callable[[DoseEvent], None],
+            grace_seconds: float = 300.0,
+            late_fn: Optional[Callable[[List[DoseEvent]], None]] = None,
+            last_fired: Optional[Dict[int, datetime]] = None
+            ) -> None:
+        self.clock = clock
+        self.compile_fn = compile_fn
+        self.fire_fn = fire_fn
+        self.grace_seconds = grace_seconds
+        self.late_fn = late_fn
+
+        self._heap: List[DoseEvent] = []
+        self._last_fired: Dict[int, DoseEvent] = {
+            head: DoseEvent(at, head, 0.0) for head, at in (last_fired or {}).items() if at is not None
+        }
+        self._compiled_through: Optional[date] = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._compiled_through is None:
+            self.rebuild()
+        self._thread = threading.Thread(target=self._run, name="timeline-dispatcher", daemon=True)
+        self._thread.start()
+
+    def rebuild(self) -> None:
+        """
+        Recompile today's and tomorrow's timelines, e.g. after a schedule change.
+        """
+        with self._condition:
+            now = self.clock.now()
+            today = now.date()
+            self._heap = [
+                event
+                for day in (today, today + timedelta(days=1))
+                for event in self.compile_fn(day)
+                if event.at > now and not self._has_fired(event)
+            ]
+            heapq.heapify(self._heap)
+            self._compiled_through = today + timedelta(days=1)
+            self._condition.notify()
+
+    def upcoming(self, limit: Optional[int] = None) -> List[DoseEvent]:
+        with self._condition:
+            events = sorted(self._heap)
+        return events if limit is None else events[:limit]
+
+    def next_for(self, head: int) -> Optional[datetime]:
+        with self._condition:
+            return min((event.at for event in self._heap if event.head == head), default=None)
+
+    def _has_fired(self, event: DoseEvent) -> bool:
+        # Called with the lock held
+        last = self._last_fired.get(event.head)
+        return last is not None and (event.at <= last.at or event.slot <= last.slot)
+
+    def _extend(self, now: datetime) -> None:
+        # Called with the lock held: keep the timeline compiled through tomorrow
+        while self._compiled_through < now.date() + timedelta(days=1):
+            self._compiled_through += timedelta(days=1)
+            for event in self.compile_fn(self._compiled_through):
+                if event.at > now and not self._has_fired(event):
+                    heapq.heappush(self._heap, event)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    now = self.clock.now()
+                    self._extend(now)
+                    if self._heap and self._heap[0].at <= now:
+                        break
+                    next_day = datetime.combine(self._compiled_through, time())
+                    wake = min(self._heap[0].at, next_day) if self._heap else next_day
+                    self.clock.wait(self._condition, max((wake - now).total_seconds(), 0.0))
+                due, late = [], []
+                while self._heap and self._heap[0].at <= now:
+                    event = heapq.heappop(self._heap)
+                    self._last_fired[event.head] = event
+                    lateness = self.clock.to_real((now - event.at).total_seconds())
+                    (late if lateness > self.grace_seconds else due).append(event)
+
+            if late:
+                if self.late_fn is None:
+                    for head in sorted({event.head for event in late}):
+                        dropped = [event for event in late if event.head == head]
+                        logger.warning(
+                            f"Dropping {len(dropped)} scheduled doses ({sum(event.ml for event in dropped):.2f}mL) "
+                            f"on head {head} more than {self.grace_seconds}s late"
+                        )
+                else:
+                    try:
+                        self.late_fn(late)
+                    except Exception:
+                        logger.exception("Failed to handle late scheduled doses")
+            for event in due:
+                try:
+                    self.fire_fn(event)
+                except Exception:
+                    logger.exception(f"Failed to fire scheduled dose for head {event.head}")
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
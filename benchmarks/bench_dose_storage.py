@@ -0,0 +1,127 @@
+"""
+Per-dose storage write latency.
+
+Compares the original three-file path (insert_raw_entry + insert_entry +
+update_remaining, each on a fresh default-pragma connection with its own commit)
+against the single-database layout (record_dose, one transaction) and against
+record_dose with the write-behind journal, where the dose thread only appends
+to memory.
+
+    python benchmarks/bench_dose_storage.py --doses 500 --dir /mnt/bench
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.clients.sqlite_client import SQliteClient
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _summary(name, samples):
+    ms = [s * 1000 for s in samples]
+    return (
+        f"{name:<14} mean={statistics.mean(ms):7.3f}ms  "
+        f"p50={_percentile(ms, 50):7.3f}ms  p99={_percentile(ms, 99):7.3f}ms"
+    )
+
+
+def _baseline_tables(directory):
+    """
+    The three database files with the schemas the original three-file client created.
+    """
+    paths = {name: os.path.join(directory, f"{name}.db") for name in ("logs", "schedules", "remaining")}
+    with sqlite3.connect(paths["logs"]) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS raw_logs (
+                id TEXT PRIMARY KEY, date TEXT, head INTEGER, time TEXT, ml REAL,
+                mode TEXT CHECK(mode IN ('Manual', 'Scheduled', 'Primer'))
+            );
+            CREATE TABLE IF NOT EXISTS logs (
+                date TEXT NOT NULL, hour TEXT NOT NULL, head1 REAL DEFAULT NULL, head2 REAL DEFAULT NULL,
+                PRIMARY KEY (date, hour)
+            );
+            """
+        )
+    with sqlite3.connect(paths["remaining"]) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS remaining (head INTEGER PRIMARY KEY, remaining REAL);
+            INSERT OR IGNORE INTO remaining (head, remaining) VALUES (1, 1000.0);
+            """
+        )
+    return paths
+
+
+def bench_three_file(directory, doses):
+    """
+    The original dose path: insert_raw_entry, insert_entry and update_remaining each
+    opened a fresh connection with default pragmas (rollback journal, synchronous=FULL)
+    and committed on its own.
+    """
+    paths = _baseline_tables(directory)
+    samples = []
+    for _ in range(doses):
+        start = time.perf_counter()
+        now = datetime.now()
+        with sqlite3.connect(paths["logs"]) as conn:
+            conn.execute(
+                "INSERT INTO raw_logs (id, date, head, time, ml, mode) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(uuid4()), now.date().isoformat(), 1, now.isoformat(), 1.0, "Manual"),
+            )
+            conn.commit()
+        with sqlite3.connect(paths["logs"]) as conn:
+            conn.execute(
+                """
+                INSERT INTO logs (date, hour, head1) VALUES (?, ?, ?)
+                ON CONFLICT(date, hour) DO UPDATE SET head1 = COALESCE(head1, 0) + excluded.head1
+                """,
+                (now.date().isoformat(), now.strftime("%H:00"), 1.0),
+            )
+            conn.commit()
+        with sqlite3.connect(paths["remaining"]) as conn:
+            conn.execute("UPDATE remaining SET remaining = remaining - ? WHERE head = ?", (1.0, 1))
+            conn.commit()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_single_db(directory, doses, write_behind=False):
+    name = "doser-journal.db" if write_behind else "doser.db"
+    client = SQliteClient(db_path=os.path.join(directory, name), write_behind=write_behind)
+    client.set_remaining(1, 1000.0)
+    samples = []
+    for _ in range(doses):
+        start = time.perf_counter()
+        client.record_dose(1, 1.0, "Manual")
+        samples.append(time.perf_counter() - start)
+    client.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--doses", type=int, default=500)
+    parser.add_argument("--dir", default=None, help="Directory for the benchmark databases (default: a temp dir)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        print(_summary("baseline", bench_three_file(directory, args.doses)))
+        print(_summary("single-db", bench_single_db(directory, args.doses)))
+        print(_summary("write-behind", bench_single_db(directory, args.doses, write_behind=True)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare read latency of the async /remaining route with a sync (threadpool) equivalent.
+
+Runs the app with simulated GPIO and a temp database, keeps Starlette's
+threadpool busy with slow sync requests and polls both routes concurrently,
+then reports p50/p99 latency for each.
+
+    python benchmarks/bench_read_latency.py --pollers 20 --requests 50 --busy 60
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def poll(client, path, requests, samples):
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get(path)
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+
+
+async def load(app, path, args):
+    import httpx
+
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        busy = [asyncio.ensure_future(client.get("/bench/busy")) for _ in range(args.busy)]
+        await asyncio.sleep(0.01)  # Let the busy requests take the threadpool first
+        started = time.perf_counter()
+        await asyncio.gather(*(poll(client, path, args.requests, samples) for _ in range(args.pollers)))
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*busy)
+    return samples, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pollers", type=int, default=20, help="Concurrent clients polling the read route")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per poller")
+    parser.add_argument("--busy", type=int, default=60, help="Slow sync requests occupying the threadpool")
+    parser.add_argument("--busy-seconds", type=float, default=0.05, help="How long each slow request holds its thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "doser.db")
+        os.environ["DOSER_GPIO_BACKEND"] = "simulated"
+        os.environ["DOSER_DB_PATH"] = db_path
+
+        from app.clients.sqlite_client import SQliteClient
+        from app.main import app
+
+        # The pre-async behaviour: a plain def route, run on the threadpool like every sync endpoint
+        sync_client = SQliteClient(db_path=db_path)
+
+        def remaining_sync():
+            return sync_client.get_remaining()
+
+        def busy():
+            time.sleep(args.busy_seconds)
+            return {}
+
+        app.add_api_route("/bench/remaining-sync", remaining_sync, methods=["GET"])
+        app.add_api_route("/bench/busy", busy, methods=["GET"])
+
+        results = {}
+        for name, path in (("async", "/remaining"), ("sync", "/bench/remaining-sync")):
+            samples, elapsed = asyncio.run(load(app, path, args))
+            results[name] = (samples, elapsed)
+        sync_client.close()
+
+    print(f"{args.pollers} pollers x {args.requests} requests, {args.busy} busy requests of {args.busy_seconds * 1000:.0f}ms")
+    for name, (samples, elapsed) in results.items():
+        print(
+            f"{name:>5}: p50 {percentile(samples, 0.50) * 1000:7.2f}ms  "
+            f"p99 {percentile(samples, 0.99) * 1000:7.2f}ms  "
+            f"mean {statistics.mean(samples) * 1000:7.2f}ms  "
+            f"{len(samples) / elapsed:8.0f} req/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
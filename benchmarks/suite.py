@@ -0,0 +1,379 @@
+"""
+Benchmark and load-test suite for the API, dose pipeline and scheduler.
+
+Each scenario runs in a fresh process against create_app() with the simulated
+GPIO backend and databases in a temp dir, and the results are written as JSON
+so runs can be compared with --compare.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --scenarios read_polling,logs_year --compare results.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+READ_ENDPOINTS = ("/remaining", "/totals", "/schedules", "/history", "/forecast", "/jobs", "/metrics")
+TERMINAL_STATUSES = ("done", "failed")
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _latency(samples):
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": _percentile(samples, 0.50) * 1000,
+        "p99_ms": _percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def _histogram_quantile(buckets, counts, q):
+    """
+    Upper bound of the bucket holding quantile q of a Histogram series.
+    """
+    total = sum(counts)
+    cumulative = 0
+    for bound, count in zip(tuple(buckets) + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= q * total:
+            return bound
+    return float("inf")
+
+
+class StubClock:
+    """
+    Clock whose time is set by hand, to write synthetic history at any date.
+    """
+    def __init__(self, time):
+        self.time = time
+
+    def now(self):
+        return self.time
+
+
+def _seed_history(db_path, heads, days, doses_per_day, end):
+    from app.clients.sqlite_client import SQliteClient
+
+    clock = StubClock(end - timedelta(days=days))
+    client = SQliteClient(db_path=db_path, write_behind=True, journal_max_batch=500, clock=clock, heads=heads)
+    step = timedelta(days=1) / doses_per_day
+    doses = 0
+    while clock.time < end:
+        for head in heads:
+            mode = "Manual" if doses % 10 == 0 else "Scheduled"
+            client.record_dose(head, 1.0, mode, 0.714, 1.0)
+            doses += 1
+        clock.time += step
+    for head in heads:
+        client.set_remaining(head, 1000.0)
+    client.close()
+    return doses
+
+
+def _start_app(directory, **env):
+    """
+    Configure the service through its DOSER_* variables and build it. Only call once per process.
+    """
+    os.environ.update({
+        "DOSER_GPIO_BACKEND": "simulated",
+        "DOSER_DB_PATH": os.path.join(directory, "doser.db"),
+        "DOSER_RETENTION_DAYS": "0",
+    })
+    os.environ.update({key: str(value) for key, value in env.items()})
+    import app.main
+    return app.main.app
+
+
+def _client(app):
+    import httpx
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+
+def dose_write(args):
+    """
+    Per-dose storage write latency of each storage layout.
+    """
+    from bench_dose_storage import bench_single_db, bench_three_file
+
+    with tempfile.TemporaryDirectory() as directory:
+        return {
+            "three_file": _latency(bench_three_file(directory, args["doses"])),
+            "single_db": _latency(bench_single_db(directory, args["doses"])),
+            "write_behind": _latency(bench_single_db(directory, args["doses"], write_behind=True)),
+        }
+
+
+def read_polling(args):
+    """
+    Throughput and latency of the read endpoints under concurrent polling.
+    """
+    from fastapi.testclient import TestClient
+
+    async def poll(app, path):
+        samples = []
+
+        async def poller(client):
+            for _ in range(args["requests"]):
+                started = time.perf_counter()
+                response = await client.get(path)
+                samples.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        async with _client(app) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(poller(client) for _ in range(args["pollers"])))
+            elapsed = time.perf_counter() - started
+        return dict(_latency(samples), requests_per_second=len(samples) / elapsed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        _seed_history(os.path.join(directory, "doser.db"), (1, 2), 30, 12, datetime.now())
+        app = _start_app(directory)
+        with TestClient(app):
+            return {path: asyncio.run(poll(app, path)) for path in READ_ENDPOINTS}
+
+
+def dose_burst(args):
+    """
+    A burst of concurrent /dose requests: response latency, 429s and time until every accepted dose ran.
+    """
+    from fastapi.testclient import TestClient
+
+    async def burst(app):
+        async with _client(app) as client:
+            async def send(index):
+                started = time.perf_counter()
+                response = await client.post(f"/dose/{1 + index % 2}", params={"ml": 1.0})
+                return response, time.perf_counter() - started
+
+            started = time.perf_counter()
+            sent = await asyncio.gather(*(send(index) for index in range(args["burst"])))
+            statuses = {}
+            for response, _ in sent:
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            pending = {response.json()["command_id"] for response, _ in sent if response.status_code == 200}
+            outcomes = {}
+            deadline = time.perf_counter() + args["burst_timeout"]
+            while pending and time.perf_counter() < deadline:
+                for command_id in list(pending):
+                    status = (await client.get(f"/commands/{command_id}")).json()["status"]
+                    if status in TERMINAL_STATUSES:
+                        outcomes[status] = outcomes.get(status, 0) + 1
+                        pending.discard(command_id)
+                await asyncio.sleep(0.01)
+            return {
+                "requests": args["burst"],
+                "responses": statuses,
+                "latency": _latency([elapsed for _, elapsed in sent]),
+                "commands": dict(outcomes, unfinished=len(pending)),
+                "drain_seconds": time.perf_counter() - started,
+            }
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = _start_app(directory, DOSER_CLOCK_SPEED=args["burst_speed"])
+        with TestClient(app) as client:
+            client.post("/remaining/1", params={"ml": 100_000})
+            client.post("/remaining/2", params={"ml": 100_000})
+            return dict(asyncio.run(burst(app)), clock_speed=args["burst_speed"])
+
+
+def scheduler_lag(args):
+    """
+    How late scheduled doses fire with many heads on a fast virtual clock.
+    """
+    from fastapi.testclient import TestClient
+    from app.metrics import SCHEDULER_LAG
+
+    heads, speed, hours, doses_per_day = args["heads"], args["scheduler_speed"], args["scheduler_hours"], args["doses_per_day"]
+    with tempfile.TemporaryDirectory() as directory:
+        heads_path = os.path.join(directory, "heads.json")
+        with open(heads_path, "w") as f:
+            json.dump([
+                {"id": head, "pin_1": 2 * head, "pin_2": 2 * head + 1, "calibration_ml_per_second": 1.0, "current_draw_amps": 0.1}
+                for head in range(1, heads + 1)
+            ], f)
+        app = _start_app(
+            directory,
+            DOSER_HEADS_PATH=heads_path,
+            DOSER_CLOCK_SPEED=speed,
+            DOSER_POWER_BUDGET_AMPS=heads * 0.1,
+        )
+        with TestClient(app) as client:
+            client.post("/schedule/batch", json={"schedules": [
+                {"head": head, "total_dose": doses_per_day * 0.5, "doses_per_day": doses_per_day}
+                for head in range(1, heads + 1)
+            ]})
+            time.sleep(hours * 3600 / speed)
+
+        series = list(SCHEDULER_LAG.snapshot().values())
+        counts = [sum(column) for column in zip(*(counts for counts, _, _ in series))] if series else []
+        fired = sum(count for _, _, count in series)
+        total = sum(lag for _, lag, _ in series)
+        # Lag is measured on the virtual clock, so divide by the speed for real time
+        return {
+            "heads": heads,
+            "clock_speed": speed,
+            "virtual_hours": hours,
+            "doses_fired": fired,
+            "doses_expected": int(heads * doses_per_day * hours / 24),
+            "mean_ms": total / fired / speed * 1000 if fired else None,
+            "p50_ms_upper_bound": _histogram_quantile(SCHEDULER_LAG.buckets, counts, 0.50) / speed * 1000 if fired else None,
+            "p99_ms_upper_bound": _histogram_quantile(SCHEDULER_LAG.buckets, counts, 0.99) / speed * 1000 if fired else None,
+        }
+
+
+def logs_year(args):
+    """
+    /logs, /history and /forecast over a year of synthetic dose history.
+    """
+    from fastapi.testclient import TestClient
+
+    def timed_get(client, path, params=None):
+        samples = []
+        for _ in range(args["repeat"]):
+            started = time.perf_counter()
+            response = client.get(path, params=params)
+            samples.append(time.perf_counter() - started)
+            response.raise_for_status()
+        return {"median_ms": statistics.median(samples) * 1000, "bytes": len(response.content)}
+
+    def paged(client, limit):
+        started = time.perf_counter()
+        pages = 0
+        cursor = None
+        while True:
+            params = {"raw": "true", "days": 366, "limit": limit}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/logs", params=params)
+            response.raise_for_status()
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        return {"pages": pages, "page_size": limit, "total_ms": (time.perf_counter() - started) * 1000}
+
+    with tempfile.TemporaryDirectory() as directory:
+        now = datetime.now()
+        doses = _seed_history(os.path.join(directory, "doser.db"), (1, 2), 365, args["year_doses_per_day"], now)
+        app = _start_app(directory)
+        with TestClient(app) as client:
+            return {
+                "doses": doses,
+                "logs_raw_json": timed_get(client, "/logs", {"raw": "true", "days": 366}),
+                "logs_raw_ndjson": timed_get(client, "/logs", {"raw": "true", "days": 366, "format": "ndjson"}),
+                "logs_raw_csv": timed_get(client, "/logs", {"raw": "true", "days": 366, "format": "csv"}),
+                "logs_hourly_json": timed_get(client, "/logs", {"days": 366}),
+                "logs_raw_paged": paged(client, 1000),
+                "history_year": timed_get(client, "/history", {"start": (now - timedelta(days=365)).isoformat(), "end": now.isoformat()}),
+                "forecast": timed_get(client, "/forecast"),
+            }
+
+
+SCENARIOS = {
+    "dose_write": dose_write,
+    "read_polling": read_polling,
+    "dose_burst": dose_burst,
+    "scheduler_lag": scheduler_lag,
+    "logs_year": logs_year,
+}
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def _compare(previous, current):
+    before = _flatten(previous["results"])
+    for name, value in _flatten(current["results"]).items():
+        if name in before and name.endswith(("_ms", "_upper_bound", "per_second", "seconds")) and before[name]:
+            change = (value - before[name]) / before[name] * 100
+            print(f"{name:<60} {before[name]:12.3f} -> {value:12.3f}  {change:+7.1f}%")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier results file to print changes against")
+    parser.add_argument("--doses", type=int, default=500, help="dose_write: doses per storage layout")
+    parser.add_argument("--pollers", type=int, default=20, help="read_polling: concurrent clients per endpoint")
+    parser.add_argument("--requests", type=int, default=50, help="read_polling: requests per client")
+    parser.add_argument("--burst", type=int, default=50, help="dose_burst: concurrent /dose requests")
+    parser.add_argument("--burst-speed", type=float, default=50, help="dose_burst: virtual clock speed so runs finish quickly")
+    parser.add_argument("--burst-timeout", type=float, default=30, help="dose_burst: seconds to wait for accepted doses to run")
+    parser.add_argument("--heads", type=int, default=32, help="scheduler_lag: pump heads")
+    parser.add_argument("--doses-per-day", type=int, default=96, help="scheduler_lag: scheduled doses per head per day")
+    parser.add_argument("--scheduler-speed", type=float, default=600, help="scheduler_lag: virtual clock speed")
+    parser.add_argument("--scheduler-hours", type=float, default=2, help="scheduler_lag: virtual hours to run")
+    parser.add_argument("--year-doses-per-day", type=int, default=12, help="logs_year: synthetic doses per head per day")
+    parser.add_argument("--repeat", type=int, default=3, help="logs_year: requests per measurement")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios {unknown}. Must be in {list(SCENARIOS)}.")
+
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+    # Every scenario gets a fresh process: create_app() reads the environment and sets process-wide state
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        started = time.perf_counter()
+        with context.Pool(1) as pool:
+            report["results"][name] = pool.apply(SCENARIOS[name], (vars(args),))
+        print(f"{name}: done in {time.perf_counter() - started:.1f}s")
+        print(json.dumps(report["results"][name], indent=2))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
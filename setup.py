@@ -11,6 +11,10 @@ setup(
         "uvicorn",
         "RPi.GPIO",
         "apscheduler",
+        "numpy",
     ],
+    extras_require={
+        "gateway": ["httpx"],
+    },
     python_requires=">=3.7",
 )
\ No newline at end of file
@@ -0,0 +1,94 @@
+from concurrent.futures import Future
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import get_router
+from app.hardware.command_queue import CommandQueue, QueueFullError
+from app.hardware.pump import UPPER_LIMIT
+
+class ManualDispatcher:
+    """Dispatcher whose runs only finish when the test says so."""
+    def __init__(self) -> None:
+        self.runs = []
+
+    def dose(self, head: int, mode: str, ml: float) -> Future:
+        future = Future()
+        self.runs.append((head, mode, ml, future))
+        return future
+
+    def finish(self, error: Exception = None) -> None:
+        future = self.runs[-1][3]
+        if error is None:
+            future.set_result(0.0)
+        else:
+            future.set_exception(error)
+
+def test_waiting_commands_merge_up_to_the_upper_limit():
+    dispatcher = ManualDispatcher()
+    queue = CommandQueue(dispatcher, max_depth=5)
+    first = queue.submit(1, "Manual", 1.0)
+    waiting = [queue.submit(1, "Manual", UPPER_LIMIT * 0.4) for _ in range(3)]
+
+    dispatcher.finish()
+    # Two of them fit in one run, the third would go over the limit and runs next
+    assert [run[:3] for run in dispatcher.runs] == [(1, "Manual", 1.0), (1, "Manual", UPPER_LIMIT * 0.8)]
+    assert first.status == "done"
+    assert [command.status for command in waiting] == ["running", "running", "queued"]
+    assert waiting[0].coalesced_with == [waiting[1].id]
+
+    dispatcher.finish()
+    assert dispatcher.runs[-1][:3] == (1, "Manual", UPPER_LIMIT * 0.4)
+    dispatcher.finish()
+    assert [command.status for command in waiting] == ["done", "done", "done"]
+    assert queue.depth(1) == 0
+
+def test_commands_with_another_mode_are_not_merged():
+    dispatcher = ManualDispatcher()
+    queue = CommandQueue(dispatcher)
+    queue.submit(1, "Manual", 1.0)
+    queue.submit(1, "Manual", 1.0)
+    queue.submit(1, "Primer", 1.0)
+    dispatcher.finish()
+    assert dispatcher.runs[-1][:3] == (1, "Manual", 1.0)
+
+def test_submit_beyond_max_depth_raises_queue_full():
+    queue = CommandQueue(ManualDispatcher(), max_depth=2)
+    queue.submit(1, "Manual", 1.0)
+    queue.submit(1, "Manual", 1.0)
+    queue.submit(1, "Manual", 1.0)
+    with pytest.raises(QueueFullError) as error:
+        queue.submit(1, "Manual", 1.0)
+    assert error.value.depth == 2
+    # Scheduled doses are never turned away and other heads have their own bound
+    queue.submit(1, "Scheduled", 1.0, enforce_limit=False)
+    queue.submit(2, "Manual", 1.0)
+
+def test_full_queue_is_a_429_on_dose_and_a_rejected_item_in_dose_batch():
+    queue = CommandQueue(ManualDispatcher(), max_depth=1)
+    app = FastAPI()
+    app.include_router(get_router(queue, None, None, None, None, None, None))
+    client = TestClient(app)
+
+    assert client.post("/dose/1", params={"ml": 1.0}).status_code == 200
+    assert client.post("/dose/1", params={"ml": 1.0}).status_code == 200
+    response = client.post("/dose/1", params={"ml": 1.0})
+    assert response.status_code == 429
+    assert response.json()["detail"]["queue_depth"] == 1
+
+    response = client.post("/dose/batch", json={"doses": [{"head": 1, "ml": 1.0}, {"head": 2, "ml": 1.0}]})
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["rejected", "queued"]
+
+def test_failed_run_fails_every_merged_command():
+    dispatcher = ManualDispatcher()
+    queue = CommandQueue(dispatcher)
+    queue.submit(1, "Manual", 1.0)
+    merged = [queue.submit(1, "Manual", 2.0), queue.submit(1, "Manual", 3.0)]
+    dispatcher.finish()
+    assert dispatcher.runs[-1][2] == 5.0
+
+    dispatcher.finish(RuntimeError("pump stalled"))
+    assert [(command.status, command.error) for command in merged] == [("failed", "pump stalled")] * 2
+    assert queue.depth(1) == 0
@@ -0,0 +1,49 @@
+import os
+import threading
+from concurrent.futures import Future
+
+from app.clients.sqlite_client import SQliteClient
+from app.hardware.clock import Clock
+from app.hardware.dispatcher import PowerDispatcher
+from app.hardware.gpio import SimulatedGPIO
+from app.hardware.pump import Pump
+
+class FinishedPump:
+    """Pump whose runs are already over by the time dose() returns."""
+    def __init__(self) -> None:
+        self.clock = Clock()
+
+    def dose(self, head_id: int, mode: str, ml: float) -> Future:
+        future = Future()
+        future.set_result(0.0)
+        return future
+
+def run_in_thread(target, timeout: float) -> bool:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+def test_run_that_finishes_before_dose_returns_does_not_deadlock():
+    dispatcher = PowerDispatcher(FinishedPump(), budget_amps=1.0)
+    results = []
+    assert run_in_thread(lambda: results.append(dispatcher.dose(1, "Manual", 1.0).result()), timeout=5)
+    assert results == [0.0]
+    assert dispatcher.stats()["active_heads"] == []
+
+def test_short_runs_on_accelerated_clock_do_not_deadlock(tmp_path):
+    clock = Clock(speed=1e7)
+    sqlite_client = SQliteClient(db_path=os.path.join(tmp_path, "doser.db"), write_behind=True, clock=clock)
+    pump = Pump(sqlite_client, SimulatedGPIO(clock, max_transitions=None), clock)
+    dispatcher = PowerDispatcher(pump, budget_amps=1.0)
+
+    def dose_repeatedly():
+        for _ in range(5000):
+            dispatcher.dose(1, "Manual", 0.001).result()
+
+    try:
+        assert run_in_thread(dose_repeatedly, timeout=60)
+        assert dispatcher.stats()["runs"] == 5000
+    finally:
+        pump.shutdown()
+        sqlite_client.close()
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+from datetime import datetime
+
+from app.clients.dose_journal import DoseEntry, DoseJournal
+from app.clients.sqlite_client import SQliteClient
+
+def test_batch_retried_after_remaining_write_fails_is_logged_once(tmp_path, monkeypatch):
+    client = SQliteClient(
+        logs_path=os.path.join(tmp_path, "logs.db"),
+        schedules_path=os.path.join(tmp_path, "schedules.db"),
+        remaining_path=os.path.join(tmp_path, "remaining.db"),
+        write_behind=True,
+        journal_max_delay=3600
+    )
+    try:
+        client.set_remaining(1, 100.0)
+        client.record_dose(1, 2.0, "Manual")
+        client.record_dose(1, 3.0, "Manual")
+
+        update_remaining = client._update_remaining
+        calls = []
+        def fail_once(cur, dosed):
+            calls.append(dosed)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            update_remaining(cur, dosed)
+        monkeypatch.setattr(client, "_update_remaining", fail_once)
+
+        assert client.journal.flush() == 2
+        assert client.journal.backlog() == 0
+    finally:
+        client.close()
+
+    with sqlite3.connect(os.path.join(tmp_path, "logs.db")) as conn:
+        assert conn.execute(f"SELECT COUNT(*), SUM(ml) FROM {SQliteClient.RAW_LOGS_TABLE_NAME}").fetchone() == (2, 5.0)
+        assert conn.execute(f"SELECT SUM(ml) FROM {SQliteClient.LOGS_TABLE_NAME}").fetchone() == (5.0,)
+    with sqlite3.connect(os.path.join(tmp_path, "remaining.db")) as conn:
+        assert conn.execute(f"SELECT remaining FROM {SQliteClient.REMAINING_TABLE_NAME} WHERE head = 1").fetchone() == (95.0,)
+
+def test_entry_that_keeps_failing_is_dropped_without_blocking_the_rest():
+    written = []
+    def flush_fn(batch):
+        if any(entry.id == "bad" for entry in batch):
+            raise ValueError("bad entry")
+        written.extend(entry.id for entry in batch)
+
+    journal = DoseJournal(flush_fn, max_attempts=3)
+    for id in ("a", "bad", "b"):
+        journal.append(DoseEntry(id, 1, 1.0, "Manual", datetime(2024, 1, 1)))
+
+    assert journal.flush() == 1
+    assert journal.flush() == 0
+    assert journal.flush() == 1
+    assert journal.flush() == 0
+    assert written == ["a", "b"]
+    assert journal.backlog() == 0
+
+def test_set_remaining_is_not_reduced_by_doses_from_before_it(tmp_path):
+    client = SQliteClient(db_path=os.path.join(tmp_path, "doser.db"), write_behind=True, journal_max_delay=3600)
+    try:
+        client.set_remaining(1, 100.0)
+        client.record_dose(1, 2.0, "Manual")
+        assert client.journal.backlog() == 1
+
+        client.set_remaining(1, 500.0)
+        client.flush()
+        assert client.get_remaining()[1] == 500.0
+    finally:
+        client.close()
+
+    with sqlite3.connect(os.path.join(tmp_path, "doser.db")) as conn:
+        assert conn.execute(f"SELECT remaining FROM {SQliteClient.REMAINING_TABLE_NAME} WHERE head = 1").fetchone() == (500.0,)
+
+def test_cache_matches_the_database_after_an_entry_is_dropped(tmp_path):
+    client = SQliteClient(db_path=os.path.join(tmp_path, "doser.db"), write_behind=True, journal_max_delay=3600)
+    try:
+        client.set_remaining(1, 100.0)
+        client.record_dose(1, 2.0, "Manual")
+        client.record_dose(1, 3.0, "Manual")
+        assert client.get_remaining()[1] == 95.0
+        assert client.get_todays_total()["head1"]["today_total"] == 5.0
+
+        write_doses = client.journal.flush_fn
+        def reject_three(batch):
+            if any(entry.ml == 3.0 for entry in batch):
+                raise sqlite3.IntegrityError("bad entry")
+            write_doses(batch)
+        client.journal.flush_fn = reject_three
+        client.journal.max_attempts = 1
+
+        assert client.journal.flush() == 1
+        assert client.journal.backlog() == 0
+
+        with sqlite3.connect(os.path.join(tmp_path, "doser.db")) as conn:
+            remaining, = conn.execute(f"SELECT remaining FROM {SQliteClient.REMAINING_TABLE_NAME} WHERE head = 1").fetchone()
+            logged, = conn.execute(f"SELECT SUM(ml) FROM {SQliteClient.LOGS_TABLE_NAME} WHERE head = 1").fetchone()
+        assert client.get_remaining()[1] == remaining == 98.0
+        assert client.get_todays_total()["head1"]["today_total"] == logged == 2.0
+    finally:
+        client.close()
@@ -0,0 +1,76 @@
+import asyncio
+import importlib
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.clients.sqlite_client import SQliteClient
+from app.gateway.fleet import FleetGateway
+
+def create_node(directory: str, monkeypatch, doses: list) -> FastAPI:
+    os.makedirs(directory)
+    db_path = os.path.join(directory, "doser.db")
+    client = SQliteClient(db_path=db_path)
+    for head, ml in doses:
+        client.record_dose(head, ml, "Manual")
+    client.close()
+
+    monkeypatch.setenv("DOSER_STORAGE_MODE", "single")
+    monkeypatch.setenv("DOSER_DB_PATH", db_path)
+    monkeypatch.setenv("DOSER_GPIO_BACKEND", "simulated")
+    monkeypatch.setenv("DOSER_WRITE_BEHIND", "false")
+    main = importlib.import_module("app.main")
+    return main.create_app()
+
+@pytest.fixture
+def gateway(tmp_path, monkeypatch):
+    tank1 = create_node(tmp_path / "tank1", monkeypatch, [(1, 1.5), (2, 2.0)])
+    tank2 = create_node(tmp_path / "tank2", monkeypatch, [(1, 3.0)])
+    garbage = FastAPI()
+    garbage.get("/logs")(lambda: {"not": "a list"})
+    garbage.get("/heads")(lambda: {"1": {}})
+
+    return FleetGateway(
+        {
+            "tank1": "http://tank1",
+            "tank2": "http://tank2",
+            "garbage": "http://garbage",
+            # Nothing listens on the discard port, the connection is refused
+            "down": "http://127.0.0.1:9",
+        },
+        timeout=2.0,
+        mounts={
+            "http://tank1": httpx.ASGITransport(app=tank1),
+            "http://tank2": httpx.ASGITransport(app=tank2),
+            "http://garbage": httpx.ASGITransport(app=garbage),
+        }
+    )
+
+def test_heads_of_every_node_with_the_unreachable_one_marked_down(gateway):
+    async def fetch():
+        async with gateway:
+            return await gateway.fan_out("/heads")
+    result = asyncio.run(fetch())
+
+    assert result["failed"] == ["down"]
+    for name in ("tank1", "tank2"):
+        node = result["nodes"][name]
+        assert node["ok"]
+        assert set(node["data"]) == {"1", "2"}
+    assert not result["nodes"]["down"]["ok"]
+    assert "data" not in result["nodes"]["down"]
+
+def test_logs_are_merged_and_a_node_with_a_bad_response_is_only_marked_failed(gateway):
+    async def fetch():
+        async with gateway:
+            return await gateway.logs(raw="true", days=7)
+    result = asyncio.run(fetch())
+
+    assert sorted(result["failed"]) == ["down", "garbage"]
+    assert sorted((row["node"], row["head"], row["ml"]) for row in result["logs"]) == [
+        ("tank1", 1, 1.5), ("tank1", 2, 2.0), ("tank2", 1, 3.0)
+    ]
+    assert "Unexpected /logs response" in result["nodes"]["garbage"]["error"]
+    assert result["nodes"]["tank1"]["ok"] and result["nodes"]["tank2"]["ok"]
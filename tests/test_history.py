@@ -0,0 +1,57 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.clients.sqlite_client import SQliteClient
+
+class StubClock:
+    def __init__(self, time: datetime) -> None:
+        self.time = time
+
+    def now(self) -> datetime:
+        return self.time
+
+@pytest.fixture
+def sqlite_client(tmp_path):
+    clock = StubClock(datetime(2024, 1, 1, 8, 0))
+    client = SQliteClient(db_path=os.path.join(tmp_path, "doser.db"), clock=clock)
+    for i in range(12):
+        clock.time = datetime(2024, 1, 1, 8, 0) + timedelta(minutes=25 * i)
+        client.record_dose(1 + i % 2, 1.0 + i, "Manual" if i % 3 else "Scheduled")
+    yield client
+    client.close()
+
+def test_hourly_history_is_read_from_the_hourly_logs(sqlite_client):
+    history = sqlite_client.fetch_history("hourly", datetime(2024, 1, 1, 9, 30), datetime(2024, 1, 1, 11, 59))
+    with sqlite3.connect(sqlite_client.db_path) as conn:
+        logged = conn.execute(
+            "SELECT date || 'T' || hour, head, ml FROM logs WHERE hour BETWEEN '09:00' AND '11:00' ORDER BY date, hour, head"
+        ).fetchall()
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'rollup_hourly'").fetchone() is None
+    assert [(row["bucket"], row["head"], row["ml"]) for row in history] == logged
+    assert sum(row["ml"] for row in sqlite_client.fetch_history("hourly", datetime(2024, 1, 1), datetime(2024, 1, 2))) == (
+        sum(row["ml"] for row in sqlite_client.fetch_history("daily", datetime(2024, 1, 1), datetime(2024, 1, 2)))
+    )
+
+def test_mode_filter_needs_daily_resolution(sqlite_client):
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 1, 23)
+    assert sqlite_client.history_resolution(start, end) == "hourly"
+    assert sqlite_client.history_resolution(start, end, mode="Manual") == "daily"
+    with pytest.raises(ValueError):
+        sqlite_client.fetch_history("hourly", start, end, mode="Manual")
+    daily = sqlite_client.fetch_history("daily", start, end, mode="Scheduled")
+    assert [(row["head"], row["ml"], row["doses"]) for row in daily] == [(1, 1.0 + 7.0, 2), (2, 4.0 + 10.0, 2)]
+
+def test_upgrade_drops_the_hourly_rollup(tmp_path):
+    db_path = os.path.join(tmp_path, "doser.db")
+    SQliteClient(db_path=db_path).close()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE rollup_hourly (bucket TEXT, head INTEGER, mode TEXT, ml REAL, doses INTEGER)")
+        conn.execute("PRAGMA user_version = 5")
+
+    SQliteClient(db_path=db_path).close()
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'rollup_hourly'").fetchone() is None
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SQliteClient.SCHEMA_VERSION
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.clients.sqlite_client import SQliteClient
+
+class StubClock:
+    def __init__(self, time: datetime) -> None:
+        self.time = time
+
+    def now(self) -> datetime:
+        return self.time
+
+@pytest.fixture
+def sqlite_client(tmp_path):
+    clock = StubClock(datetime(2024, 1, 1, 8, 0))
+    client = SQliteClient(db_path=os.path.join(tmp_path, "doser.db"), clock=clock)
+    # Several doses per hour on both heads, over a few hours
+    for i in range(23):
+        clock.time = datetime(2024, 1, 1, 8, 0) + timedelta(minutes=17 * i)
+        client.record_dose(1 + i % 2, 0.5 + i, "Manual")
+    clock.time = datetime(2024, 1, 2, 12, 0)
+    yield client
+    client.close()
+
+def read_all(client: SQliteClient, table_name: str, **kwargs) -> list:
+    _, batches, next_key = client.stream_logs(table_name, **kwargs)
+    return [tuple(row) for batch in batches for row in batch], next_key
+
+def read_pages(client: SQliteClient, table_name: str, limit: int) -> list:
+    rows, cursor = [], None
+    while True:
+        after = client.decode_cursor(cursor, table_name) if cursor else None
+        page, next_key = read_all(client, table_name, after=after, limit=limit)
+        assert len(page) <= limit
+        rows.extend(page)
+        if next_key is None:
+            return rows
+        cursor = client.encode_cursor(table_name, next_key)
+
+@pytest.mark.parametrize("table_name", [SQliteClient.RAW_LOGS_TABLE_NAME, SQliteClient.LOGS_TABLE_NAME])
+@pytest.mark.parametrize("limit", [1, 3, 4])
+def test_pages_add_up_to_the_full_result(sqlite_client, table_name, limit):
+    full, _ = read_all(sqlite_client, table_name)
+    assert len(full) > limit
+    pages = read_pages(sqlite_client, table_name, limit)
+    assert pages == full
+    assert len(set(pages)) == len(pages)
+
+def test_cursor_is_rejected_on_the_other_log_table(sqlite_client):
+    for issued, used in (
+        (SQliteClient.RAW_LOGS_TABLE_NAME, SQliteClient.LOGS_TABLE_NAME),
+        (SQliteClient.LOGS_TABLE_NAME, SQliteClient.RAW_LOGS_TABLE_NAME),
+    ):
+        _, _, next_key = sqlite_client.stream_logs(issued, limit=2)
+        cursor = sqlite_client.encode_cursor(issued, next_key)
+        with pytest.raises(ValueError, match="does not match"):
+            sqlite_client.decode_cursor(cursor, used)
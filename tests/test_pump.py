@@ -0,0 +1,34 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import get_router
+from app.hardware.pump import PUMP_HEADS, PumpHead, fit_calibration
+
+@pytest.mark.parametrize("start_latency, stop_latency", [(0.25, 0.0), (0.0, 0.1)])
+def test_fit_recovers_rate_and_net_latency(start_latency, stop_latency):
+    head = PumpHead(17, 22, 1.4, start_latency_seconds=start_latency, stop_latency_seconds=stop_latency)
+    runs = [(seconds, head.flow_ml(seconds)) for seconds in (1.0, 4.0, 10.0)]
+    fitted = fit_calibration(runs)
+    assert fitted["calibration_ml_per_second"] == pytest.approx(1.4)
+    assert fitted["start_latency_seconds"] == pytest.approx(start_latency)
+    assert fitted["stop_latency_seconds"] == pytest.approx(stop_latency)
+
+def test_fit_needs_runs_of_different_lengths():
+    with pytest.raises(ValueError):
+        fit_calibration([(2.0, 2.5), (2.0, 2.7)])
+
+def test_calibration_endpoint_applies_the_fit(monkeypatch):
+    monkeypatch.setitem(PUMP_HEADS, 1, PUMP_HEADS[1])
+    app = FastAPI()
+    app.include_router(get_router(None, None, None, None, None, None, None))
+    client = TestClient(app)
+
+    # Liquid starts flowing 0.2s after the pins switch on
+    response = client.post("/heads/1/calibration", json={"runs": [{"seconds": 2.2, "ml": 3.0}, {"seconds": 8.2, "ml": 12.0}]})
+    assert response.status_code == 200
+    assert PUMP_HEADS[1].calibration_ml_per_second == pytest.approx(1.5)
+    assert PUMP_HEADS[1].start_latency_seconds == pytest.approx(0.2)
+    assert PUMP_HEADS[1].on_seconds(3.0) == pytest.approx(2.2)
+
+    assert client.post("/heads/1/calibration", json={"runs": [{"seconds": 2.0, "ml": 3.0}]}).status_code == 400
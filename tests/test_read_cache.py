@@ -0,0 +1,56 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.clients.sqlite_client import SQliteClient
+from app.hardware.clock import Clock
+
+def logged_today(client: SQliteClient) -> dict:
+    with sqlite3.connect(client.db_path) as conn:
+        rows = conn.execute(
+            f"SELECT head, SUM(ml) FROM {SQliteClient.LOGS_TABLE_NAME} WHERE date = ? GROUP BY head",
+            (client.clock.now().date().isoformat(),)
+        ).fetchall()
+    totals = dict.fromkeys(client.heads, 0.0)
+    totals.update(rows)
+    return totals
+
+def cached_today(client: SQliteClient) -> dict:
+    return {head: client.get_todays_total()[f"head{head}"]["today_total"] for head in client.heads}
+
+def check(client: SQliteClient) -> None:
+    # Read once with doses possibly still in the journal, then again once they are on disk
+    before_flush = cached_today(client)
+    client.flush()
+    assert before_flush == pytest.approx(logged_today(client))
+    assert cached_today(client) == pytest.approx(logged_today(client))
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_todays_totals_match_the_logs_on_both_sides_of_midnight(tmp_path, write_behind):
+    # 60x: the minute to midnight passes in one real second
+    clock = Clock(speed=60, start=datetime(2024, 1, 1, 23, 59))
+    client = SQliteClient(
+        db_path=os.path.join(tmp_path, "doser.db"), write_behind=write_behind, journal_max_delay=3600, clock=clock
+    )
+    try:
+        check(client)
+        client.record_dose(1, 1.5, "Manual")
+        client.record_dose(2, 2.0, "Scheduled")
+        assert clock.now().date() == datetime(2024, 1, 1).date()
+        check(client)
+        assert cached_today(client) == {1: 1.5, 2: 2.0}
+
+        clock.sleep((datetime(2024, 1, 2) - clock.now()).total_seconds() + 1)
+        assert clock.now() < datetime(2024, 1, 2) + timedelta(minutes=1)
+        # First read after midnight reloads instead of carrying yesterday's totals over
+        check(client)
+        assert cached_today(client) == {1: 0.0, 2: 0.0}
+
+        client.record_dose(1, 3.0, "Manual")
+        client.record_dose(1, 0.5, "Manual")
+        check(client)
+        assert cached_today(client) == {1: 3.5, 2: 0.0}
+    finally:
+        client.close()
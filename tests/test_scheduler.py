@@ -0,0 +1,100 @@
+import os
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.clients.sqlite_client import SQliteClient
+from app.hardware.clock import Clock
+from app.scheduler.jobs import SchedulerManager
+
+# Head 1 doses 1mL at 00:00, 06:00, 12:00 and 18:00
+SCHEDULE = {1: {"total_dose": 4.0, "doses_per_day": 4, "window_start": None, "window_end": None}}
+
+class RecordingQueue:
+    def __init__(self) -> None:
+        self.submitted = []
+
+    def submit(self, head: int, mode: str, ml: float, enforce_limit: bool = True) -> Future:
+        self.submitted.append((head, mode, ml))
+        future = Future()
+        future.set_result(0.0)
+        return future
+
+@pytest.fixture
+def sqlite_client(tmp_path):
+    client = SQliteClient(db_path=os.path.join(tmp_path, "doser.db"))
+    client.update_schedules(SCHEDULE)
+    yield client
+    client.close()
+
+def start_manager(sqlite_client, policy: str, now: datetime, next_due: datetime, **kwargs):
+    # Down since next_due: the doses from there up to now were missed
+    sqlite_client.update_scheduler_states({1: (None, next_due)})
+    queue = RecordingQueue()
+    manager = SchedulerManager(queue, sqlite_client, Clock(start=now), catch_up_policy=policy, **kwargs)
+    return manager, queue
+
+def test_skip_policy_drops_doses_missed_while_down(sqlite_client):
+    manager, queue = start_manager(sqlite_client, "skip", datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 0, 0))
+    try:
+        assert manager.startup["missed"][1]["doses"] == 2
+        assert manager.startup["caught_up_ml"] == {}
+        assert queue.submitted == []
+    finally:
+        manager.shutdown()
+
+def test_merge_policy_doses_missed_volume_at_once(sqlite_client):
+    manager, queue = start_manager(sqlite_client, "merge", datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 0, 0))
+    try:
+        assert manager.startup["caught_up_ml"] == {1: 2.0}
+        assert queue.submitted == [(1, "Scheduled", 2.0)]
+    finally:
+        manager.shutdown()
+
+def test_spread_policy_adds_missed_volume_to_the_next_days_doses(sqlite_client):
+    manager, queue = start_manager(sqlite_client, "spread", datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 0, 0))
+    try:
+        assert queue.submitted == []
+        # 12:00, 18:00, 00:00 and 06:00 each carry a quarter of the 2mL missed
+        for event in manager.timeline.upcoming(4):
+            manager._run_scheduled_dose(event)
+        assert queue.submitted == [(1, "Scheduled", 1.5)] * 4
+        manager._run_scheduled_dose(manager.timeline.upcoming()[4])
+        assert queue.submitted[-1] == (1, "Scheduled", 1.0)
+    finally:
+        manager.shutdown()
+
+def test_spread_keeps_the_remainder_of_an_earlier_catch_up(sqlite_client):
+    manager, queue = start_manager(sqlite_client, "spread", datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 0, 0))
+    try:
+        upcoming = manager.timeline.upcoming(4)
+        manager._run_scheduled_dose(upcoming[0])
+        # 1.5mL of the first catch-up is still to spread when 2mL more come in late
+        manager._run_late_doses(upcoming[1:3])
+        for event in manager.timeline.upcoming()[1:5]:
+            manager._run_scheduled_dose(event)
+        extra = sum(ml for _, _, ml in queue.submitted) - 5 * 1.0
+        assert extra == pytest.approx(2.0 + 2.0)
+    finally:
+        manager.shutdown()
+
+def test_dose_found_past_grace_window_goes_through_the_catch_up_policy(sqlite_client):
+    manager, queue = start_manager(
+        sqlite_client, "merge", datetime(2024, 1, 2, 11, 59, 58), datetime(2024, 1, 2, 12, 0), grace_seconds=1.0
+    )
+    try:
+        assert queue.submitted == []
+        # The wall clock jumps past 12:00 by an hour, as after a suspend
+        with manager.timeline._condition:
+            manager.clock._start += timedelta(hours=1)
+            manager.timeline._condition.notify()
+        deadline = time.monotonic() + 5
+        while not queue.submitted and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert queue.submitted == [(1, "Scheduled", 1.0)]
+        _, state = sqlite_client.fetch_schedules_with_state()
+        assert state[1]["last_fired"] == datetime(2024, 1, 2, 12, 0)
+    finally:
+        manager.shutdown()
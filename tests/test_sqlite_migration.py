@@ -0,0 +1,136 @@
+import os
+import sqlite3
+
+from app.clients.sqlite_client import SQliteClient
+
+def create_baseline_logs(path: str) -> None:
+    # Layout written before the single-database mode and per-head log rows existed
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE raw_logs (
+                id TEXT PRIMARY KEY,
+                date TEXT,
+                head INTEGER,
+                time TEXT,
+                ml REAL,
+                mode TEXT CHECK(mode IN ('Manual', 'Scheduled', 'Primer'))
+            );
+            CREATE TABLE logs (
+                date TEXT NOT NULL,
+                hour TEXT NOT NULL,
+                head1 REAL DEFAULT NULL,
+                head2 REAL DEFAULT NULL,
+                PRIMARY KEY (date, hour)
+            );
+            INSERT INTO raw_logs VALUES ('a', '2024-01-01', 1, '2024-01-01T08:15:00', 1.5, 'Scheduled');
+            INSERT INTO raw_logs VALUES ('b', '2024-01-01', 2, '2024-01-01T08:30:00', 2.0, 'Manual');
+            INSERT INTO raw_logs VALUES ('c', '2024-01-02', 1, '2024-01-02T09:00:00', 1.5, 'Scheduled');
+            INSERT INTO logs VALUES ('2024-01-01', '08:00', 1.5, 2.0);
+            INSERT INTO logs VALUES ('2024-01-02', '09:00', 1.5, NULL);
+            """
+        )
+
+def create_baseline_files(directory: str) -> tuple:
+    paths = tuple(os.path.join(directory, name) for name in ("logs.db", "schedules.db", "remaining.db"))
+    create_baseline_logs(paths[0])
+    with sqlite3.connect(paths[1]) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE schedules (head INTEGER PRIMARY KEY, total_dose REAL, doses_per_day INTEGER);
+            INSERT INTO schedules VALUES (1, 6.0, 4);
+            INSERT INTO schedules VALUES (2, NULL, NULL);
+            """
+        )
+    with sqlite3.connect(paths[2]) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE remaining (head INTEGER PRIMARY KEY, remaining REAL);
+            INSERT INTO remaining VALUES (1, 480.5);
+            INSERT INTO remaining VALUES (2, 250.0);
+            """
+        )
+    return paths
+
+def hourly_totals(path: str) -> dict:
+    with sqlite3.connect(path) as conn:
+        return {
+            (date, hour, head): ml
+            for date, hour, head, ml in conn.execute("SELECT date, hour, head, ml FROM logs")
+        }
+
+def open_single(directory: str, paths: tuple) -> SQliteClient:
+    logs_path, schedules_path, remaining_path = paths
+    return SQliteClient(
+        logs_path=logs_path,
+        schedules_path=schedules_path,
+        remaining_path=remaining_path,
+        db_path=os.path.join(directory, "doser.db")
+    )
+
+EXPECTED_HOURLY = {
+    ("2024-01-01", "08:00", 1): 1.5,
+    ("2024-01-01", "08:00", 2): 2.0,
+    ("2024-01-02", "09:00", 1): 1.5,
+}
+
+def test_three_file_install_is_migrated_into_one_database(tmp_path):
+    paths = create_baseline_files(tmp_path)
+    client = open_single(tmp_path, paths)
+    try:
+        assert client.get_remaining() == {1: 480.5, 2: 250.0}
+        schedules = client.fetch_all_schedules()
+        assert (schedules[1]["total_dose"], schedules[1]["doses_per_day"]) == (6.0, 4)
+        assert schedules[2]["total_dose"] is None
+    finally:
+        client.close()
+
+    db_path = os.path.join(tmp_path, "doser.db")
+    assert hourly_totals(db_path) == EXPECTED_HOURLY
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SQliteClient.SCHEMA_VERSION
+        assert conn.execute("SELECT COUNT(*), SUM(ml) FROM raw_logs").fetchone() == (3, 5.0)
+        assert conn.execute("SELECT bucket, head, ml FROM rollup_daily ORDER BY bucket, head").fetchall() == [
+            ("2024-01-01", 1, 1.5), ("2024-01-01", 2, 2.0), ("2024-01-02", 1, 1.5)
+        ]
+    for path in paths:
+        assert not os.path.exists(path)
+        assert os.path.exists(f"{path}.migrated")
+
+def test_second_open_of_a_migrated_database_changes_nothing(tmp_path):
+    paths = create_baseline_files(tmp_path)
+    open_single(tmp_path, paths).close()
+    db_path = os.path.join(tmp_path, "doser.db")
+    with sqlite3.connect(db_path) as conn:
+        before = {
+            table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall())
+            for table in ("raw_logs", "logs", "schedules", "remaining", "rollup_daily")
+        }
+
+    client = open_single(tmp_path, paths)
+    try:
+        assert client.get_remaining() == {1: 480.5, 2: 250.0}
+    finally:
+        client.close()
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SQliteClient.SCHEMA_VERSION
+        for table, rows in before.items():
+            assert sorted(conn.execute(f"SELECT * FROM {table}").fetchall()) == rows
+    for path in paths:
+        assert not os.path.exists(path)
+        assert not os.path.exists(f"{path}.migrated.migrated")
+
+def test_wide_logs_table_is_unpivoted_with_the_same_per_head_totals(tmp_path):
+    db_path = os.path.join(tmp_path, "doser.db")
+    create_baseline_logs(db_path)
+    with sqlite3.connect(db_path) as conn:
+        wide = dict(conn.execute("SELECT 1, SUM(head1) FROM logs UNION ALL SELECT 2, SUM(head2) FROM logs").fetchall())
+
+    SQliteClient(db_path=db_path).close()
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SQliteClient.SCHEMA_VERSION
+        assert dict(conn.execute("SELECT head, SUM(ml) FROM logs GROUP BY head").fetchall()) == wide
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'logs_wide'").fetchone() is None
+    assert hourly_totals(db_path) == EXPECTED_HOURLY
@@ -0,0 +1,37 @@
+import time
+from datetime import datetime
+
+from app.hardware.clock import Clock
+from app.scheduler.timeline import TimelineDispatcher, compile_timeline
+
+def test_rebuild_does_not_refire_a_dose_the_stagger_moves_later():
+    clock = Clock(speed=100, start=datetime(2024, 1, 1, 11, 59, 50))
+    schedules = {2: {"total_dose": 2.0, "doses_per_day": 2}}
+    fired = []
+    timeline = TimelineDispatcher(
+        clock,
+        lambda day: compile_timeline(schedules, day, stagger_seconds=30),
+        lambda event: fired.append(event.head)
+    )
+    timeline.start()
+    try:
+        deadline = time.monotonic() + 5
+        while 2 not in fired and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert fired == [2]
+
+        # Head 1 now shares 12:00 with head 2, whose dose moves to 12:00:30
+        schedules[1] = {"total_dose": 2.0, "doses_per_day": 2}
+        timeline.rebuild()
+        assert all(event.at.date() > clock.now().date() for event in timeline.upcoming() if event.head == 2)
+        time.sleep(clock.to_real(60))
+    finally:
+        timeline.stop()
+    assert fired.count(2) == 1
+    assert timeline.next_for(2) == datetime(2024, 1, 2, 0, 0, 30)
+
+def test_every_head_of_a_large_fleet_gets_its_own_time():
+    schedules = {head: {"total_dose": 4.0, "doses_per_day": 1 + head % 4} for head in range(1, 33)}
+    events = compile_timeline(schedules, datetime(2024, 1, 1).date(), stagger_seconds=30)
+    assert len(events) == sum(schedule["doses_per_day"] for schedule in schedules.values())
+    assert len({event.at for event in events}) == len(events)